@@ -0,0 +1,197 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Helpers for caching data downloaded from Quandl on the local disk."""
+import glob
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from helpers.file_system import ensure_dir
+
+# The cache directory and offline mode can also be set by these variables
+CACHE_DIR_VARIABLE = 'QUANDL_CACHE_DIR'
+OFFLINE_VARIABLE = 'QUANDL_OFFLINE'
+DEFAULT_CACHE_DIR = '../data/quandl_cache'
+
+
+def get_cache_dir(cache_dir=None):
+    """ Returns the cache directory (cache_dir, QUANDL_CACHE_DIR or the
+        default ../data/quandl_cache). """
+    if cache_dir:
+        return cache_dir
+    return os.environ.get(CACHE_DIR_VARIABLE, DEFAULT_CACHE_DIR)
+
+
+def is_offline(offline=None):
+    """ Returns offline if given, otherwise if QUANDL_OFFLINE is set to 1. """
+    if offline is not None:
+        return bool(offline)
+    return os.environ.get(OFFLINE_VARIABLE, '0') in ('1', 'true', 'True')
+
+
+def get_cache_key(handle, start_date, end_date, variable):
+    """ Returns the key (SHA-1 of the request) of a series in the cache. """
+    request = '|'.join((str(handle), str(start_date), str(end_date), str(variable)))
+    return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
+
+def get_series(handle, start_date, end_date, variable, api_key=None,
+               cache_dir=None, ttl=None, offline=None, refresh=False,
+               fetcher=None):
+    """ Returns a series from the cache or downloads it from Quandl.
+
+        The series (and its log-returns in percent) is read from the cache if
+        it is present and not older than ttl seconds. Otherwise, it is
+        downloaded using the fetcher and written to the cache as a compressed
+        npz-file named by the key of the request, see get_cache_key. In the
+        offline mode, the network is never used and cached series are
+        returned regardless of their age.
+
+        Args:
+            handle: name at Quandl. (string)
+            start_date: date to start extraction from (YYYY-MM-DD).
+            end_date: date to end extraction at (YYYY-MM-DD).
+            variable: name of column to use for computations.
+            api_key: the Quandl API key. (string)
+            cache_dir: directory of the cache, see get_cache_dir.
+            ttl: maximum age of cached series in seconds. (None: no limit)
+            offline: never download data, see is_offline. (boolean)
+            refresh: download the series even if it is in the cache.
+                     (boolean)
+            fetcher: function (handle, start_date, end_date, api_key)
+                     returning a pandas data frame indexed by date. The
+                     default is fetch_quandl, see also csv_fetcher.
+
+        Returns:
+            A dict with the dates, values and log_returns (arrays) and the
+            time when the series was fetched.
+
+    """
+    cache_dir = get_cache_dir(cache_dir)
+    offline = is_offline(offline)
+    key = get_cache_key(handle, start_date, end_date, variable)
+    file_name = os.path.join(cache_dir, key + '.npz')
+
+    if os.path.exists(file_name) and (offline or not refresh):
+        series = load_series(file_name)
+        age = time.time() - series['fetched_at']
+        if offline or ttl is None or age <= ttl:
+            print("Loaded " + handle + " (" + variable + ") from cache: " + file_name + ".")
+            return series
+
+    if offline:
+        raise ValueError("Series " + handle + " (" + variable + ") from " +
+                         str(start_date) + " to " + str(end_date) +
+                         " is not in the cache " + cache_dir +
+                         " and downloads are disabled (offline mode).")
+
+    if fetcher is None:
+        fetcher = fetch_quandl
+    data = fetcher(handle, start_date, end_date, api_key)
+    if variable not in list(data):
+        raise ValueError("No column " + variable + " in the data for " + handle + ".")
+
+    values = np.array(data[variable], dtype=float)
+    series = {'handle': handle,
+              'start_date': str(start_date),
+              'end_date': str(end_date),
+              'variable': variable,
+              'dates': np.array(pd.to_datetime(data.index).values, dtype='datetime64[D]'),
+              'values': values,
+              'log_returns': 100 * np.diff(np.log(values)),
+              'fetched_at': time.time()
+              }
+    store_series(file_name, series)
+    return series
+
+
+def load_series(file_name):
+    """ Reads a series from a file in the cache. """
+    with np.load(file_name) as data:
+        series = {key: data[key] for key in data.files}
+    for key in ('handle', 'start_date', 'end_date', 'variable'):
+        series[key] = str(series[key])
+    series['fetched_at'] = float(series['fetched_at'])
+    return series
+
+
+def store_series(file_name, series):
+    """ Writes a series to the cache.
+
+        The file is written to a temporary file first and then renamed, so
+        that processes reading the cache at the same time never see a
+        partially written file.
+
+    """
+    ensure_dir(file_name)
+    tmp_file_name = file_name + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file_name, 'wb') as fout:
+        np.savez_compressed(fout, **series)
+    os.replace(tmp_file_name, file_name)
+    print("Wrote " + series['handle'] + " (" + series['variable'] + ") to cache: " + file_name + ".")
+
+
+def clear_cache(cache_dir=None, handle=None, max_age=None):
+    """ Removes series from the cache.
+
+        Args:
+            cache_dir: directory of the cache, see get_cache_dir.
+            handle: only remove series with this Quandl name. (string)
+            max_age: only remove series older than this (in seconds).
+
+        Returns:
+            The number of removed files.
+
+    """
+    no_removed = 0
+    for file_name in glob.glob(os.path.join(get_cache_dir(cache_dir), '*.npz')):
+        series = load_series(file_name)
+        if handle is not None and series['handle'] != handle:
+            continue
+        if max_age is not None and time.time() - series['fetched_at'] <= max_age:
+            continue
+        os.remove(file_name)
+        no_removed += 1
+    return no_removed
+
+
+def fetch_quandl(handle, start_date, end_date, api_key=None):
+    """ Downloads data from Quandl (as a pandas data frame). """
+    import quandl
+    if api_key:
+        quandl.ApiConfig.api_key = api_key
+    return quandl.get(handle, start_date=start_date, end_date=end_date)
+
+
+def csv_fetcher(file_name):
+    """ Returns a fetcher that reads data from a csv file instead of Quandl.
+
+        Can be used for testing or to fill the cache on a machine without
+        network access. The file must have the dates in the first column and
+        one column for each variable (as data downloaded from Quandl).
+
+    """
+    def fetcher(handle, start_date, end_date, api_key=None):
+        data = pd.read_csv(file_name, index_col=0, parse_dates=True)
+        data = data.sort_index()
+        return data.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
+    return fetcher
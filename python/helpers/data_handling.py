@@ -19,14 +19,19 @@
 """Helpers for generating and importing data from/to models."""
 import pandas as pd
 import numpy as np
-import quandl
 
-def import_data_quandl(model, handle, start_date, end_date, variable, api_key=None):
+from helpers.data_cache import get_series
+
+def import_data_quandl(model, handle, start_date, end_date, variable, api_key=None,
+                       cache_dir=None, ttl=None, offline=None, refresh=False,
+                       fetcher=None):
     """ Imports financial data from Quandl.
 
         Downloads data from Quandl and computes the log-returns in percent.
         The result is saved in the model object as the attributes obs and
-        and no_obs.
+        and no_obs. The data is stored in a local cache and later calls
+        with the same arguments read the data from the cache instead, see
+        helpers.data_cache.get_series.
 
         Args:
             model: object to store data in.
@@ -34,16 +39,21 @@ def import_data_quandl(model, handle, start_date, end_date, variable, api_key=No
             start_date: date to start extraction from (YYYY-MM-DD).
             start_date: date to end extraction at (YYYY-MM-DD).
             variable: name of column to use for computations.
+            api_key: the Quandl API key. (string)
+            cache_dir: directory of the cache.
+            ttl: maximum age of cached data in seconds. (None: no limit)
+            offline: never download data, only use the cache. (boolean)
+            refresh: download the data even if it is in the cache. (boolean)
+            fetcher: function to download the data (instead of Quandl).
 
         Returns:
            Nothing.
 
     """
-    if api_key:
-        quandl.ApiConfig.api_key = api_key
-
-    data = quandl.get(handle, start_date=start_date, end_date=end_date)
-    log_returns = 100 * np.diff(np.log(data[variable]))
+    series = get_series(handle, start_date, end_date, variable,
+                        api_key=api_key, cache_dir=cache_dir, ttl=ttl,
+                        offline=offline, refresh=refresh, fetcher=fetcher)
+    log_returns = series['log_returns']
     model.no_obs = len(log_returns) - 1
     obs = np.array(log_returns, copy=True).reshape((model.no_obs + 1, 1))
     model.obs = obs
@@ -89,6 +99,46 @@ def import_data(model, file_name):
 
     print("Loaded data from file: " + file_name + ".")
 
+def import_panel_data(model, file_name, columns=None):
+    """ Imports a panel of observations from file.
+
+        Data is given as a csv file with one column for each series (e.g. the
+        log-returns of a number of assets) and one time step per line. All
+        series must have the same length and no missing values. The data is
+        stored in the model object under the attributes panel_obs (an array
+        of size (no_obs + 1) x no_series), panel_names and no_series.
+
+        Args:
+            model: object to store data in.
+            file_name: relative search path to csv file. (string)
+            columns: the names of the columns to import (list of strings). If
+                     None, all columns in the file are imported.
+
+        Returns:
+           Nothing.
+
+    """
+    data_frame = pd.read_csv(file_name)
+
+    if columns is None:
+        columns = list(data_frame)
+    if not set(columns).issubset(list(data_frame)):
+        raise ValueError("Some of the requested series are not in the file.")
+
+    if model.no_obs:
+        obs = data_frame[columns].values[0:(model.no_obs + 1), :]
+    else:
+        obs = data_frame[columns].values
+        model.no_obs = obs.shape[0] - 1
+
+    if np.any(~np.isfinite(obs)):
+        raise ValueError("The panel contains missing or non-finite observations.")
+
+    model.panel_obs = np.array(obs, dtype=float, copy=True)
+    model.panel_names = list(columns)
+    model.no_series = len(columns)
+    print("Loaded panel with {} series from file: {}.".format(model.no_series, file_name))
+
 def generate_data(model, file_name=None):
     """ Generates data from model and saves it to file.
 
@@ -0,0 +1,149 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Helpers for storing data in a binary format for memory mapping."""
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from helpers.file_system import ensure_dir
+
+METADATA_FILE = 'metadata.json'
+FORMAT_VERSION = 1
+
+
+def convert_csv_to_store(file_name, store_dir):
+    """ Converts a csv file with data to a binary data store.
+
+        Each column in the file (e.g. observation, state and input as for
+        import_data) is written as a npy-file with an array of size
+        no_rows x 1 in the directory store_dir. The names of the columns,
+        the files and the number of rows are written to the sidecar file
+        metadata.json in the same directory.
+
+        Args:
+            file_name: relative search path to csv file. (string)
+            store_dir: directory to write the data store to. (string)
+
+        Returns:
+           The metadata (dict).
+
+    """
+    data_frame = pd.read_csv(file_name)
+
+    metadata = {'format_version': FORMAT_VERSION,
+                'source': os.path.abspath(file_name),
+                'created': time.strftime("%c"),
+                'no_rows': int(data_frame.shape[0]),
+                'dtype': 'float64',
+                'columns': {}
+                }
+    for column in list(data_frame):
+        column_file = re.sub(r'[^0-9a-zA-Z_-]', '_', str(column)) + '.npy'
+        values = np.array(data_frame[column].values, dtype=np.float64)
+        values = values.reshape((metadata['no_rows'], 1))
+        ensure_dir(os.path.join(store_dir, column_file))
+        np.save(os.path.join(store_dir, column_file), values)
+        metadata['columns'][str(column)] = column_file
+
+    with open(os.path.join(store_dir, METADATA_FILE), 'w') as fout:
+        json.dump(metadata, fout, indent=2)
+
+    print("Converted data from file: " + file_name + " to data store: " + store_dir + ".")
+    return metadata
+
+
+def read_metadata(store_dir):
+    """ Reads the metadata of a data store. """
+    file_name = os.path.join(store_dir, METADATA_FILE)
+    if not os.path.exists(file_name):
+        raise ValueError("No data store found in: " + store_dir + ".")
+    with open(file_name, 'r') as fin:
+        metadata = json.load(fin)
+    if metadata['format_version'] != FORMAT_VERSION:
+        raise ValueError("Unknown format of data store: " + store_dir + ".")
+    return metadata
+
+
+def open_column(store_dir, column, no_rows=None):
+    """ Returns a read-only memory map of a column in a data store.
+
+        The data is not read into memory but is loaded by the operating
+        system when it is accessed. Hence, processes opening the same store
+        (or forked from a process that has opened it) share the memory.
+
+        Args:
+            store_dir: directory of the data store. (string)
+            column: name of the column. (string)
+            no_rows: number of rows to return (from the start). If None,
+                     all rows are returned.
+
+        Returns:
+           A read-only array (numpy.memmap) of size no_rows x 1.
+
+    """
+    metadata = read_metadata(store_dir)
+    if column not in metadata['columns']:
+        raise ValueError("No column " + column + " in data store: " + store_dir + ".")
+
+    values = np.load(os.path.join(store_dir, metadata['columns'][column]),
+                     mmap_mode='r')
+    if no_rows is not None:
+        if no_rows > values.shape[0]:
+            raise ValueError("The data store only contains " +
+                             str(values.shape[0]) + " rows.")
+        values = values[0:no_rows, :]
+    return values
+
+
+def import_data_store(model, store_dir):
+    """ Imports data from a binary data store.
+
+        As import_data but the data is read from a data store created by
+        convert_csv_to_store. The attributes obs, states and inputs of the
+        model are read-only memory maps of the files in the store, so the
+        data is not copied when the model is used in many worker processes.
+
+        Args:
+            model: object to store data in.
+            store_dir: directory of the data store. (string)
+
+        Returns:
+           Nothing.
+
+    """
+    metadata = read_metadata(store_dir)
+    columns = metadata['columns']
+
+    if 'observation' not in columns:
+        raise ValueError("No observations in data store, a column must be named observation.")
+    if not model.no_obs:
+        model.no_obs = metadata['no_rows'] - 1
+    no_rows = model.no_obs + 1
+
+    model.obs = open_column(store_dir, 'observation', no_rows)
+    if 'state' in columns:
+        model.states = open_column(store_dir, 'state', no_rows)
+    if 'input' in columns:
+        model.inputs = open_column(store_dir, 'input', no_rows)
+
+    print("Loaded data from data store: " + store_dir + ".")
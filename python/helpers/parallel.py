@@ -0,0 +1,156 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Helpers for evaluating functions in a pool of worker processes."""
+import multiprocessing
+import multiprocessing.sharedctypes
+import sys
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+_worker_context = {}
+
+def get_worker_context():
+    """ Returns the context (model, state estimator, etc.) of the worker. """
+    return _worker_context
+
+def run_in_pool(func, tasks, context=None, no_workers=None):
+    """ Evaluates a function for a list of tasks in a pool of processes.
+
+        The model and state estimator objects cannot be pickled (the priors
+        are given as modules) so they are not sent with each task. Instead,
+        they are given in the dict context which is made available to the
+        workers by forking the current process. The workers can access it
+        by calling get_worker_context.
+
+        Args:
+            func: function to evaluate. Must be defined at the top-level of
+                  a module and accept a single task as argument.
+            tasks: list of (picklable) arguments to func.
+            context: a dict with objects required by func.
+            no_workers: number of worker processes. (integer) If None, the
+                        number of cores is used and if 1, all tasks are
+                        evaluated in the current process.
+
+        Returns:
+            A list with the output of func for each task (same order as tasks).
+
+    """
+    _worker_context.clear()
+    if context:
+        _worker_context.update(context)
+
+    if no_workers is None:
+        no_workers = multiprocessing.cpu_count()
+    no_workers = int(min(no_workers, len(tasks)))
+
+    if no_workers <= 1:
+        return [func(task) for task in tasks]
+
+    pool = multiprocessing.get_context('fork').Pool(processes=no_workers)
+    try:
+        output = pool.map(func, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return output
+
+
+class WorkerPool(object):
+    """ A persistent pool of worker processes sharing a context.
+
+        As run_in_pool but the workers are forked once when the pool is
+        created and are reused for each call to map. This avoids the cost of
+        starting new processes when functions are evaluated repeatedly, e.g.
+        in each iteration of the MH algorithm. Note that the workers see the
+        context as it was when the pool was created, so everything that
+        changes between calls must be given in the tasks.
+
+        Args:
+            context: a dict with objects required by the functions.
+            no_workers: number of worker processes. (integer) If None, the
+                        number of cores is used and if 1, all tasks are
+                        evaluated in the current process.
+
+    """
+    def __init__(self, context=None, no_workers=None):
+        if no_workers is None:
+            no_workers = multiprocessing.cpu_count()
+        self.no_workers = int(no_workers)
+        self.context = context
+        self.pool = None
+
+        if self.no_workers > 1:
+            _worker_context.clear()
+            if context:
+                _worker_context.update(context)
+            self.pool = multiprocessing.get_context('fork').Pool(processes=self.no_workers)
+
+    def map(self, func, tasks):
+        """ Evaluates func for a list of tasks (same order in the output). """
+        if self.pool is None:
+            _worker_context.clear()
+            if self.context:
+                _worker_context.update(self.context)
+            return [func(task) for task in tasks]
+        return self.pool.map(func, tasks)
+
+    def close(self):
+        """ Terminates the worker processes. """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def to_shared_array(array):
+    """ Copies an array into shared memory.
+
+        The returned array is backed by a shared memory block, which is not
+        copied when the process is forked. Hence, all workers in a pool read
+        the same data.
+
+        Args:
+            array: the array to copy. (array of floats)
+
+        Returns:
+            A numpy array with the same shape and values as array.
+
+    """
+    array = np.asarray(array, dtype=float)
+    buffer = multiprocessing.sharedctypes.RawArray('d', int(array.size))
+    shared_array = np.frombuffer(buffer, dtype=float).reshape(array.shape)
+    shared_array[...] = array
+    return shared_array
+
+
+def get_peak_memory():
+    """ Returns the peak resident memory of the process in MB (or None if it
+        cannot be measured on the platform). """
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Given in bytes on macOS and in kilobytes on Linux
+        return peak_memory / 1024.0**2
+    return peak_memory / 1024.0
@@ -0,0 +1,198 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Helpers for profiling a window of iterations of a sampler."""
+import cProfile
+import os
+import pstats
+
+from helpers.file_system import ensure_dir
+
+# Functions that are always included in the summary (if they are called)
+WATCHED_FUNCTIONS = ('store_free_params', 'store_params', 'logpdf',
+                     'bfgs_estimate', 'filter', 'smoother', 'get_gradient',
+                     'get_hessian')
+
+PSTATS_FILE = 'profile.pstats'
+COLLAPSED_FILE = 'profile_collapsed.txt'
+
+
+class IterationProfiler(object):
+    """ Profiles a window of iterations using cProfile.
+
+        The sampler calls before_iteration and after_iteration around each
+        iteration and the profiler is only enabled for the iterations in
+        the window, so the overhead of profiling is restricted to these.
+
+        Args:
+            window: the first and last iteration to profile (the last is not
+                    included), e.g. (500, 600). (tuple of integers)
+
+    """
+    def __init__(self, window):
+        self.first_iter = int(window[0])
+        self.last_iter = int(window[1])
+        if self.first_iter >= self.last_iter:
+            raise ValueError("The profiling window must contain at least one iteration.")
+        self.profile = cProfile.Profile()
+        self.active = False
+        self.no_profiled_iters = 0
+
+    def before_iteration(self, i):
+        """ Starts the profiler at the first iteration of the window. """
+        if i == self.first_iter:
+            self.active = True
+            self.profile.enable()
+
+    def after_iteration(self, i):
+        """ Stops the profiler after the last iteration of the window. """
+        if self.active:
+            self.no_profiled_iters += 1
+            if i + 1 >= self.last_iter:
+                self.stop()
+
+    def stop(self):
+        """ Stops the profiler (if the run ends within the window). """
+        if self.active:
+            self.profile.disable()
+            self.active = False
+
+    def get_summary(self, no_functions=10):
+        """ Returns a summary of the profile.
+
+            Args:
+                no_functions: number of functions (with the largest own time)
+                              to include. The functions in WATCHED_FUNCTIONS
+                              are included as well.
+
+            Returns:
+                A dict with the profiled iterations, the total time and a
+                list of dicts with the number of calls, the own time and the
+                cumulative time (seconds) of the functions.
+
+        """
+        summary = {'iterations': [self.first_iter, self.first_iter + self.no_profiled_iters],
+                   'no_profiled_iters': self.no_profiled_iters,
+                   'total_time': 0.0,
+                   'functions': []}
+        if self.no_profiled_iters == 0:
+            return summary
+
+        stats = pstats.Stats(self.profile)
+        rows = []
+        for func, (_, no_calls, own_time, cum_time, _) in stats.stats.items():
+            rows.append({'function': _get_label(func),
+                         'no_calls': no_calls,
+                         'own_time': own_time,
+                         'cumulative_time': cum_time,
+                         'own_time_per_iteration': own_time / self.no_profiled_iters})
+        rows.sort(key=lambda row: row['own_time'], reverse=True)
+
+        summary['total_time'] = stats.total_tt
+        summary['functions'] = rows[0:no_functions]
+        summary['functions'] += [row for row in rows[no_functions:]
+                                 if row['function'].split(':')[-1] in WATCHED_FUNCTIONS]
+        return summary
+
+    def save(self, output_dir):
+        """ Writes the profile as a pstats-file and a collapsed-stack file.
+
+            The pstats-file can be read by pstats.Stats or e.g. snakeviz and
+            the collapsed stacks (one line per stack with the time in
+            microseconds) by e.g. flamegraph.pl or speedscope.
+
+        """
+        if self.no_profiled_iters == 0:
+            return
+        file_name = os.path.join(output_dir, PSTATS_FILE)
+        ensure_dir(file_name)
+        self.profile.dump_stats(file_name)
+
+        stacks = get_collapsed_stacks(pstats.Stats(self.profile))
+        with open(os.path.join(output_dir, COLLAPSED_FILE), 'w') as fout:
+            for stack in sorted(stacks):
+                fout.write(stack + ' ' + str(stacks[stack]) + '\n')
+        print("Wrote profile to: " + file_name + ".")
+
+
+def get_collapsed_stacks(stats, max_depth=50, min_fraction=1e-4):
+    """ Computes collapsed stacks (for flame graphs) from a profile.
+
+        cProfile only records the callers of each function, so the stacks
+        are approximated by splitting the own time of each function over its
+        callers in proportion to the cumulative time of the calls from each
+        caller, recursively up to the functions without (profiled) callers.
+
+        Args:
+            stats: the profile. (pstats.Stats)
+            max_depth: maximum depth of the stacks.
+            min_fraction: parts of stacks with a smaller fraction of the
+                          total time are dropped (which bounds the number
+                          of stacks).
+
+        Returns:
+            A dict with the time in microseconds of each stack given as the
+            names of the functions separated by semicolons (outermost first).
+
+    """
+    stacks = {}
+    min_time = min_fraction * stats.total_tt
+
+    def add_stack(path, weight):
+        stack = ';'.join(_get_label(func) for func in path)
+        stacks[stack] = stacks.get(stack, 0) + weight
+
+    def walk(path, weight):
+        callers = stats.stats[path[0]][4]
+        callers = {caller: value for caller, value in callers.items()
+                   if caller in stats.stats and caller not in path}
+        total = sum(value[3] for value in callers.values())
+        if not callers or total <= 0.0 or len(path) >= max_depth:
+            add_stack(path, weight)
+            return
+        for caller, value in callers.items():
+            caller_weight = weight * value[3] / total
+            if caller_weight >= min_time:
+                walk([caller] + path, caller_weight)
+
+    for func, (_, _, own_time, _, _) in stats.stats.items():
+        if own_time >= min_time:
+            walk([func], own_time)
+
+    return {stack: int(round(1e6 * weight)) for stack, weight in stacks.items()
+            if int(round(1e6 * weight)) > 0}
+
+
+def format_summary(summary, no_functions=10):
+    """ Returns a summary from IterationProfiler.get_summary as a string. """
+    lines = ["Profile of iterations {} to {} ({:.3f} seconds):".format(
+        summary['iterations'][0], summary['iterations'][1], summary['total_time'])]
+    lines.append("{:>10s} {:>12s} {:>12s}  {}".format("calls", "own time", "cum. time", "function"))
+    for row in summary['functions'][0:no_functions]:
+        lines.append("{:>10d} {:>12.4f} {:>12.4f}  {}".format(
+            row['no_calls'], row['own_time'], row['cumulative_time'], row['function']))
+    return '\n'.join(lines)
+
+
+def _get_label(func):
+    """ Returns a label (file:function) for a function in a profile. """
+    file_name, _, func_name = func
+    if file_name == '~':
+        # Built-in functions
+        return func_name
+    return os.path.basename(file_name) + ':' + func_name
@@ -0,0 +1,53 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Helpers for randomised quasi-Monte Carlo point sets."""
+
+import numpy as np
+
+GOLDEN_RATIO_CONJUGATE = (np.sqrt(5.0) - 1.0) / 2.0
+
+def kronecker_point_set(no_points):
+    """ Randomly shifted two-dimensional point set sorted by the first coordinate.
+
+        The point set {(j / N, j * g mod 1)}, where g is the golden ratio
+        conjugate (the Kronecker sequence with the smallest discrepancy in
+        one dimension), is shifted by a uniform random vector modulo one
+        (Cranley-Patterson rotation). Each point is marginally uniform on the
+        unit square and the point set has low discrepancy for all N. As the
+        first coordinate is a shifted regular grid, the points are sorted by
+        it without sorting.
+
+        Args:
+            no_points: number of points. (integer)
+
+        Returns:
+            First value: the first coordinate of the points (sorted array).
+            Second value: the second coordinate of the points (array).
+
+    """
+    shift = np.random.uniform(size=2)
+
+    # The sorted first coordinate is (n + r) / N for n = 0, ..., N - 1
+    offset = int(np.floor(shift[0] * no_points))
+    first_coord = (np.arange(no_points) + shift[0] * no_points - offset) / no_points
+
+    # which is the point with index j = n - offset (mod N) in the point set
+    point_idx = np.mod(np.arange(no_points) - offset, no_points)
+    second_coord = np.mod(point_idx * GOLDEN_RATIO_CONJUGATE + shift[1], 1.0)
+    return first_coord, second_coord
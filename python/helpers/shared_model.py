@@ -0,0 +1,294 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Helpers for broadcasting models to worker processes using shared memory."""
+import importlib
+import multiprocessing
+import pickle
+import uuid
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8: the arrays are inherited by forking the process instead
+    shared_memory = None
+
+from helpers.parallel import to_shared_array
+
+# Arrays and models in the current (worker) process
+_local_arrays = {}
+_attached_blocks = {}
+_worker_state = {}
+
+# Attributes of the model published as shared arrays
+SHARED_ATTRIBUTES = ('obs', 'states', 'inputs', 'panel_obs')
+
+
+def publish_array(array):
+    """ Copies an array to shared memory.
+
+        If multiprocessing.shared_memory is available (Python 3.8 or later),
+        the array is copied to a named shared memory block, which can be
+        attached by any process. Otherwise, it is copied by to_shared_array
+        and can only be attached by processes forked after this call.
+
+        Args:
+            array: the array to copy. (array of floats)
+
+        Returns:
+            A (picklable) descriptor of the array for attach_array.
+
+    """
+    array = np.ascontiguousarray(array, dtype=float)
+    descriptor = {'shape': array.shape, 'dtype': array.dtype.str}
+    if shared_memory is not None:
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared_array[...] = array
+        descriptor['name'] = block.name
+        _attached_blocks[block.name] = block
+    else:
+        descriptor['name'] = 'local_' + uuid.uuid4().hex
+        _local_arrays[descriptor['name']] = to_shared_array(array)
+    return descriptor
+
+
+def attach_array(descriptor, writeable=False):
+    """ Returns the shared array given by a descriptor from publish_array.
+
+        The array is attached once in each process and later calls return
+        views of the same memory.
+
+    """
+    name = descriptor['name']
+    if name in _local_arrays:
+        array = _local_arrays[name]
+    else:
+        if shared_memory is None:
+            raise ValueError("The shared array " + name + " is not available " +
+                             "in this process (requires the fork start method).")
+        if name not in _attached_blocks:
+            _attached_blocks[name] = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(descriptor['shape'], dtype=np.dtype(descriptor['dtype']),
+                           buffer=_attached_blocks[name].buf)
+    array = array.view()
+    array.flags.writeable = writeable
+    return array
+
+
+def release_array(descriptor):
+    """ Frees the shared memory of an array (call in the publishing process). """
+    name = descriptor['name']
+    _local_arrays.pop(name, None)
+    block = _attached_blocks.pop(name, None)
+    if block is not None:
+        block.close()
+        block.unlink()
+
+
+class ModelBroadcast(object):
+    """ The data and static configuration of a model in shared memory.
+
+        The data (obs, states, inputs and panel_obs) is published once by
+        publish_array and all other attributes of the model that can be
+        pickled (parameters, number of observations, parameters to estimate,
+        etc.) are stored in the dict spec together with the name of the
+        class of the model. The priors are stored by the names of their
+        modules. A worker process rebuilds the model from spec by calling
+        build_model_proxy, which attaches the data without copying it.
+
+        Args:
+            model: the model to broadcast.
+
+    """
+    def __init__(self, model):
+        self.spec = {'id': uuid.uuid4().hex,
+                     'module': type(model).__module__,
+                     'class_name': type(model).__name__,
+                     'arrays': {},
+                     'config': {},
+                     'priors': {}
+                     }
+
+        for key, value in vars(model).items():
+            if key in SHARED_ATTRIBUTES and isinstance(value, np.ndarray):
+                self.spec['arrays'][key] = publish_array(value)
+            elif key == 'params_prior':
+                for param, prior in value.items():
+                    self.spec['priors'][param] = (prior[0].__name__,) + tuple(prior[1:])
+            else:
+                try:
+                    pickle.dumps(value)
+                except Exception:
+                    continue
+                self.spec['config'][key] = value
+
+    def close(self):
+        """ Frees the shared memory of the data. """
+        for descriptor in self.spec['arrays'].values():
+            release_array(descriptor)
+        self.spec['arrays'] = {}
+
+
+def build_model_proxy(spec):
+    """ Rebuilds a model from the spec of a ModelBroadcast.
+
+        The model is created by the constructor of its class, after which the
+        static configuration and priors are restored and the data is attached
+        as read-only views of the shared memory. The models are cached in the
+        process, so later calls with the same spec return the same object.
+
+    """
+    if spec['id'] in _worker_state:
+        return _worker_state[spec['id']]
+
+    module = importlib.import_module(spec['module'])
+    model = getattr(module, spec['class_name'])()
+    for key, value in spec['config'].items():
+        setattr(model, key, value)
+    if spec['priors']:
+        model.params_prior = {}
+        for param, prior in spec['priors'].items():
+            model.params_prior[param] = (importlib.import_module(prior[0]),) + tuple(prior[1:])
+    for key, descriptor in spec['arrays'].items():
+        setattr(model, key, attach_array(descriptor))
+
+    _worker_state[spec['id']] = model
+    return model
+
+
+class BroadcastPool(object):
+    """ A pool of workers estimating the log-likelihood of a broadcast model.
+
+        The model is broadcast once (see ModelBroadcast) and the state
+        estimator is sent once to each worker when the pool is started. Each
+        task is then only a parameter vector (and a seed) and the estimates
+        are written by the workers into preallocated shared buffers, so no
+        model or data is pickled per task. With shared_memory (Python 3.8 or
+        later), any start method can be used (spawn is the default).
+        Otherwise, the workers are forked.
+
+        Args:
+            model: the model.
+            state_estimator: the state estimator (must be picklable).
+            no_workers: number of worker processes. (integer) If None, the
+                        number of cores is used.
+            max_batch_size: maximum number of parameters in each call to
+                            estimate_log_like (size of the buffers).
+            start_method: 'spawn', 'fork' or 'forkserver'.
+
+    """
+    def __init__(self, model, state_estimator, no_workers=None,
+                 max_batch_size=1000, start_method=None):
+        if no_workers is None:
+            no_workers = multiprocessing.cpu_count()
+        if start_method is None:
+            start_method = 'spawn' if shared_memory is not None else 'fork'
+        if shared_memory is None and start_method != 'fork':
+            raise ValueError("The start method must be fork for Python < 3.8.")
+
+        no_params = model.no_params_to_estimate
+        self.max_batch_size = int(max_batch_size)
+        self.broadcast = ModelBroadcast(model)
+        self.buffers = {'log_like': publish_array(np.zeros(self.max_batch_size)),
+                        'gradient': publish_array(np.zeros((self.max_batch_size, no_params)))}
+
+        context = multiprocessing.get_context(start_method)
+        self.pool = context.Pool(processes=int(no_workers),
+                                 initializer=_initialise_worker,
+                                 initargs=(self.broadcast.spec, state_estimator))
+
+    def estimate_log_like(self, param_matrix, estimate_gradient=False):
+        """ Estimates the log-likelihood for each row of param_matrix.
+
+            Args:
+                param_matrix: array (no_params x no_params_to_estimate) with
+                              the parameters (not the free parameters).
+                estimate_gradient: should the gradient be estimated (using
+                                   the smoother)? (boolean)
+
+            Returns:
+                The log-likelihoods (and the gradients if estimate_gradient
+                is True, otherwise None).
+
+        """
+        param_matrix = np.atleast_2d(param_matrix)
+        no_rows = param_matrix.shape[0]
+        if no_rows > self.max_batch_size:
+            raise ValueError("The number of parameters is larger than max_batch_size.")
+
+        seeds = np.random.randint(0, 2**31 - 1, size=no_rows)
+        tasks = [(self.broadcast.spec['id'], i, param_matrix[i, :],
+                  estimate_gradient, seeds[i], self.buffers)
+                 for i in range(no_rows)]
+        self.pool.map(_estimate_task, tasks)
+
+        log_like = np.array(attach_array(self.buffers['log_like'])[0:no_rows])
+        if not estimate_gradient:
+            return log_like, None
+        return log_like, np.array(attach_array(self.buffers['gradient'])[0:no_rows, :])
+
+    def close(self):
+        """ Terminates the workers and frees the shared memory. """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for descriptor in self.buffers.values():
+            release_array(descriptor)
+        self.buffers = {}
+        self.broadcast.close()
+
+
+def _initialise_worker(spec, state_estimator):
+    """ Rebuilds the model and stores the state estimator in a worker. """
+    build_model_proxy(spec)
+    _worker_state['state_estimator'] = state_estimator
+
+
+def _estimate_task(task):
+    """ Estimates the log-likelihood for one parameter vector in a worker. """
+    spec_id, idx, params, estimate_gradient, seed, buffers = task
+    model = _worker_state[spec_id]
+    state_estimator = _worker_state['state_estimator']
+    np.random.seed(seed)
+
+    model.store_params(params)
+
+    log_like = attach_array(buffers['log_like'], writeable=True)
+    gradient = attach_array(buffers['gradient'], writeable=True)
+    if not model.check_parameters():
+        log_like[idx] = -np.inf
+        gradient[idx, :] = 0.0
+        return None
+
+    # The state estimator is reused by the later tasks of the worker
+    saved_estimate_gradient = state_estimator.settings['estimate_gradient']
+    state_estimator.settings['estimate_gradient'] = estimate_gradient
+    try:
+        if estimate_gradient:
+            state_estimator.smoother(model)
+            gradient[idx, :] = state_estimator.results['gradient_internal']
+        else:
+            state_estimator.filter(model)
+    finally:
+        state_estimator.settings['estimate_gradient'] = saved_estimate_gradient
+    log_like[idx] = float(state_estimator.results['log_like'])
+    return None
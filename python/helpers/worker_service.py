@@ -0,0 +1,356 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Worker server and client for estimating log-likelihoods over sockets.
+
+    A message consists of a 4-byte (big-endian) length of a JSON header
+    followed by the header and the raw data (float64, little-endian) of the
+    arrays listed in header['arrays'] as [name, shape] pairs. The requests
+    are:
+
+        {'type': 'ping'}: returns the name of the state estimator and the
+                          dimensions of the model.
+        {'type': 'evaluate', 'run_smoother': bool, 'estimate_gradient': bool,
+         'seed': int} with the array params (P x no_params_to_estimate):
+                          returns the arrays valid, log_like and
+                          state_trajectory (and the gradients and Hessians
+                          if estimate_gradient is True).
+        {'type': 'shutdown'}: stops the server.
+
+    Errors are returned as {'type': 'error', 'message': str}.
+
+"""
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import struct
+import threading
+import traceback
+
+import numpy as np
+
+HEADER_FORMAT = '>I'
+GRADIENT_KEYS = ('gradient_internal', 'hessian_internal',
+                 'log_joint_gradient_estimate', 'log_joint_hessian_estimate')
+
+
+def send_message(sock, header, arrays=None):
+    """ Sends a header (dict) and arrays (dict of name: array) on a socket. """
+    header = dict(header)
+    payload = []
+    header['arrays'] = []
+    if arrays:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype='<f8')
+            header['arrays'].append([name, list(array.shape)])
+            payload.append(array.tobytes())
+    header_bytes = json.dumps(header).encode('utf-8')
+    sock.sendall(struct.pack(HEADER_FORMAT, len(header_bytes)) + header_bytes + b''.join(payload))
+
+
+def receive_message(sock):
+    """ Receives a message from a socket and returns the header and arrays. """
+    header_length = struct.unpack(HEADER_FORMAT, _receive_bytes(sock, struct.calcsize(HEADER_FORMAT)))[0]
+    header = json.loads(_receive_bytes(sock, header_length).decode('utf-8'))
+    arrays = {}
+    for name, shape in header.pop('arrays'):
+        no_bytes = 8 * int(np.prod(shape))
+        arrays[name] = np.frombuffer(_receive_bytes(sock, no_bytes), dtype='<f8').reshape(shape)
+    return header, arrays
+
+
+def _receive_bytes(sock, no_bytes):
+    """ Receives exactly no_bytes from a socket. """
+    chunks = []
+    while no_bytes > 0:
+        chunk = sock.recv(min(no_bytes, 1 << 20))
+        if not chunk:
+            raise ConnectionError("The connection was closed by the other side.")
+        chunks.append(chunk)
+        no_bytes -= len(chunk)
+    return b''.join(chunks)
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    """ A server estimating the log-likelihood of a model for given parameters.
+
+        The model (with data and inference model) and the state estimator are
+        loaded once when the server is created. Each connection is handled in
+        a separate thread and can send any number of requests, but the
+        evaluations are carried out one at a time. Start one server per core
+        (e.g. by start_local_workers) to evaluate parameters concurrently.
+
+        Args:
+            model: the model.
+            state_estimator: the state estimator.
+            host: the address to listen on. (string)
+            port: the port to listen on (0: any free port). (integer)
+
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, model, state_estimator, host='127.0.0.1', port=0):
+        self.model = model
+        self.state_estimator = state_estimator
+        self.lock = threading.Lock()
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _RequestHandler)
+
+    def evaluate(self, params, run_smoother, estimate_gradient, seed):
+        """ Runs the filter or smoother for each row of params. """
+        model = self.model
+        state = self.state_estimator
+        no_rows = params.shape[0]
+        no_params = model.no_params_to_estimate
+
+        output = {'valid': np.zeros(no_rows),
+                  'log_like': -np.inf * np.ones(no_rows),
+                  'state_trajectory': np.zeros((no_rows, model.no_obs + 1))}
+        if estimate_gradient:
+            output.update({'gradient_internal': np.zeros((no_rows, no_params)),
+                           'hessian_internal': np.zeros((no_rows, no_params, no_params)),
+                           'log_joint_gradient_estimate': np.zeros((no_rows, model.no_params)),
+                           'log_joint_hessian_estimate': np.zeros((no_rows, model.no_params, model.no_params))})
+
+        with self.lock:
+            np.random.seed(seed)
+            state.settings['estimate_gradient'] = estimate_gradient
+            for i in range(no_rows):
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    model.store_params(params[i, :])
+                if not model.check_parameters():
+                    continue
+                if run_smoother:
+                    state.smoother(model)
+                else:
+                    state.filter(model)
+                output['valid'][i] = 1.0
+                output['log_like'][i] = float(state.results['log_like'])
+                output['state_trajectory'][i, :] = np.array(state.results['state_trajectory']).flatten()
+                if estimate_gradient:
+                    for key in GRADIENT_KEYS:
+                        output[key][i] = state.results[key]
+        return output
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """ Answers the requests on a connection until it is closed. """
+
+    def handle(self):
+        while True:
+            try:
+                header, arrays = receive_message(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                if header['type'] == 'ping':
+                    send_message(self.request, {'type': 'pong',
+                                                'name': self.server.state_estimator.name,
+                                                'no_obs': int(self.server.model.no_obs),
+                                                'no_params_to_estimate': int(self.server.model.no_params_to_estimate)})
+                elif header['type'] == 'evaluate':
+                    output = self.server.evaluate(arrays['params'],
+                                                  bool(header['run_smoother']),
+                                                  bool(header['estimate_gradient']),
+                                                  int(header['seed']))
+                    send_message(self.request, {'type': 'result'}, output)
+                elif header['type'] == 'shutdown':
+                    send_message(self.request, {'type': 'ok'})
+                    threading.Thread(target=self.server.shutdown).start()
+                    return
+                else:
+                    raise ValueError("Unknown request: " + str(header['type']) + ".")
+            except Exception:
+                send_message(self.request, {'type': 'error', 'message': traceback.format_exc()})
+
+
+class WorkerClient(object):
+    """ A client for a number of worker servers.
+
+        Keeps one open connection to each server (which is reopened if it
+        fails) and splits each batch of parameters into one request per
+        server. All requests are sent before any answer is received, so the
+        servers evaluate their parts concurrently. Smaller batches are sent
+        to the servers in turn. The connections are not shared with forked
+        processes (e.g. the workers in a WorkerPool), which open their own.
+
+        Args:
+            addresses: list of (host, port) of the servers.
+            timeout: timeout for socket operations in seconds. (float)
+
+    """
+    def __init__(self, addresses, timeout=None):
+        self.addresses = [(str(host), int(port)) for host, port in addresses]
+        self.timeout = timeout
+        self.connections = {}
+        self.pid = os.getpid()
+        self.next_server = 0
+
+    def ping(self):
+        """ Returns the answer of each server to a ping. """
+        self._check_process()
+        output = []
+        for address in self.addresses:
+            header, _ = self._request(address, {'type': 'ping'})
+            output.append(header)
+        return output
+
+    def evaluate(self, param_matrix, run_smoother=False, estimate_gradient=False):
+        """ Estimates the log-likelihood for each row of param_matrix.
+
+            Returns:
+                A dict with the stacked arrays from the servers (see the
+                documentation of the module), in the order of the rows.
+
+        """
+        self._check_process()
+        param_matrix = np.atleast_2d(np.array(param_matrix, dtype=float))
+        no_rows = param_matrix.shape[0]
+        blocks = np.array_split(np.arange(no_rows), min(no_rows, len(self.addresses)))
+        seeds = np.random.randint(0, 2**31 - 1, size=len(blocks))
+
+        no_servers = len(self.addresses)
+        addresses = [self.addresses[(self.next_server + i) % no_servers]
+                     for i in range(len(blocks))]
+        self.next_server = (self.next_server + len(blocks)) % no_servers
+
+        header = {'type': 'evaluate',
+                  'run_smoother': bool(run_smoother),
+                  'estimate_gradient': bool(estimate_gradient)}
+        for block, address, seed in zip(blocks, addresses, seeds):
+            header['seed'] = int(seed)
+            self._send(address, header, {'params': param_matrix[block, :]})
+
+        output = {}
+        try:
+            for block, address in zip(blocks, addresses):
+                _, arrays = self._receive(address)
+                for key in arrays:
+                    if key not in output:
+                        output[key] = np.zeros((no_rows,) + arrays[key].shape[1:])
+                    output[key][block] = arrays[key]
+        except Exception:
+            # Unread answers on the other connections are discarded
+            self.close()
+            raise
+        return output
+
+    def shutdown_servers(self):
+        """ Stops all servers. """
+        for address in self.addresses:
+            try:
+                self._request(address, {'type': 'shutdown'})
+            except (ConnectionError, OSError):
+                pass
+        self.close()
+
+    def close(self):
+        """ Closes all connections. """
+        for sock in self.connections.values():
+            sock.close()
+        self.connections = {}
+
+    def _check_process(self):
+        """ Drops the connections inherited from the parent after a fork. """
+        if self.pid != os.getpid():
+            for sock in self.connections.values():
+                sock.close()
+            self.connections = {}
+            self.pid = os.getpid()
+            self.next_server = self.pid % len(self.addresses)
+
+    def _get_connection(self, address):
+        """ Returns the open connection to a server (or opens it). """
+        if address not in self.connections:
+            sock = socket.create_connection(address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections[address] = sock
+        return self.connections[address]
+
+    def _send(self, address, header, arrays=None):
+        """ Sends a request (reconnecting once if the connection is broken). """
+        try:
+            send_message(self._get_connection(address), header, arrays)
+        except (ConnectionError, OSError):
+            self._drop_connection(address)
+            send_message(self._get_connection(address), header, arrays)
+
+    def _receive(self, address):
+        """ Receives an answer and raises errors from the server. """
+        try:
+            header, arrays = receive_message(self.connections[address])
+        except (ConnectionError, OSError):
+            self._drop_connection(address)
+            raise
+        if header['type'] == 'error':
+            raise RuntimeError("Error in worker " + str(address) + ":\n" + header['message'])
+        return header, arrays
+
+    def _request(self, address, header, arrays=None):
+        self._send(address, header, arrays)
+        return self._receive(address)
+
+    def _drop_connection(self, address):
+        sock = self.connections.pop(address, None)
+        if sock is not None:
+            sock.close()
+
+
+def start_local_workers(model, state_estimator, no_workers=None, host='127.0.0.1'):
+    """ Starts worker servers in forked processes on this machine.
+
+        Args:
+            model: the model.
+            state_estimator: the state estimator.
+            no_workers: number of servers. (integer) If None, the number of
+                        cores is used.
+            host: the address to listen on. (string)
+
+        Returns:
+            A list of the addresses (host, port) of the servers and a list of
+            the processes.
+
+    """
+    if no_workers is None:
+        no_workers = multiprocessing.cpu_count()
+    context = multiprocessing.get_context('fork')
+
+    addresses = []
+    processes = []
+    for _ in range(int(no_workers)):
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_serve, args=(model, state_estimator, host, child_conn))
+        process.daemon = True
+        process.start()
+        addresses.append((host, parent_conn.recv()))
+        processes.append(process)
+    return addresses, processes
+
+
+def _serve(model, state_estimator, host, conn):
+    """ Runs a worker server in a (forked) process. """
+    server = WorkerServer(model, state_estimator, host=host, port=0)
+    conn.send(server.server_address[1])
+    conn.close()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
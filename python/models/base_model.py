@@ -20,7 +20,8 @@
 import numpy as np
 
 from helpers.data_handling import generate_data, import_data
-from helpers.data_handling import import_data_quandl
+from helpers.data_handling import import_data_quandl, import_panel_data
+from helpers.data_store import import_data_store
 from helpers.inference_model import create_inference_model, fix_true_params
 from helpers.model_params import store_free_params, store_params
 from helpers.model_params import get_free_params, get_params, get_all_params
@@ -42,6 +43,10 @@ class BaseModel(object):
     inputs = []
     obs = []
 
+    panel_obs = []
+    panel_names = []
+    no_series = 0
+
     params_to_estimate_idx = []
     no_params_to_estimate = 0
     params_to_estimate = []
@@ -93,11 +98,13 @@ class BaseModel(object):
         print("===============================================================")
         return " "
 
-    def generate_initial_state(self, no_samples):
+    def generate_initial_state(self, no_samples, noise=None):
         """ Generates no_samples from the initial state distribution.
 
             Args:
                 no_samples: number of samples to generate (integer).
+                noise: standard Gaussian noise to use instead of random
+                       numbers, e.g., from a quasi-random point set (array).
 
             Returns:
                 An array with no_samples from the initial state distribution.
@@ -105,12 +112,14 @@ class BaseModel(object):
         """
         raise NotImplementedError
 
-    def generate_state(self, cur_state, time_step):
+    def generate_state(self, cur_state, time_step, noise=None):
         """ Generates a new state by the state dynamics.
 
             Args:
                 cur_state: the current state (array).
                 time_step: the current time step (integer).
+                noise: standard Gaussian noise to use instead of random
+                       numbers, e.g., from a quasi-random point set (array).
 
             Returns:
                 An array of samples from the next time step.
@@ -132,6 +141,22 @@ class BaseModel(object):
         """
         raise NotImplementedError
 
+    def log_state_transition_bound(self, time_step):
+        """ Computes an upper bound of the log-probability of a state transition.
+
+            The bound is used for sampling from the backward kernel using
+            rejection sampling in the particle smoothers.
+
+            Args:
+                time_step: the current time step (integer).
+
+            Returns:
+                A scalar which is larger than or equal to evaluate_state for
+                all next and current states at time_step.
+
+        """
+        raise NotImplementedError
+
     def generate_obs(self, cur_state, time_step):
         """ Generates a new observation by the observation dynamics.
 
@@ -298,6 +323,8 @@ class BaseModel(object):
     generate_data = generate_data
     import_data = import_data
     import_data_quandl = import_data_quandl
+    import_panel_data = import_panel_data
+    import_data_store = import_data_store
 
     # Helpers for handling parameters
     store_free_params = store_free_params
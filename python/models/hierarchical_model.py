@@ -0,0 +1,355 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Hierarchical model composed of a number of series models."""
+import copy
+import numpy as np
+
+from models.base_model import BaseModel
+from helpers.distributions import normal
+from helpers.distributions import gamma
+from helpers.parallel import to_shared_array
+
+
+class HierarchicalModel(BaseModel):
+    """ Hierarchical model composed of a number of series models.
+
+        Combines S models (e.g. StochasticVolatilityModel), each with its own
+        data, into one model for inference. The parameters of the series
+        models are either shared (the same value for all series) or local
+        (one value for each series). The local parameters are partially
+        pooled by the prior
+
+        free(p_s) ~ N(p_mean, p_stdev^2),   s = 0, ..., S-1,
+
+        where free(p_s) is the reparameterised (unrestricted) value of the
+        local parameter p in series s and (p_mean, p_stdev) are
+        hyperparameters, which are estimated together with the rest of the
+        parameters. The shared parameters have the priors given in the
+        series models.
+
+        The parameters of the model are named as the parameters of the series
+        models for the shared parameters, p_0, ..., p_{S-1} for the local
+        parameters and p_mean and p_stdev for the hyperparameters. All
+        parameters are estimated, so the model is created as an inference
+        model. The log-likelihood is estimated by HierarchicalStateInference,
+        which runs a state estimator for each series in a pool of processes.
+
+        Args:
+            series_models: list of model objects with data. The models are
+                           changed by the container and should not be used
+                           elsewhere.
+            shared_params: names of the shared parameters. (list of strings)
+            local_params: names of the local parameters. (list of strings)
+            hyperparams_prior: a dict with the priors of the hyperparameters
+                               (same format as params_prior). Defaults to
+                               the prior of the parameter in the series
+                               models for p_mean and a Gamma(2, 4) prior for
+                               p_stdev.
+
+    """
+
+    def __init__(self, series_models, shared_params=('phi', 'sigma_v'),
+                 local_params=('mu',), hyperparams_prior=None):
+        self.name = "Hierarchical model of {} series ({}).".format(len(series_models),
+                                                                   series_models[0].name)
+        self.file_prefix = "hierarchical_" + series_models[0].file_prefix
+
+        self.series_models = series_models
+        self.no_series = len(series_models)
+        self.shared_params = list(shared_params)
+        self.local_params = list(local_params)
+
+        template = series_models[0]
+        for param in self.shared_params + self.local_params:
+            if param not in template.params:
+                raise ValueError("The parameter " + param + " is not in the series models.")
+
+        self.params = {}
+        self.free_params = {}
+        self.params_prior = {}
+        for param in self.shared_params:
+            self.params.update({param: template.params[param]})
+            self.params_prior.update({param: template.params_prior[param]})
+        for param in self.local_params:
+            for i in range(self.no_series):
+                self.params.update({self._local_name(param, i): series_models[i].params[param]})
+        for param in self.local_params:
+            self.params.update({param + '_mean': 0.0})
+            self.params.update({param + '_stdev': 1.0})
+            self.params_prior.update({param + '_mean': template.params_prior[param]})
+            self.params_prior.update({param + '_stdev': (gamma, 2.0, 4.0)})
+        if hyperparams_prior:
+            self.params_prior.update(hyperparams_prior)
+        self.no_params = len(self.params)
+
+        # Set up the series models for inference on the shared and local params
+        series_params = [param for param in template.params
+                         if param in self.shared_params + self.local_params]
+        for model in self.series_models:
+            model.fix_true_params()
+            model.create_inference_model(params_to_estimate=tuple(series_params))
+            model.obs = to_shared_array(model.obs)
+
+        self.no_obs = int(np.max([model.no_obs for model in self.series_models]))
+        if np.all([model.no_obs == self.no_obs for model in self.series_models]):
+            self.obs = np.hstack([model.obs.reshape((-1, 1)) for model in self.series_models])
+        else:
+            self.obs = [model.obs.flatten().tolist() for model in self.series_models]
+        self.states = []
+        self.inputs = []
+
+        self.transform_params_to_free()
+        for param in self.local_params:
+            local_values = [self.free_params[self._local_name(param, i)]
+                            for i in range(self.no_series)]
+            self.params[param + '_mean'] = float(np.mean(local_values))
+            if self.no_series > 1 and np.std(local_values) > 0.0:
+                self.params[param + '_stdev'] = float(np.std(local_values))
+        self.transform_params_to_free()
+
+        self.fix_true_params()
+        self.create_inference_model(params_to_estimate=tuple(self.params.keys()))
+
+    @staticmethod
+    def _local_name(param, series):
+        return param + '_' + str(series)
+
+    def get_series_params(self, series):
+        """ Returns the parameters of a series model.
+
+            Args:
+                series: index of the series. (integer)
+
+            Returns:
+                A dict with the parameters of the series model, where the
+                shared and local parameters are given by the current
+                parameters of the hierarchical model.
+
+        """
+        params = copy.deepcopy(self.series_models[series].true_params)
+        for param in self.shared_params:
+            params[param] = self.params[param]
+        for param in self.local_params:
+            params[param] = self.params[self._local_name(param, series)]
+        return params
+
+    def check_parameters(self):
+        """" Checks if parameters satisfies hard constraints on the parameters.
+
+                Returns:
+                    Boolean to indicate if the current parameters results in
+                    a stable system for all series and positive hyperparameters.
+
+        """
+        for param in self.local_params:
+            if self.params[param + '_stdev'] <= 0.0:
+                return False
+
+        for i in range(self.no_series):
+            model = self.series_models[i]
+            model.params = self.get_series_params(i)
+            if not model.check_parameters():
+                return False
+        return True
+
+    def log_prior(self):
+        """ Returns the logarithm of the prior distribution.
+
+            Returns:
+                First value: a dict with an entry for each parameter.
+                Second value: the sum of the log-prior for all variables.
+
+        """
+        prior = {}
+        for param in self.params:
+            if param in self.params_prior:
+                dist = self.params_prior[param][0]
+                hyppar1 = self.params_prior[param][1]
+                hyppar2 = self.params_prior[param][2]
+                prior.update({param: dist.logpdf(self.params[param], hyppar1, hyppar2)})
+
+        for param in self.local_params:
+            mean = self.params[param + '_mean']
+            stdev = self.params[param + '_stdev']
+            for i in range(self.no_series):
+                local_name = self._local_name(param, i)
+                prior.update({local_name: normal.logpdf(self.free_params[local_name], mean, stdev)})
+
+        prior_sum = 0.0
+        for param in self.params_to_estimate:
+            prior_sum += prior[param]
+
+        return prior, prior_sum
+
+    def log_prior_gradient(self):
+        """ The gradient of the logarithm of the prior.
+
+            Returns:
+                A dict with an entry for each parameter (with respect to the
+                free parameters).
+
+        """
+        template = self.series_models[0]
+        template.params = self.get_series_params(0)
+        template_gradients = template.log_prior_gradient()
+
+        gradients = {}
+        for param in self.params:
+            gradients.update({param: 0.0})
+        for param in self.shared_params:
+            gradients[param] = template_gradients[param]
+
+        for param in self.local_params:
+            mean = self.params[param + '_mean']
+            stdev = self.params[param + '_stdev']
+            residuals = self._local_residuals(param)
+
+            for i in range(self.no_series):
+                gradients[self._local_name(param, i)] = -residuals[i] / stdev**2
+
+            dist, hyppar1, hyppar2 = self.params_prior[param + '_mean']
+            gradients[param + '_mean'] = dist.logpdf_gradient(mean, hyppar1, hyppar2)
+            gradients[param + '_mean'] += np.sum(residuals) / stdev**2
+
+            dist, hyppar1, hyppar2 = self.params_prior[param + '_stdev']
+            gradients[param + '_stdev'] = dist.logpdf_gradient(stdev, hyppar1, hyppar2) * stdev
+            gradients[param + '_stdev'] += np.sum(residuals**2) / stdev**2 - self.no_series
+        return gradients
+
+    def log_prior_hessian(self):
+        """ The Hessian of the logarithm of the prior.
+
+            Returns:
+                A dict with an entry for each parameter (the diagonal of the
+                Hessian with respect to the free parameters).
+
+        """
+        template = self.series_models[0]
+        template.params = self.get_series_params(0)
+        template_hessians = template.log_prior_hessian()
+
+        hessians = {}
+        for param in self.params:
+            hessians.update({param: 0.0})
+        for param in self.shared_params:
+            hessians[param] = template_hessians[param]
+
+        for param in self.local_params:
+            mean = self.params[param + '_mean']
+            stdev = self.params[param + '_stdev']
+            residuals = self._local_residuals(param)
+
+            for i in range(self.no_series):
+                hessians[self._local_name(param, i)] = -1.0 / stdev**2
+
+            dist, hyppar1, hyppar2 = self.params_prior[param + '_mean']
+            hessians[param + '_mean'] = dist.logpdf_hessian(mean, hyppar1, hyppar2)
+            hessians[param + '_mean'] -= self.no_series / stdev**2
+
+            dist, hyppar1, hyppar2 = self.params_prior[param + '_stdev']
+            hessians[param + '_stdev'] = dist.logpdf_hessian(stdev, hyppar1, hyppar2) * stdev**2
+            hessians[param + '_stdev'] += dist.logpdf_gradient(stdev, hyppar1, hyppar2) * stdev
+            hessians[param + '_stdev'] -= 2.0 * np.sum(residuals**2) / stdev**2
+        return hessians
+
+    def _local_residuals(self, param):
+        """ Returns the deviations of the free local parameters from their mean. """
+        mean = self.params[param + '_mean']
+        residuals = [self.free_params[self._local_name(param, i)] - mean
+                     for i in range(self.no_series)]
+        return np.array(residuals)
+
+    def transform_params_to_free(self):
+        """ Computes and store the values of the reparameterised parameters.
+
+            The shared and local parameters are transformed as in the series
+            models and the standard deviations of the hyperparameters are
+            log-transformed.
+
+        """
+        for i in range(self.no_series):
+            model = self.series_models[i]
+            model.params = self.get_series_params(i)
+            model.transform_params_to_free()
+            if i == 0:
+                for param in self.shared_params:
+                    self.free_params[param] = model.free_params[param]
+            for param in self.local_params:
+                self.free_params[self._local_name(param, i)] = model.free_params[param]
+
+        for param in self.local_params:
+            self.free_params[param + '_mean'] = self.params[param + '_mean']
+            self.free_params[param + '_stdev'] = np.log(self.params[param + '_stdev'])
+
+    def transform_params_from_free(self):
+        """ Computes and store the values of the standard parameters.
+
+            See transform_params_to_free.
+
+        """
+        for i in range(self.no_series):
+            model = self.series_models[i]
+            for param in self.shared_params:
+                model.free_params[param] = self.free_params[param]
+            for param in self.local_params:
+                model.free_params[param] = self.free_params[self._local_name(param, i)]
+            model.transform_params_from_free()
+            if i == 0:
+                for param in self.shared_params:
+                    self.params[param] = model.params[param]
+            for param in self.local_params:
+                self.params[self._local_name(param, i)] = model.params[param]
+
+        for param in self.local_params:
+            self.params[param + '_mean'] = self.free_params[param + '_mean']
+            self.params[param + '_stdev'] = np.exp(self.free_params[param + '_stdev'])
+
+    def log_jacobian(self):
+        """ Computes the sum of the log-Jacobian.
+
+            The Jacobians of the shared parameters are given by the series
+            models. The local parameters have their prior on the free scale
+            and do not contribute.
+
+            Returns:
+                the sum of the logarithm of the Jacobian of the parameter
+                transformation for the parameters under inference as listed
+                in params_to_estimate.
+
+        """
+        jacobian = {}
+        for param in self.params:
+            jacobian.update({param: 0.0})
+        for param in self.shared_params:
+            jacobian[param] = self._series_log_jacobian(param)
+        for param in self.local_params:
+            jacobian[param + '_stdev'] = np.log(self.params[param + '_stdev'])
+        return self._compile_log_jacobian(jacobian)
+
+    def _series_log_jacobian(self, param):
+        """ Returns the log-Jacobian of a single parameter in the series models. """
+        template = self.series_models[0]
+        saved = (template.params_to_estimate, template.no_params_to_estimate)
+        template.params = self.get_series_params(0)
+        try:
+            template.params_to_estimate = param
+            template.no_params_to_estimate = 1
+            return template.log_jacobian()
+        finally:
+            template.params_to_estimate, template.no_params_to_estimate = saved
@@ -0,0 +1,280 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""System model class for a multivariate linear Gaussian state-space model."""
+import numpy as np
+import pandas as pd
+
+from models.linear_gaussian_model import LinearGaussianModel
+
+
+class MultivariateLinearGaussianModel(LinearGaussianModel):
+    """ System model class for a multivariate linear Gaussian state-space model.
+
+        Encodes the model with the parameterisation:
+
+        x[t+1] = mu + phi * A (x[t] - mu) + sigma[v] * v[t]
+        y[t]   = C x[t]                   + sigma[e] * e[t]
+
+        where the state x[t] has dimension state_dim and the observation y[t]
+        has dimension obs_dim. Here, mu is a vector with all elements equal
+        to the parameter mu and v[t], e[t] are independent and standard
+        Gaussian. The structure of the transition matrix A and the observation
+        matrix C are fixed and given at initialisation (identity matrices by
+        default). Factor models are obtained by letting C have fewer columns
+        than rows and local-linear trends by a suitable A.
+
+        The parameters of the model are (mu, phi, sigma[v], sigma[e]) with the
+        same reparameterisation and priors as in LinearGaussianModel.
+
+        The model is used together with the square-root Kalman methods, which
+        access the system through get_system_matrices and
+        get_system_matrix_derivatives. Override these methods (and
+        the parameter transformations) for other parameterisations.
+
+    """
+
+    def __init__(self, state_dim=10, transition_matrix=None, obs_matrix=None):
+        super(MultivariateLinearGaussianModel, self).__init__()
+        self.name = "Multivariate linear Gaussian state-space model with four parameters."
+        self.file_prefix = "multivariate_linear_gaussian_model"
+
+        if transition_matrix is None:
+            transition_matrix = np.eye(state_dim)
+        if obs_matrix is None:
+            obs_matrix = np.eye(state_dim)
+
+        self.transition_matrix = np.array(transition_matrix, dtype=float)
+        self.obs_matrix = np.array(obs_matrix, dtype=float)
+        self.state_dim = self.transition_matrix.shape[0]
+        self.obs_dim = self.obs_matrix.shape[0]
+
+        if self.transition_matrix.shape != (self.state_dim, self.state_dim):
+            raise ValueError("The transition matrix must be square.")
+        if self.obs_matrix.shape[1] != self.state_dim:
+            raise ValueError("The observation matrix must have state_dim columns.")
+
+    def get_system_matrices(self):
+        """ Returns the system matrices for the current parameters.
+
+            Returns:
+                A dict with the state mean (vector), the transition matrix,
+                the observation matrix and the lower Cholesky factors of the
+                state and observation noise covariance matrices.
+
+        """
+        return {'state_mean': self.params['mu'] * np.ones(self.state_dim),
+                'transition': self.params['phi'] * self.transition_matrix,
+                'state_cov_root': self.params['sigma_v'] * np.eye(self.state_dim),
+                'obs_matrix': self.obs_matrix,
+                'obs_cov_root': self.params['sigma_e'] * np.eye(self.obs_dim)
+               }
+
+    def get_system_matrix_derivatives(self):
+        """ Returns the derivatives of the system matrices.
+
+            The derivatives are with respect to the free (reparameterised)
+            parameters and are used to compute the gradients of the log joint
+            distribution of states and observations (Fisher's identity).
+
+            Returns:
+                A dict with an entry for each parameter (in the same order as
+                the attribute params) with the derivatives of the state mean,
+                the transition matrix and the state and observation noise
+                covariance matrices.
+
+        """
+        state_dim = self.state_dim
+        obs_dim = self.obs_dim
+        zero_vector = np.zeros(state_dim)
+        zero_state = np.zeros((state_dim, state_dim))
+        zero_obs = np.zeros((obs_dim, obs_dim))
+
+        derivatives = {}
+        derivatives.update({'mu': {'state_mean': np.ones(state_dim),
+                                   'transition': zero_state,
+                                   'state_cov': zero_state,
+                                   'obs_cov': zero_obs}})
+        derivatives.update({'phi': {'state_mean': zero_vector,
+                                    'transition': (1.0 - self.params['phi']**2) * self.transition_matrix,
+                                    'state_cov': zero_state,
+                                    'obs_cov': zero_obs}})
+        derivatives.update({'sigma_v': {'state_mean': zero_vector,
+                                        'transition': zero_state,
+                                        'state_cov': 2.0 * self.params['sigma_v']**2 * np.eye(state_dim),
+                                        'obs_cov': zero_obs}})
+        derivatives.update({'sigma_e': {'state_mean': zero_vector,
+                                        'transition': zero_state,
+                                        'state_cov': zero_state,
+                                        'obs_cov': 2.0 * self.params['sigma_e']**2 * np.eye(obs_dim)}})
+        return derivatives
+
+    def generate_initial_state(self, no_samples):
+        """ Generates no_samples from the initial state distribution.
+
+            Args:
+                no_samples: number of samples to generate (integer).
+
+            Returns:
+                An array (state_dim x no_samples) from the initial state
+                distribution (the stationary distribution if A is identity).
+
+        """
+        mean = self.params['mu']
+        noise_stdev = self.params['sigma_v'] / np.sqrt(1.0 - self.params['phi']**2)
+        return mean + noise_stdev * np.random.normal(size=(self.state_dim, no_samples))
+
+    def generate_state(self, cur_state, time_step):
+        """ Generates a new state by the state dynamics.
+
+            Args:
+                cur_state: the current state (array of length state_dim).
+                time_step: the current time step (integer).
+
+            Returns:
+                An array with a sample from the next time step.
+
+        """
+        system = self.get_system_matrices()
+        mean = system['state_mean']
+        mean = mean + np.dot(system['transition'], cur_state - mean)
+        noise = np.dot(system['state_cov_root'], np.random.normal(size=self.state_dim))
+        return mean + noise
+
+    def evaluate_state(self, next_state, cur_state, time_step):
+        """ Computes the probability of a state transition.
+
+            Args:
+                next_state: the next state (array of length state_dim)
+                cur_state: the current state (array of length state_dim).
+                time_step: the current time step (integer).
+
+            Returns:
+                The transition log-probability.
+
+        """
+        system = self.get_system_matrices()
+        mean = system['state_mean']
+        mean = mean + np.dot(system['transition'], cur_state - mean)
+        return _gaussian_logpdf(next_state, mean, system['state_cov_root'])
+
+    def log_state_transition_bound(self, time_step):
+        """ Computes an upper bound of the log-probability of a state transition.
+
+            Args:
+                time_step: the current time step (integer).
+
+            Returns:
+                A scalar which is larger than or equal to evaluate_state for
+                all next and current states at time_step.
+
+        """
+        stdev = self.params['sigma_v']
+        return -0.5 * self.state_dim * np.log(2.0 * np.pi) - self.state_dim * np.log(stdev)
+
+    def generate_obs(self, cur_state, time_step):
+        """ Generates a new observation by the observation dynamics.
+
+            Args:
+                cur_state: the current state (array of length state_dim).
+                time_step: the current time step (integer).
+
+            Returns:
+                An array with an observation.
+
+        """
+        system = self.get_system_matrices()
+        mean = np.dot(system['obs_matrix'], cur_state)
+        noise = np.dot(system['obs_cov_root'], np.random.normal(size=self.obs_dim))
+        return mean + noise
+
+    def evaluate_obs(self, cur_state, time_step):
+        """ Computes the probability of obtaining an observation.
+
+            Args:
+                cur_state: the current state (array of length state_dim).
+                time_step: the current time step (integer).
+
+            Returns:
+                The observation log-probability.
+
+        """
+        system = self.get_system_matrices()
+        mean = np.dot(system['obs_matrix'], cur_state)
+        return _gaussian_logpdf(self.obs[time_step], mean, system['obs_cov_root'])
+
+    def generate_data(self, file_name=None):
+        """ Generates data from model and saves it to file.
+
+            Data is generated according to the model object and stored as the
+            attributes obs (no_obs+1 x obs_dim) and states (no_obs+1 x
+            state_dim). The data is saved to a csv file with the columns
+            state_0, state_1, ..., observation_0, observation_1, ... if a
+            file name is provided.
+
+        """
+        self.states = np.zeros((self.no_obs + 1, self.state_dim))
+        self.obs = np.zeros((self.no_obs + 1, self.obs_dim))
+        self.states[0, :] = self.initial_state
+
+        for i in range(1, self.no_obs + 1):
+            self.states[i, :] = self.generate_state(self.states[i-1, :], i)
+            self.obs[i, :] = self.generate_obs(self.states[i, :], i)
+
+        if file_name:
+            columns = ['state_' + str(i) for i in range(self.state_dim)]
+            columns += ['observation_' + str(i) for i in range(self.obs_dim)]
+            data_frame = pd.DataFrame(data=np.hstack((self.states, self.obs)),
+                                      columns=columns)
+            data_frame.to_csv(file_name, index=False, header=True)
+            print("Wrote generated data to file: " + file_name + ".")
+
+    def import_data(self, file_name):
+        """ Imports data from file.
+
+            The csv file must have the columns observation_0, ..., observation_{obs_dim-1}
+            and optionally state_0, ..., state_{state_dim-1} (as written by
+            generate_data).
+
+        """
+        data_frame = pd.read_csv(file_name)
+        columns = ['observation_' + str(i) for i in range(self.obs_dim)]
+        if not set(columns).issubset(list(data_frame)):
+            raise ValueError("No observations in file, header must be " +
+                             "observation_0, observation_1, ...")
+
+        obs = data_frame[columns].values
+        if self.no_obs:
+            obs = obs[0:(self.no_obs + 1), :]
+        else:
+            self.no_obs = obs.shape[0] - 1
+        self.obs = np.array(obs, copy=True)
+
+        columns = ['state_' + str(i) for i in range(self.state_dim)]
+        if set(columns).issubset(list(data_frame)):
+            self.states = np.array(data_frame[columns].values[0:(self.no_obs + 1), :])
+
+        print("Loaded data from file: " + file_name + ".")
+
+
+def _gaussian_logpdf(value, mean, cov_root):
+    """ Log-density of a Gaussian given the lower Cholesky factor of the
+        covariance matrix. """
+    residual = np.linalg.solve(cov_root, np.asarray(value).flatten() - mean)
+    log_det = 2.0 * np.sum(np.log(np.abs(np.diag(cov_root))))
+    return -0.5 * (len(mean) * np.log(2.0 * np.pi) + log_det + np.sum(residual**2))
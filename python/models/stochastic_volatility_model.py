@@ -71,37 +71,42 @@ class StochasticVolatilityModel(BaseModel):
         self.params_to_estimate = []
         self.true_params = []
 
-    def generate_initial_state(self, no_samples):
+    def generate_initial_state(self, no_samples, noise=None):
         """ Generates no_samples from the initial state distribution.
 
             Args:
                 no_samples: number of samples to generate (integer).
+                noise: standard Gaussian noise to use instead of random
+                       numbers, e.g., from a quasi-random point set (array).
 
             Returns:
                 An array with no_samples from the initial state distribution.
 
         """
         mean = self.params['mu']
-        noise_stdev = self.params['sigma_v']
-        noise_stdev /= np.sqrt(1.0 - self.params['phi']**2)
-        return mean + noise_stdev * np.random.normal(size=(1, no_samples))
+        noise_stdev = self.params['sigma_v'] / np.sqrt(1.0 - self.params['phi']**2)
+        if noise is None:
+            noise = np.random.normal(size=(1, no_samples))
+        return mean + noise_stdev * noise
 
-    def generate_state(self, cur_state, time_step):
+    def generate_state(self, cur_state, time_step, noise=None):
         """ Generates a new state by the state dynamics.
 
             Args:
                 cur_state: the current state (array).
                 time_step: the current time step (integer).
+                noise: standard Gaussian noise to use instead of random
+                       numbers, e.g., from a quasi-random point set (array).
 
             Returns:
                 An array ofsamples from the next time step.
 
         """
-        mean = self.params['mu']
-        mean += self.params['phi'] * (cur_state - self.params['mu'])
+        mean = self.params['mu'] + self.params['phi'] * (cur_state - self.params['mu'])
         noise_stdev = self.params['sigma_v']
-        noise = noise_stdev * np.random.randn(1, len(cur_state))
-        return mean + noise
+        if noise is None:
+            noise = np.random.randn(1, len(cur_state))
+        return mean + noise_stdev * noise
 
     def evaluate_state(self, next_state, cur_state, time_step):
         """ Computes the probability of a state transition.
@@ -115,11 +120,24 @@ class StochasticVolatilityModel(BaseModel):
                 An array of transition log-probabilities.
 
         """
-        mean = self.params['mu']
-        mean += self.params['phi'] * (cur_state - self.params['mu'])
+        mean = self.params['mu'] + self.params['phi'] * (cur_state - self.params['mu'])
         stdev = self.params['sigma_v']
         return norm.logpdf(next_state, mean, stdev)
 
+    def log_state_transition_bound(self, time_step):
+        """ Computes an upper bound of the log-probability of a state transition.
+
+            Args:
+                time_step: the current time step (integer).
+
+            Returns:
+                A scalar which is larger than or equal to evaluate_state for
+                all next and current states at time_step.
+
+        """
+        stdev = self.params['sigma_v']
+        return -0.5 * np.log(2.0 * np.pi) - np.log(stdev)
+
     def generate_obs(self, cur_state, time_step):
         """ Generates a new observation by the observation dynamics.
 
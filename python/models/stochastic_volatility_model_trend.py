@@ -0,0 +1,193 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""System model class for a stochastic volatility model with a trend."""
+import numpy as np
+import pandas as pd
+
+from models.stochastic_volatility_model import StochasticVolatilityModel
+from helpers.distributions import gamma
+
+
+class StochasticVolatilityModelTrend(StochasticVolatilityModel):
+    """ System model class for a stochastic volatility model with a trend.
+
+        Encodes the model with the parameterisation:
+
+        x[t+1] = mu + phi * (x[t] - mu) + sigma[v] * v[t]
+        b[t+1] = b[t]                   + sigma[b] * w[t]
+        y[t]   = b[t] + exp(0.5 * x[t]) * e[t]
+
+        where e[t], v[t], w[t] are independent and standard Gaussian. The
+        parameters of the model are (mu, phi, sigma[v], sigma[b]) and the
+        inference model is reparameterised as in StochasticVolatilityModel
+        with sigma[b] = exp(kappa).
+
+        The model is conditionally linear Gaussian: given the log-volatility
+        x[t] (the non-linear state), the trend b[t] (the linear state) is
+        given by a linear Gaussian state-space model. The methods for the
+        non-linear state are inherited from StochasticVolatilityModel and the
+        linear part is given by get_linear_system. Hence, the model is used
+        with the Rao-Blackwellised particle filter, which marginalises the
+        trend using a Kalman filter for each particle.
+
+    """
+
+    def __init__(self):
+        super(StochasticVolatilityModelTrend, self).__init__()
+        self.name = "Stochastic volatility model with a trend."
+        self.file_prefix = "stochastic_volatility_model_trend"
+
+        self.params.update({'sigma_b': 0.1})
+        self.free_params.update({'sigma_b': np.log(0.1)})
+        self.no_params = len(self.params)
+        self.params_prior.update({'sigma_b': (gamma, 2.0, 20.0)})
+        self.trend = []
+
+    def get_linear_system(self, cur_state, time_step):
+        """ Returns the linear Gaussian model for the trend.
+
+            Args:
+                cur_state: the current non-linear state (array).
+                time_step: the current time step (integer).
+
+            Returns:
+                A dict with the mean, transition and state noise variance of
+                the trend dynamics b[t] = mean + transition * (b[t-1] - mean)
+                + noise and the observation matrix and noise variance in
+                y[t] = obs_matrix * b[t] + noise given the non-linear state.
+
+        """
+        return {'mean': 0.0,
+                'transition': 1.0,
+                'state_var': self.params['sigma_b']**2,
+                'obs_matrix': 1.0,
+                'obs_var': np.exp(cur_state)
+               }
+
+    def evaluate_obs(self, cur_state, time_step):
+        """ The observation density depends on the trend, which is not part
+            of the state in the particle filter. Use the Rao-Blackwellised
+            particle filter for this model. """
+        raise NotImplementedError("The observation density requires the " +
+                                  "trend, use RaoBlackwellisedParticleMethods.")
+
+    def log_joint_gradient(self, next_state, cur_state, time_index):
+        """ The gradient of the log joint density depends on the trend,
+            which is marginalised by the Rao-Blackwellised particle filter.
+            Gradients are not supported for this model, use mh0. """
+        raise NotImplementedError("Gradients are not supported for the " +
+                                  "model with trend, use mh0.")
+
+    def check_parameters(self):
+        """" Checks if parameters satisfies hard constraints on the parameters.
+
+                Returns:
+                    Boolean to indicate if the current parameters results in
+                    a stable system and obey the constraints on their values.
+
+        """
+        if self.params['sigma_b'] < 0.0:
+            return False
+        return super(StochasticVolatilityModelTrend, self).check_parameters()
+
+    def log_prior_gradient(self):
+        """ Returns the logarithm of the prior distribution.
+
+            Returns:
+                First value: a dict with an entry for each parameter.
+                Second value: the sum of the log-prior for all variables.
+
+        """
+        gradients = super(StochasticVolatilityModelTrend, self).log_prior_gradient()
+        gradients['sigma_b'] *= self.params['sigma_b']
+        return gradients
+
+    def log_prior_hessian(self):
+        """ The Hessian of the logarithm of the prior.
+
+            Returns:
+                A dict with an entry for each parameter.
+
+        """
+        gradients = super(StochasticVolatilityModel, self).log_prior_gradient()
+        hessians = super(StochasticVolatilityModelTrend, self).log_prior_hessian()
+
+        gradients['sigma_b'] *= self.params['sigma_b']
+        hessians['sigma_b'] *= self.params['sigma_b']**2
+        hessians['sigma_b'] += gradients['sigma_b']
+        return hessians
+
+    def transform_params_to_free(self):
+        """ Computes and store the values of the reparameterised parameters.
+
+            See the docstring for the model class for more information.
+
+        """
+        super(StochasticVolatilityModelTrend, self).transform_params_to_free()
+        self.free_params['sigma_b'] = np.log(self.params['sigma_b'])
+
+    def transform_params_from_free(self):
+        """ Computes and store the values of the standard parameters.
+
+            See the docstring for the model class for more information.
+
+        """
+        super(StochasticVolatilityModelTrend, self).transform_params_from_free()
+        self.params['sigma_b'] = np.exp(self.free_params['sigma_b'])
+
+    def log_jacobian(self):
+        """ Computes the sum of the log-Jacobian.
+
+            Returns:
+                the sum of the logarithm of the Jacobian of the parameter
+                transformation for the parameters under inference as listed
+                in params_to_estimate.
+
+        """
+        jacobian = {}
+        jacobian.update({'mu': 0.0})
+        jacobian.update({'phi': np.log(1.0 - self.params['phi']**2)})
+        jacobian.update({'sigma_v': np.log(self.params['sigma_v'])})
+        jacobian.update({'sigma_b': np.log(self.params['sigma_b'])})
+        return self._compile_log_jacobian(jacobian)
+
+    def generate_data(self, file_name=None):
+        """ Generates data from model and saves it to file.
+
+            The log-volatility is stored in the attribute states, the trend
+            in the attribute trend and the observations in obs. The data is
+            saved to a csv file with the columns state, trend and observation
+            if a file name is provided.
+
+        """
+        self.states = np.zeros((self.no_obs + 1, 1))
+        self.trend = np.zeros((self.no_obs + 1, 1))
+        self.obs = np.zeros((self.no_obs + 1, 1))
+        self.states[0] = self.initial_state
+
+        for i in range(1, self.no_obs + 1):
+            self.states[i] = self.generate_state(self.states[i-1], i)
+            self.trend[i] = self.trend[i-1] + self.params['sigma_b'] * np.random.randn()
+            self.obs[i] = self.trend[i] + self.generate_obs(self.states[i], i)
+
+        if file_name:
+            data_frame = pd.DataFrame(data=np.hstack((self.states, self.trend, self.obs)),
+                                      columns=['state', 'trend', 'observation'])
+            data_frame.to_csv(file_name, index=False, header=True)
+            print("Wrote generated data to file: " + file_name + ".")
@@ -0,0 +1,431 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Ensemble of Metropolis-Hastings chains run in lock-step."""
+import copy
+import time
+import numpy as np
+
+from helpers.file_system import write_to_json
+from parameter.base_parameter_inference import BaseParameterInference
+
+
+class EnsembleMetropolisHastings(BaseParameterInference):
+    """ Ensemble of Metropolis-Hastings chains run in lock-step.
+
+        Runs no_chains independent MH chains, where all the steps in each
+        iteration (proposal, prior, Jacobian, accept/reject and storage of the
+        traces) are carried out as array operations over the chains. The
+        log-likelihood (and gradients) of all the proposed parameters are
+        estimated in a single call to filter_batch (or smoother_batch) of the
+        state estimator, which is vectorised for the Kalman methods.
+
+        The model must support array-valued parameters in the methods
+        transform_params_from_free, log_prior and log_jacobian (which is the
+        case for the models in this code base). Parameters resulting in a
+        non-finite log-prior, log-Jacobian or log-likelihood are rejected.
+
+        Args:
+            model: a model class to conduct inference on.
+            alg_type: the type of MH algorithm to use. (string) Choose from:
+                mh0: standard MH with a Gaussian random walk proposal.
+                mh1: the MALA algorithm using the gradient of the log-target.
+                mh2: the (simplified) manifold MALA algorithm using the
+                     Segal-Weinstein estimate of the Hessian. Proposals with
+                     an estimate which is not positive definite are rejected.
+
+            new_settings: a dict with the following settings:
+                'no_iters': number of MH iterations to carry out. (integer)
+
+                'no_burnin_iters': number of iterations to discard as burn-in.
+
+                'no_chains': number of chains in the ensemble. (integer)
+
+                'step_size': the step length of the proposal. (float)
+
+                'base_hessian': the Hessian estimate for the proposal. (array)
+
+                'initial_params': parameter vector to initialise the chains
+                                  in. (array)
+
+                'initial_params_spread': standard deviation of the Gaussian
+                                         perturbations of the (free) initial
+                                         parameters of each chain. (float)
+
+                'no_iters_between_progress_reports': how often shall progress
+                                                     reports be given to user.
+
+    """
+    def __init__(self, model, alg_type, new_settings=None):
+        self.use_grad_info = False
+        self.use_hess_info = False
+
+        self.settings = {'no_iters': 1000,
+                         'no_burnin_iters': 250,
+                         'no_chains': 100,
+                         'step_size': 0.5,
+                         'base_hessian': np.eye(3) * 0.10**2,
+                         'initial_params': (0.2, 0.5, 1.0),
+                         'initial_params_spread': 0.0,
+                         'verbose': False,
+                         'no_iters_between_progress_reports': 100,
+                         'hessian_estimate': None
+                        }
+        if new_settings:
+            self.settings.update(new_settings)
+
+        if alg_type == 'mh0':
+            self.name = "Ensemble of zero-order Metropolis-Hastings chains"
+        elif alg_type == 'mh1':
+            self.name = "Ensemble of first-order Metropolis-Hastings chains"
+            self.use_grad_info = True
+        elif alg_type == 'mh2':
+            self.name = "Ensemble of second-order Metropolis-Hastings chains"
+            self.use_grad_info = True
+            self.use_hess_info = True
+            self.settings['hessian_estimate'] = 'segal_weinstein'
+        else:
+            raise ValueError("Unknown MH variant selected...")
+        self.alg_type = alg_type
+
+        self.model = model
+        no_iters = self.settings['no_iters']
+        no_chains = self.settings['no_chains']
+        no_params = self.model.no_params_to_estimate
+
+        if self.settings['no_burnin_iters'] >= no_iters:
+            raise ValueError("EnsembleMetropolisHastings: no_burnin_iters " +
+                             "cannot be larger or equal to no_iters.")
+
+        self.free_params = np.zeros((no_iters, no_chains, no_params))
+        self.params = np.zeros((no_iters, no_chains, no_params))
+        self.log_prior = np.zeros((no_iters, no_chains))
+        self.log_like = np.zeros((no_iters, no_chains))
+        self.log_jacobian = np.zeros((no_iters, no_chains))
+        self.accept_prob = np.zeros((no_iters, no_chains))
+        self.accepted = np.zeros((no_iters, no_chains))
+
+        self.gradient = np.zeros((no_iters, no_chains, no_params))
+        self.nat_gradient = np.zeros((no_iters, no_chains, no_params))
+        self.hess = np.zeros((no_iters, no_chains, no_params, no_params))
+        self.current_iter = 0
+
+    def run(self, state_estimator):
+        """ Runs the ensemble of Metropolis-Hastings chains.
+
+            Args:
+                state_estimator: a state estimator object (with the methods
+                                 filter_batch and smoother_batch).
+
+            Returns:
+                Nothing.
+
+        """
+        self.start_time = time.time()
+        self._print_greeting(state_estimator)
+
+        if self.use_grad_info or self.use_hess_info:
+            state_estimator.settings['estimate_gradient'] = True
+
+        no_iters = self.settings['no_iters']
+        no_chains = self.settings['no_chains']
+        self.current_iter = 0
+        self._initialise_params(state_estimator)
+
+        for i in range(1, no_iters):
+            self.current_iter = i
+            prop = self._propose_params()
+            prop.update(self._evaluate_params(state_estimator, prop['free_params']))
+            log_accept_prob = self._compute_log_accept_prob(prop)
+
+            with np.errstate(over='ignore', invalid='ignore'):
+                accept_prob = np.minimum(1.0, np.exp(log_accept_prob))
+            accept_prob[~np.isfinite(accept_prob)] = 0.0
+            accepted = np.random.uniform(size=no_chains) < accept_prob
+
+            self.accept_prob[i, :] = accept_prob
+            self.accepted[i, :] = accepted
+            self._store_state(i, self._current_state(i - 1))
+            self._store_state(i, prop, accepted)
+
+            flag = self.settings['no_iters_between_progress_reports']
+            flag = np.remainder(i + 1, flag) == 0
+            if flag:
+                self.print_progress_report()
+
+        print("Run of ensemble MH algorithm complete...")
+        print("It took: {:.2f} seconds to run this code.".format((time.time() - self.start_time)))
+        self.time_per_iteration = (time.time() - self.start_time) / no_iters
+
+    def _initialise_params(self, state_estimator):
+        """ Initialise the chains around initial_params. """
+        no_chains = self.settings['no_chains']
+        self.model.store_params(self.settings['initial_params'])
+        initial_free_params = self.model.get_free_params()
+
+        free_params = np.tile(initial_free_params, (no_chains, 1))
+        free_params += self.settings['initial_params_spread'] * \
+                       np.random.normal(size=free_params.shape)
+
+        init = self._evaluate_params(state_estimator, free_params)
+        if not np.all(init['valid']):
+            raise NameError("The initial values of the parameters does " +
+                            "not result in a valid model for all chains.")
+
+        init.update({'free_params': free_params})
+        self._store_state(0, init)
+        self.accept_prob[0, :] = 1.0
+        self.accepted[0, :] = 1.0
+
+    def _evaluate_params(self, state_estimator, free_params):
+        """ Evaluates the log-target (and its derivatives) for all chains. """
+        no_chains, no_params = free_params.shape
+        model = self.model
+        saved_params = (copy.deepcopy(model.params), copy.deepcopy(model.free_params))
+
+        try:
+            with np.errstate(all='ignore'):
+                model.params = copy.deepcopy(model.true_params)
+                model.transform_params_to_free()
+                for j, param in enumerate(model.params_to_estimate):
+                    model.free_params[param] = free_params[:, j]
+                model.transform_params_from_free()
+
+                params = np.zeros((no_chains, no_params))
+                for j, param in enumerate(model.params_to_estimate):
+                    params[:, j] = model.params[param]
+                log_jacobian = np.ones(no_chains) * model.log_jacobian()
+                log_prior = np.ones(no_chains) * model.log_prior()[1]
+        finally:
+            model.params, model.free_params = saved_params
+
+        valid = np.isfinite(log_jacobian) & np.isfinite(log_prior)
+        valid &= np.all(np.isfinite(params), axis=1)
+
+        log_like = -np.inf * np.ones(no_chains)
+        gradient = np.zeros((no_chains, no_params))
+        nat_gradient = np.zeros((no_chains, no_params))
+        hess = np.tile(self._base_inverse_hessian(), (no_chains, 1, 1))
+
+        idx = np.where(valid)[0]
+        if len(idx) > 0:
+            with np.errstate(all='ignore'):
+                output = self._estimate_log_like(state_estimator, params[idx, :], idx)
+            log_like[idx] = output['log_like']
+            if self.use_grad_info:
+                gradient[idx, :] = output['gradient_internal']
+
+            if self.use_hess_info:
+                hess_idx, is_pd = self._invert_hessians(output['hessian_internal'])
+                hess[idx, :, :] = hess_idx
+                valid[idx] &= is_pd
+
+        valid &= np.isfinite(log_like) & np.all(np.isfinite(gradient), axis=1)
+
+        if self.use_grad_info:
+            step_size = 0.5 * self.settings['step_size']**2
+            nat_gradient = step_size * np.einsum('cij,cj->ci', hess, gradient)
+
+        return {'params': params,
+                'log_jacobian': log_jacobian,
+                'log_prior': log_prior,
+                'log_like': log_like,
+                'gradient': gradient,
+                'nat_gradient': nat_gradient,
+                'hess': hess,
+                'valid': valid
+               }
+
+    def _estimate_log_like(self, state_estimator, params, idx):
+        """ Estimates the log-likelihood (and gradients) for the chains in idx. """
+        if self.use_grad_info:
+            return state_estimator.smoother_batch(self.model, params)
+        return state_estimator.filter_batch(self.model, params)
+
+    def _base_inverse_hessian(self):
+        """ The (scaled) negative inverse Hessian used by mh0 and mh1. """
+        return self.settings['step_size']**2 * np.array(self.settings['base_hessian'])
+
+    def _invert_hessians(self, hessians):
+        """ Inverts the Segal-Weinstein estimates of the negative Hessian of
+            each chain and checks if the inverses are positive definite. """
+        no_chains, no_params, _ = hessians.shape
+        inverse_hessians = np.tile(self._base_inverse_hessian(), (no_chains, 1, 1))
+        is_pd = np.zeros(no_chains, dtype=bool)
+
+        with np.errstate(all='ignore'):
+            eigenvalues = np.linalg.eigvalsh(hessians)
+        is_pd = np.all(np.isfinite(eigenvalues), axis=1)
+        is_pd[is_pd] = np.all(eigenvalues[is_pd] > 0.0, axis=1)
+
+        if np.any(is_pd):
+            inverse_hessians[is_pd] = np.linalg.inv(hessians[is_pd])
+            inverse_hessians[is_pd] *= self.settings['step_size']**2
+        return inverse_hessians, is_pd
+
+    def _propose_params(self):
+        """ Proposes new parameters for all chains given the current ones. """
+        i = self.current_iter
+        no_chains, no_params = self.free_params.shape[1:]
+
+        cur_free_params = self.free_params[i - 1, :, :]
+        cur_nat_grad = self.nat_gradient[i - 1, :, :]
+        cur_hess_root = np.linalg.cholesky(self.hess[i - 1, :, :, :])
+
+        perturbation = np.random.normal(size=(no_chains, no_params))
+        perturbation = np.einsum('cij,cj->ci', cur_hess_root, perturbation)
+
+        return {'free_params': cur_free_params + cur_nat_grad + perturbation}
+
+    def _compute_log_accept_prob(self, prop):
+        """ Computes the logarithm of the acceptance probabilities. """
+        cur = self._current_state(self.current_iter - 1)
+
+        log_prior_diff = prop['log_prior'] - cur['log_prior']
+        log_like_diff = prop['log_like'] - cur['log_like']
+        log_jacob_diff = prop['log_jacobian'] - cur['log_jacobian']
+
+        prop_prop = _gaussian_logpdf(prop['free_params'],
+                                     cur['free_params'] + cur['nat_gradient'],
+                                     cur['hess'])
+        cur_prop = _gaussian_logpdf(cur['free_params'],
+                                    prop['free_params'] + prop['nat_gradient'],
+                                    prop['hess'])
+
+        with np.errstate(invalid='ignore'):
+            log_accept_prob = log_prior_diff + log_like_diff + log_jacob_diff
+            log_accept_prob += cur_prop - prop_prop
+        log_accept_prob[~prop['valid']] = -np.inf
+        return log_accept_prob
+
+    def _current_state(self, iter):
+        """ Returns the state of all chains at an iteration. """
+        return {'free_params': self.free_params[iter, :, :],
+                'params': self.params[iter, :, :],
+                'log_jacobian': self.log_jacobian[iter, :],
+                'log_prior': self.log_prior[iter, :],
+                'log_like': self.log_like[iter, :],
+                'gradient': self.gradient[iter, :, :],
+                'nat_gradient': self.nat_gradient[iter, :, :],
+                'hess': self.hess[iter, :, :, :]
+               }
+
+    def _store_state(self, iter, state, idx=None):
+        """ Stores the state of the chains in idx (default all) at iter. """
+        if idx is None:
+            idx = np.ones(self.settings['no_chains'], dtype=bool)
+        self.free_params[iter, idx, :] = state['free_params'][idx]
+        self.params[iter, idx, :] = state['params'][idx]
+        self.log_jacobian[iter, idx] = state['log_jacobian'][idx]
+        self.log_prior[iter, idx] = state['log_prior'][idx]
+        self.log_like[iter, idx] = state['log_like'][idx]
+        self.gradient[iter, idx, :] = state['gradient'][idx]
+        self.nat_gradient[iter, idx, :] = state['nat_gradient'][idx]
+        self.hess[iter, idx, :, :] = state['hess'][idx]
+
+    def _print_greeting(self, state_estimator):
+        print("")
+        print("###################################################################")
+        print("Starting ensemble MH algorithm...")
+        print("")
+        print("Sampling from the parameter posterior using: " + self.name)
+        print("in the model: " + self.model.name)
+        print("")
+        print("Likelihood estimated using:")
+        print(state_estimator.name)
+        print("")
+        print("Running {} chains for {} iterations.".format(self.settings['no_chains'],
+                                                         self.settings['no_iters']))
+        print("###################################################################")
+
+    def print_progress_report(self):
+        """ Prints a progress report to the screen during a run. """
+        iter = self.current_iter
+        mean_time_per_iter = (time.time() - self.start_time) / iter
+        est_time_remaining = mean_time_per_iter * (self.settings['no_iters'] - iter)
+
+        print("###################################################################")
+        print(" Iteration: " + str(iter + 1) + " of : "
+              + str(self.settings['no_iters']) + " completed.")
+        print(" Time per iteration: {:.3f}s and estimated time remaining: {:.3f}s.".format(mean_time_per_iter, est_time_remaining))
+        print("")
+        print(" Current posterior mean estimate (all chains): ")
+        print(["%.4f" % v for v in np.mean(self.params[range(iter), :, :], axis=(0, 1))])
+        print("")
+        print(" Current acceptance rate (mean over chains):")
+        print("%.4f" % np.mean(self.accepted[range(iter), :]))
+        print("###################################################################")
+
+    def get_samples(self):
+        """ Returns the samples after burn-in pooled over all chains. """
+        idx = range(self.settings['no_burnin_iters'], self.settings['no_iters'])
+        return self.params[idx, :, :].reshape((-1, self.model.no_params_to_estimate))
+
+    def compile_results(self, sim_name=None, sim_desc=None):
+        """ Compiles results after a run (traces have the dimensions
+            iterations x chains x parameters). """
+        idx = range(self.settings['no_burnin_iters'], self.settings['no_iters'])
+        current_time = time.strftime("%c")
+
+        mcmcout = {}
+        mcmcout.update({'params': self.params[idx, :, :]})
+        mcmcout.update({'free_params': self.free_params[idx, :, :]})
+        mcmcout.update({'log_like': self.log_like[idx, :]})
+        mcmcout.update({'accept_prob': self.accept_prob[idx, :]})
+        mcmcout.update({'accepted': self.accepted[idx, :]})
+        mcmcout.update({'simulation_description': sim_desc})
+        mcmcout.update({'simulation_name': sim_name})
+        mcmcout.update({'simulation_time': current_time})
+        mcmcout.update({'time_per_iteration': self.time_per_iteration})
+
+        data = {}
+        data.update({'observations': self.model.obs})
+        data.update({'simulation_description': sim_desc})
+        data.update({'simulation_name': sim_name})
+        data.update({'simulation_time': current_time})
+
+        settings = copy.deepcopy(self.settings)
+        settings.update({'sampler_name': self.name})
+        settings.update({'simulation_description': sim_desc})
+        settings.update({'simulation_name': sim_name})
+        settings.update({'simulation_time': current_time})
+        return mcmcout, data, settings
+
+    def save_to_file(self, output_path=None, sim_name=None, sim_desc=None):
+        """ Stores the output from a run to file (as JSON). """
+        if output_path is None:
+            raise ValueError("No output path given...")
+
+        mcout, data, settings = self.compile_results(sim_name=sim_name,
+                                                     sim_desc=sim_desc)
+        desc = {'description': settings['simulation_description'],
+                'time': settings['simulation_time']
+               }
+        write_to_json(mcout, output_path, sim_name, 'mcmc_output.json')
+        write_to_json(data, output_path, sim_name, 'data.json')
+        write_to_json(settings, output_path, sim_name, 'settings.json')
+        write_to_json(desc, output_path, sim_name, 'description.txt')
+
+
+def _gaussian_logpdf(x, mean, cov):
+    """ Log-density of Gaussians with a covariance matrix for each row. """
+    no_params = x.shape[1]
+    cov_root = np.linalg.cholesky(cov)
+    residual = np.linalg.solve(cov_root, (x - mean)[:, :, np.newaxis])[:, :, 0]
+    log_det = 2.0 * np.sum(np.log(np.diagonal(cov_root, axis1=1, axis2=2)), axis=1)
+    return -0.5 * (no_params * np.log(2.0 * np.pi) + log_det + np.sum(residual**2, axis=1))
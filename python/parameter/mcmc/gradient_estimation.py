@@ -36,6 +36,7 @@ def get_gradient(mcmc, state_estimator):
     """
     if mcmc.use_grad_info:
         gradient = state_estimator.results['gradient_internal']
+        gradient = mcmc.settings['temperature'] * gradient
     else:
         gradient = np.zeros(mcmc.model.no_params_to_estimate)
 
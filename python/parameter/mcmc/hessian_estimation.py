@@ -67,13 +67,14 @@ def get_hessian(mcmc, state_estimator, prop_gradient=None):
 
     # Estimate Hessian using Kalman smoothing or Quasi-Newton methods
     if mcmc.use_hess_info:
-        if mcmc.settings['hessian_estimate'] is 'segal_weinstein':
+        if mcmc.settings['hessian_estimate'] == 'segal_weinstein':
             hessian_est = state_estimator.results['hessian_internal']
+            hessian_est = mcmc.settings['temperature'] * hessian_est
             inverse_hessian = np.real(inverse_hessian)
             inverse_hessian = np.linalg.inv(hessian_est)
             inverse_hessian *= step_size
             return correct_hessian(inverse_hessian, mcmc)
-        if mcmc.settings['hessian_estimate'] is 'quasi_newton':
+        if mcmc.settings['hessian_estimate'] == 'quasi_newton':
             if mcmc.current_iter > mcmc.settings['qn_memory_length']:
                 inverse_hessian, no_samples = quasi_newton(mcmc, prop_gradient)
                 if inverse_hessian is not None:
@@ -148,7 +149,7 @@ def correct_hessian(estimate, mcmc):
         #           ", switched to negative Hessian estimate...")
         #     return -estimate
 
-        if strategy is 'replace' or estimate is None:
+        if strategy == 'replace' or estimate is None:
             if mcmc.current_iter > mcmc.settings['no_burnin_iters']:
                 if mcmc.settings['hessian_correction_verbose']:
                     print("Iteration: " + str(mcmc.current_iter) +
@@ -169,7 +170,7 @@ def correct_hessian(estimate, mcmc):
                 return step_size * mcmc.settings['base_hessian']
 
         # Add a diagonal matrix proportional to the largest negative eigenvalue
-        elif strategy is 'regularise':
+        elif strategy == 'regularise':
             min_eigval = np.min(np.linalg.eig(estimate)[0])
             if mcmc.settings['hessian_correction_verbose']:
                 print("Iteration: " + str(mcmc.current_iter) +
@@ -185,7 +186,7 @@ def correct_hessian(estimate, mcmc):
             return corrected_estimate
 
         # Flip the negative eigenvalues
-        elif strategy is 'flip':
+        elif strategy == 'flip':
             if mcmc.settings['hessian_correction_verbose']:
                 print("Iteration: " + str(mcmc.current_iter) +
                       ", corrected Hessian by flipping negative eigenvalues " +
@@ -0,0 +1,122 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Helpers for the mixture of Student's t proposal in independent MH."""
+import numpy as np
+from scipy.special import gammaln, logsumexp
+
+
+def fit(samples, no_components=2, dof=5.0, no_em_iters=100):
+    """ Fits a mixture of multivariate Student's t distributions to samples.
+
+        The locations, scale matrices and weights are given by the mixture
+        of Gaussians fitted to the samples by the EM algorithm. The Student's
+        t components with dof degrees of freedom have heavier tails than the
+        fitted Gaussians, which is required for the independent MH algorithm
+        to be geometrically ergodic.
+
+        Args:
+            samples: an array (no_samples x no_params) of (free) parameters,
+                     e.g. the latter part of the burn-in.
+            no_components: number of components in the mixture. (integer)
+            dof: the degrees of freedom of the components. (float)
+            no_em_iters: the maximum number of EM iterations. (integer)
+
+        Returns:
+            A dict with the weights, means, covs and dof of the mixture.
+
+    """
+    samples = np.atleast_2d(samples)
+    no_samples, no_params = samples.shape
+    no_components = int(min(no_components, no_samples))
+    regularisation = 1e-8 * np.eye(no_params)
+
+    # Initialise the components at random samples with the sample covariance
+    idx = np.random.choice(no_samples, no_components, replace=False)
+    means = samples[idx, :]
+    covs = np.tile(np.atleast_2d(np.cov(samples, rowvar=False)) + regularisation,
+                   (no_components, 1, 1))
+    weights = np.ones(no_components) / no_components
+
+    for _ in range(no_em_iters):
+        # E-step: responsibilities of each component
+        log_resp = np.zeros((no_samples, no_components))
+        for k in range(no_components):
+            log_resp[:, k] = np.log(weights[k]) + _gaussian_logpdf(samples, means[k], covs[k])
+        log_norm = logsumexp(log_resp, axis=1)
+        resp = np.exp(log_resp - log_norm[:, np.newaxis])
+
+        # M-step: weights, means and covariances of each component
+        old_means = np.array(means)
+        counts = np.sum(resp, axis=0) + 1e-12
+        weights = counts / no_samples
+        means = np.dot(resp.transpose(), samples) / counts[:, np.newaxis]
+        for k in range(no_components):
+            residual = samples - means[k]
+            covs[k] = np.dot((resp[:, k, np.newaxis] * residual).transpose(), residual)
+            covs[k] = covs[k] / counts[k] + regularisation
+
+        if np.max(np.abs(means - old_means)) < 1e-8:
+            break
+
+    return {'weights': weights, 'means': means, 'covs': covs, 'dof': float(dof)}
+
+
+def sample(proposal, no_samples):
+    """ Draws no_samples from the mixture (an array no_samples x no_params). """
+    no_params = proposal['means'].shape[1]
+    dof = proposal['dof']
+    components = np.random.choice(len(proposal['weights']), no_samples,
+                                  p=proposal['weights'])
+
+    output = np.zeros((no_samples, no_params))
+    for i in range(no_samples):
+        k = components[i]
+        cov_root = np.linalg.cholesky(proposal['covs'][k])
+        scale = np.sqrt(dof / np.random.chisquare(dof))
+        output[i, :] = proposal['means'][k] + scale * np.dot(cov_root, np.random.normal(size=no_params))
+    return output
+
+
+def logpdf(proposal, params):
+    """ Computes the log-density of the mixture for each row of params. """
+    params = np.atleast_2d(params)
+    no_params = params.shape[1]
+    dof = proposal['dof']
+
+    log_dens = np.zeros((params.shape[0], len(proposal['weights'])))
+    for k in range(len(proposal['weights'])):
+        cov_root = np.linalg.cholesky(proposal['covs'][k])
+        residual = np.linalg.solve(cov_root, (params - proposal['means'][k]).transpose())
+        quad_term = np.sum(residual**2, axis=0)
+        log_det = 2.0 * np.sum(np.log(np.diag(cov_root)))
+
+        log_dens[:, k] = np.log(proposal['weights'][k])
+        log_dens[:, k] += gammaln(0.5 * (dof + no_params)) - gammaln(0.5 * dof)
+        log_dens[:, k] -= 0.5 * (no_params * np.log(dof * np.pi) + log_det)
+        log_dens[:, k] -= 0.5 * (dof + no_params) * np.log1p(quad_term / dof)
+    return logsumexp(log_dens, axis=1)
+
+
+def _gaussian_logpdf(params, mean, cov):
+    """ Log-density of a multivariate Gaussian for each row of params. """
+    no_params = params.shape[1]
+    cov_root = np.linalg.cholesky(cov)
+    residual = np.linalg.solve(cov_root, (params - mean).transpose())
+    log_det = 2.0 * np.sum(np.log(np.diag(cov_root)))
+    return -0.5 * (no_params * np.log(2.0 * np.pi) + log_det + np.sum(residual**2, axis=0))
@@ -0,0 +1,246 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Planning of the memory used by a run of the MH algorithm."""
+import multiprocessing
+
+from parameter.mcmc.recording import RECORDING_LEVELS
+from parameter.mcmc.recording import get_recorded_traces, get_window
+
+BYTES_PER_FLOAT = 8
+BYTES_PER_MB = 1024.0**2
+
+# Approximate number of bytes per value when the output is written to file
+# by save_to_file (a copy of the array, a list of Python floats, the JSON
+# string and its encoded bytes)
+BYTES_PER_SAVED_VALUE = BYTES_PER_FLOAT + 32 + 2 * 22
+
+# The traces which are stored in the output file by save_to_file (after
+# the burn-in)
+SAVED_TRACES = ('params', 'prop_params', 'states', 'accept_prob', 'accepted',
+                'no_samples_hess_est', 'nat_gradient', 'hess')
+
+
+def get_trace_shapes(no_iters, no_params, no_obs):
+    """ Returns the shapes of the traces allocated by the MH algorithm. """
+    shapes = {}
+    for name in ('free_params', 'params', 'prop_free_params', 'prop_params',
+                 'gradient', 'nat_gradient', 'prop_grad', 'prop_nat_grad'):
+        shapes[name] = (no_iters, no_params)
+    for name in ('log_prior', 'log_like', 'log_jacobian', 'prop_log_prior',
+                 'prop_log_like', 'prop_log_jacobian', 'accept_prob',
+                 'accepted', 'no_samples_hess_est'):
+        shapes[name] = (no_iters, 1)
+    for name in ('states', 'prop_states'):
+        shapes[name] = (no_iters, no_obs + 1)
+    for name in ('hess', 'prop_hess'):
+        shapes[name] = (no_iters, no_params, no_params)
+    return shapes
+
+
+def get_state_estimator_memory(state_estimator, no_obs, no_params):
+    """ Returns the memory (bytes) used by one run of a state estimator.
+
+        Particle methods store the particles, weights and ancestors (before
+        and after resampling) for all time steps and the FFBSi smoother
+        also the sampled trajectories. Kalman methods store a few vectors
+        of the length of the data. Other state estimators are assumed to
+        use the same memory as a Kalman method.
+
+    """
+    settings = getattr(state_estimator, 'settings', None) or {}
+    no_values = 10 * (no_obs + 1) + no_params * (no_obs + 1)
+    no_particles = settings.get('no_particles')
+    if no_particles:
+        no_values += 4 * int(no_particles) * no_obs
+        if settings.get('smoothing_method') == 'ffbsi':
+            no_values += 2 * int(settings.get('ffbsi_no_trajectories', 0)) * no_obs
+    return no_values * BYTES_PER_FLOAT
+
+
+def get_no_concurrent_evaluations(settings, no_replicas=1):
+    """ Returns the number of state estimators which run at the same time
+        (in each of the no_replicas replicas of parallel tempering). """
+    no_workers = 1
+    if settings.get('mtm_no_candidates', 1) > 1:
+        no_workers = settings.get('mtm_no_workers') or multiprocessing.cpu_count()
+    if settings.get('independent_phase', False):
+        no_workers = max(no_workers, settings.get('independent_no_workers') or
+                         multiprocessing.cpu_count())
+    return max(int(no_workers), 1) * max(int(no_replicas), 1)
+
+
+def plan_memory(settings, no_params, no_obs, state_estimator=None, no_replicas=1):
+    """ Computes the expected peak memory of a run of the MH algorithm.
+
+        The recorded traces of the MH algorithm (see the setting recording)
+        are allocated for the entire run, so the peak is given by the traces
+        together with the largest of the memory used by the state estimators
+        (one for each worker evaluating candidates concurrently) and the
+        memory used when the output is written to file. For parallel
+        tempering, each replica has its own traces and state estimators but
+        only the output of the cold chain is written. The memory of the
+        Python process itself (the interpreter, modules and data) is not
+        included.
+
+        Args:
+            settings: the settings of the MH algorithm. (dict)
+            no_params: number of parameters to estimate. (integer)
+            no_obs: number of observations. (integer)
+            state_estimator: the state estimator. (None: not included)
+            no_replicas: number of replicas in parallel tempering. (integer)
+
+        Returns:
+            A dict with the memory (MB) of each trace, the total of the
+            traces, the state estimators, the output and the peak (also for
+            each of the recording levels).
+
+    """
+    state_estimator_memory = 0.0
+    no_evaluations = get_no_concurrent_evaluations(settings, no_replicas)
+    if state_estimator is not None:
+        state_estimator_memory = no_evaluations * \
+            get_state_estimator_memory(state_estimator, no_obs, no_params) / BYTES_PER_MB
+
+    plan = _get_plan(settings, no_params, no_obs, state_estimator_memory, no_replicas)
+    plan['no_concurrent_evaluations'] = no_evaluations
+
+    plan['peak_by_recording'] = {}
+    for recording in RECORDING_LEVELS:
+        level_settings = dict(settings, recording=recording)
+        plan['peak_by_recording'][recording] = _get_plan(
+            level_settings, no_params, no_obs, state_estimator_memory, no_replicas)['peak']
+    return plan
+
+
+def _get_plan(settings, no_params, no_obs, state_estimator_memory, no_replicas=1):
+    """ Computes the memory of the traces and the output for the settings. """
+    no_iters = int(settings['no_iters'])
+    no_burnin_iters = int(settings['no_burnin_iters'])
+    recorded = get_recorded_traces(settings)
+    window = get_window(settings)
+
+    traces = {}
+    for name, shape in get_trace_shapes(no_iters, no_params, no_obs).items():
+        size = 1 if name in recorded else window / float(no_iters)
+        for length in shape:
+            size *= int(length)
+        traces[name] = no_replicas * size * BYTES_PER_FLOAT / BYTES_PER_MB
+
+    # The output only includes the iterations after the burn-in (of the
+    # cold chain)
+    saved_fraction = max(no_iters - no_burnin_iters, 0) / float(no_iters * no_replicas)
+    output_traces = {name: traces[name] * saved_fraction * BYTES_PER_SAVED_VALUE /
+                     BYTES_PER_FLOAT for name in SAVED_TRACES if name in recorded}
+
+    plan = {'no_iters': no_iters,
+            'no_replicas': no_replicas,
+            'recording': settings['recording'],
+            'traces': traces,
+            'traces_total': sum(traces.values()),
+            'state_estimator': state_estimator_memory,
+            'output_traces': output_traces,
+            'output': sum(output_traces.values())
+            }
+    plan['peak'] = plan['traces_total'] + max(plan['state_estimator'], plan['output'])
+    return plan
+
+
+def get_suggestions(plan, budget):
+    """ Returns suggestions for reducing the peak memory below the budget.
+
+        Args:
+            plan: the output from plan_memory.
+            budget: the memory budget. (MB)
+
+        Returns:
+            A list of strings with the alternatives and their expected peaks.
+
+    """
+    suggestions = []
+    no_iters = plan['no_iters']
+
+    for recording, peak in sorted(plan['peak_by_recording'].items(),
+                                  key=lambda item: item[1]):
+        if peak < plan['peak']:
+            suggestions.append(
+                "With the setting 'recording': '{}' (recording {}) the expected "
+                "peak is {:.1f} MB.".format(recording,
+                                            ', '.join(RECORDING_LEVELS[recording]),
+                                            peak))
+
+    # Shorter runs reduce the traces and the output alike
+    per_iter = (plan['traces_total'] + plan['output']) / no_iters
+    max_no_iters = int((budget - plan['state_estimator']) / per_iter)
+    if 0 < max_no_iters < no_iters:
+        suggestions.append(
+            "An estimated {} of the {} iterations fit in the budget, so the "
+            "chain can be run in segments of about this length (each "
+            "initialised at the last parameters of the previous one) with the "
+            "output of each segment written to file by save_to_file.".format(
+                max_no_iters, no_iters))
+
+    if plan['state_estimator'] > 0.5 * budget:
+        suggestions.append(
+            "The state estimators ({} concurrent) use {:.1f} MB, reduce the "
+            "number of {}.".format(
+                plan['no_concurrent_evaluations'], plan['state_estimator'],
+                "particles, workers or replicas" if plan['no_replicas'] > 1
+                else "particles or workers"))
+    return suggestions
+
+
+def format_plan(plan, budget=None, no_traces=4):
+    """ Returns a summary of the output from plan_memory as a string. """
+    lines = ["Expected peak memory: {:.1f} MB".format(plan['peak']) +
+             ("." if budget is None else " (budget: {:.1f} MB).".format(budget))]
+    largest = sorted(plan['traces'].items(), key=lambda item: item[1], reverse=True)
+    lines.append("Traces: {:.1f} MB (largest: {}).".format(
+        plan['traces_total'],
+        ', '.join("{} {:.1f} MB".format(name, size) for name, size in largest[0:no_traces])))
+    lines.append("State estimators: {:.1f} MB, writing output: {:.1f} MB.".format(
+        plan['state_estimator'], plan['output']))
+    return '\n'.join(lines)
+
+
+def check_memory_budget(plan, budget, action='warn'):
+    """ Checks the expected peak memory of a run against a budget.
+
+        Args:
+            plan: the output from plan_memory.
+            budget: the memory budget. (MB) If None, nothing is checked.
+            action: 'warn' prints the plan and suggestions for reducing
+                    the memory and 'raise' raises a ValueError with them.
+
+        Returns:
+            True if the expected peak memory is within the budget.
+
+    """
+    if budget is None or plan['peak'] <= budget:
+        return True
+
+    message = format_plan(plan, budget)
+    message += '\n' + '\n'.join(get_suggestions(plan, budget))
+    if action == 'raise':
+        raise ValueError("The expected peak memory exceeds the budget.\n" + message)
+    elif action == 'warn':
+        print("Warning: the expected peak memory exceeds the budget.")
+        print(message)
+    else:
+        raise ValueError("Unknown memory_budget_action (warn/raise).")
+    return False
@@ -20,9 +20,17 @@
 import warnings
 import numpy as np
 import time
+from types import SimpleNamespace
+from scipy.special import logsumexp
 
 from helpers.distributions import multivariate_gaussian
 from helpers.cov_matrix import is_valid_covariance_matrix
+from helpers.profiling import IterationProfiler, format_summary
+
+from parameter.mcmc.memory_planner import plan_memory
+from parameter.mcmc.memory_planner import check_memory_budget
+from parameter.mcmc.memory_planner import get_trace_shapes
+from parameter.mcmc.recording import TRACE_NAMES, allocate_trace
 
 from parameter.mcmc.output import plot_results
 from parameter.mcmc.output import print_progress_report
@@ -36,6 +44,9 @@ from parameter.mcmc.performance_measures import compute_sjd
 from parameter.mcmc.gradient_estimation import get_gradient
 from parameter.mcmc.gradient_estimation import get_nat_gradient
 from parameter.mcmc.hessian_estimation import get_hessian
+from parameter.mcmc import independent_proposal
+
+from helpers.parallel import WorkerPool, get_worker_context
 
 from parameter.base_parameter_inference import BaseParameterInference
 
@@ -76,6 +87,10 @@ class MetropolisHastings(BaseParameterInference):
                      direct particle methods are used here.
                 qmh: basically the same as mh2 but using quasi-Newton updates
                      to estimate the Hessian directly from gradient information.
+                mtm: multiple-try Metropolis with the proposal of mh0. Setting
+                     mtm_no_candidates larger than one gives multiple tries
+                     with the proposal of any of the other variants, see
+                     _multiple_try_step.
 
             new_settings: a dict with the following settings:
                 'no_iters': number of MH iterations to carry out. (integer)
@@ -89,6 +104,10 @@ class MetropolisHastings(BaseParameterInference):
                 'initial_params': parameter vector to initialise the Markov
                                   chain in. (array)
 
+                'temperature': the log-likelihood is multiplied by this
+                               value in the target (and its gradient and
+                               Hessian), see parallel_tempering. (float)
+
                 'verbose': should additional information for debugging be
                            printed to screen? (boolean)
 
@@ -128,6 +147,64 @@ class MetropolisHastings(BaseParameterInference):
 
                 'qn_only_accepted_info': See quasi_newton.main.quasi_newton
 
+                'independent_phase': should the algorithm switch to an
+                                     independent MH proposal after the
+                                     burn-in? See _run_independent_phase.
+                                     (boolean)
+
+                'independent_no_components': number of Student's t
+                                             components in the independent
+                                             proposal. (integer)
+
+                'independent_dof': degrees of freedom of the components in
+                                   the independent proposal. (float)
+
+                'independent_batch_size': number of proposals evaluated
+                                          concurrently in the independent
+                                          phase. (integer)
+
+                'independent_no_workers': number of worker processes for
+                                          the independent phase. (integer)
+                                          If None, the number of cores is
+                                          used.
+
+                'mtm_no_candidates': number of candidates proposed in each
+                                     iteration (multiple tries are used if
+                                     larger than one, 5 for mtm). (integer)
+
+                'mtm_no_workers': number of worker processes for evaluating
+                                  the candidates. (integer) If None, the
+                                  number of cores is used.
+
+                'profile_iters': the first and last (not included) iteration
+                                 to profile using cProfile, e.g. (500, 600).
+                                 The profile is written next to the output
+                                 by save_to_file. (None: no profiling)
+
+                'memory_budget': the memory (MB) available for the run. The
+                                 expected peak memory is computed from the
+                                 settings (see memory_planner.plan_memory)
+                                 before the traces are allocated and again
+                                 with the state estimator before the run.
+                                 (None: no budget)
+
+                'memory_budget_action': what to do if the expected peak
+                                        memory exceeds memory_budget:
+                                        'warn' prints the plan and
+                                        suggestions for reducing the memory
+                                        and 'raise' raises a ValueError.
+
+                'recording': which traces are recorded for all iterations
+                             (see recording.RECORDING_LEVELS):
+                             'minimal': params, log_like and accepted.
+                             'standard': the traces written by save_to_file
+                                         and used by plot and the
+                                         performance measures.
+                             'debug': all traces including the proposed
+                                      states, gradients and Hessians.
+                             Only the latest iterations (the current state)
+                             of the other traces are kept.
+
     """
     def __init__(self, model, alg_type, new_settings=None):
         self.use_grad_info = False
@@ -138,6 +215,7 @@ class MetropolisHastings(BaseParameterInference):
                          'step_size': 0.5,
                          'base_hessian': np.eye(3) * 0.10**2,
                          'initial_params': (0.2, 0.5, 1.0),
+                         'temperature': 1.0,
                          'verbose': False,
                          'verbose_wait_enter': False,
                          'trust_region_size': None,
@@ -152,37 +230,57 @@ class MetropolisHastings(BaseParameterInference):
                          'qn_initial_hessian_scaling': 0.10,
                          'qn_initial_hessian_fixed': np.eye(3) * 0.01**2,
                          'qn_only_accepted_info': True,
-                         'qn_accept_all_initial': True
+                         'qn_accept_all_initial': True,
+                         'independent_phase': False,
+                         'independent_no_components': 2,
+                         'independent_dof': 5.0,
+                         'independent_batch_size': 20,
+                         'independent_no_workers': None,
+                         'mtm_no_candidates': 1,
+                         'mtm_no_workers': None,
+                         'profile_iters': None,
+                         'memory_budget': None,
+                         'memory_budget_action': 'warn',
+                         'recording': 'standard'
                         }
 
 
         if new_settings:
             self.settings.update(new_settings)
 
-        if alg_type is 'mh0':
+        if alg_type == 'mh0':
             self.name = "Zero-order Metropolis-Hastings"
-        elif alg_type is 'mh1':
+        elif alg_type == 'mh1':
             self.name = "First-order Metropolis-Hastings"
             self.use_grad_info = True
-        elif alg_type is 'mh2':
+        elif alg_type == 'mh2':
             self.name = "Second-order Metropolis-Hastings"
             self.use_grad_info = True
             self.use_hess_info = True
             self.settings['hessian_estimate'] = 'segal_weinstein'
-        elif alg_type is 'qmh':
+        elif alg_type == 'qmh':
             self.name = "quasi-Newton Metropolis-Hastings"
             self.use_grad_info = True
             self.use_hess_info = True
             self.settings['hessian_estimate'] = 'quasi_newton'
             if self.settings['qn_strategy'] is None:
                 raise ValueError("No quasi-Newton strategy selected...")
-            elif self.settings['qn_strategy'] is 'bfgs':
+            elif self.settings['qn_strategy'] == 'bfgs':
                 print("Hessian estimation using BFGS update.")
             else:
                 raise ValueError("Unknown quasi-Newton strategy selected...")
+        elif alg_type == 'mtm':
+            self.name = "Multiple-try Metropolis-Hastings"
+            if self.settings['mtm_no_candidates'] < 2:
+                self.settings['mtm_no_candidates'] = 5
         else:
             raise ValueError("Unknown MH variant selected...")
 
+        if self.settings['mtm_no_candidates'] > 1 and alg_type != 'mtm':
+            self.name += " with multiple tries"
+        self.pool = None
+        self.profiler = None
+
         self.no_hessians_corrected = 0
         self.iter_hessians_corrected = []
 
@@ -196,32 +294,13 @@ class MetropolisHastings(BaseParameterInference):
             raise ValueError("metropolisHastings: no_burnin_iters cannot be " +
                              "larger or equal to no_iters.")
 
-        self.free_params = np.zeros((no_iters, no_params_to_estimate))
-        self.params = np.zeros((no_iters, no_params_to_estimate))
-        self.prop_free_params = np.zeros((no_iters, no_params_to_estimate))
-        self.prop_params = np.zeros((no_iters, no_params_to_estimate))
-
-        self.log_prior = np.zeros((no_iters, 1))
-        self.log_like = np.zeros((no_iters, 1))
-        self.log_jacobian = np.zeros((no_iters, 1))
-        self.states = np.zeros((no_iters, no_obs + 1))
-        self.prop_log_prior = np.zeros((no_iters, 1))
-        self.prop_log_like = np.zeros((no_iters, 1))
-        self.prop_log_jacobian = np.zeros((no_iters, 1))
-        self.prop_states = np.zeros((no_iters, no_obs + 1))
-
-        self.accept_prob = np.zeros((no_iters, 1))
-        self.accepted = np.zeros((no_iters, 1))
-        self.no_samples_hess_est = np.zeros((no_iters, 1))
-
-        self.gradient = np.zeros((no_iters, no_params_to_estimate))
-        self.nat_gradient = np.zeros((no_iters, no_params_to_estimate))
-        self.hess = np.zeros((no_iters, no_params_to_estimate,
-                                 no_params_to_estimate))
-        self.prop_grad = np.zeros((no_iters, no_params_to_estimate))
-        self.prop_nat_grad = np.zeros((no_iters, no_params_to_estimate))
-        self.prop_hess = np.zeros((no_iters, no_params_to_estimate,
-                                   no_params_to_estimate))
+        self.memory_plan = plan_memory(self.settings, no_params_to_estimate, no_obs)
+        check_memory_budget(self.memory_plan, self.settings['memory_budget'],
+                            self.settings['memory_budget_action'])
+
+        shapes = get_trace_shapes(no_iters, no_params_to_estimate, no_obs)
+        for name in TRACE_NAMES:
+            setattr(self, name, allocate_trace(name, shapes[name], self.settings))
         self.current_iter = 0
 
     def run(self, state_estimator):
@@ -239,18 +318,36 @@ class MetropolisHastings(BaseParameterInference):
         """
         self.start_time = time.time()
 
+        self.memory_plan = plan_memory(self.settings,
+                                       self.model.no_params_to_estimate,
+                                       self.model.no_obs, state_estimator)
+        check_memory_budget(self.memory_plan, self.settings['memory_budget'],
+                            self.settings['memory_budget_action'])
+
         print_greeting(self, state_estimator)
 
         if self.use_grad_info or self.use_hess_info:
             state_estimator.settings['estimate_gradient'] = True
 
+        if hasattr(state_estimator, 'particle_tuning'):
+            self.particle_tuning = state_estimator.particle_tuning
+
         no_iters = self.settings['no_iters']
         self.current_iter = 0
 
+        self.profiler = None
+        if self.settings['profile_iters'] is not None:
+            self.profiler = IterationProfiler(self.settings['profile_iters'])
+
         self._initialise_params(state_estimator, self.model)
 
         for i in range(1, no_iters):
 
+            if self.settings['independent_phase'] and \
+                    i == self.settings['no_burnin_iters']:
+                self._run_independent_phase(state_estimator, self.model)
+                break
+
             if self.settings['verbose']:
                 print("")
                 print("#######################################################")
@@ -258,12 +355,11 @@ class MetropolisHastings(BaseParameterInference):
                 print("")
 
             self.current_iter = i
-            self._propose_params(self.model)
-            self._compute_accept_prob(state_estimator, self.model)
-            if (np.random.random(1) < self.accept_prob[i, :]):
-                self._accept_params()
-            else:
-                self._reject_params()
+            if self.profiler:
+                self.profiler.before_iteration(i)
+            self._iterate(state_estimator)
+            if self.profiler:
+                self.profiler.after_iteration(i)
 
             if self.settings['verbose_wait_enter']:
                 input("Press ENTER to continue...")
@@ -278,10 +374,222 @@ class MetropolisHastings(BaseParameterInference):
                 print("#######################################################")
                 print("")
 
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+        if self.profiler:
+            self.profiler.stop()
+            self.profile_summary = self.profiler.get_summary()
+            print(format_summary(self.profile_summary))
+
         print("Run of MH algorithm complete...")
         print("It took: {:.2f} seconds to run this code.".format((time.time() - self.start_time)))
         self.time_per_iteration = (time.time() - self.start_time) / no_iters
 
+    def _get_offset(self):
+        """ Returns the lag to the current state of the Markov chain.
+
+            This is one except for qMH after the first qn_memory_length
+            iterations, where the proposal is made from the state
+            qn_memory_length iterations back.
+
+        """
+        offset = 1
+        if self.use_hess_info:
+            if self.settings['hessian_estimate'] == 'quasi_newton':
+                if self.current_iter > self.settings['qn_memory_length']:
+                    offset = self.settings['qn_memory_length']
+        return offset
+
+    def _iterate(self, state_estimator):
+        """ Carries out one iteration (given by current_iter) of the MH algorithm. """
+        if self.settings['mtm_no_candidates'] > 1:
+            self._multiple_try_step(state_estimator)
+            return
+        self._propose_params(self.model)
+        self._compute_accept_prob(state_estimator, self.model)
+        if (np.random.random(1) < self.accept_prob[self.current_iter, :]):
+            self._accept_params()
+        else:
+            self._reject_params()
+
+    def _multiple_try_step(self, state):
+        """ Carries out one iteration of multiple-try Metropolis.
+
+            The mtm_no_candidates candidates are drawn from the proposal
+            (given by the alg_type) at the current state x and are evaluated
+            concurrently in a pool of workers. A candidate y is selected with
+            probability proportional to the weight w(y | x) = p(y) / q(y | x),
+            where p denotes the (estimate of the) log-target. A reference set
+            is then drawn from q(. | y), where the last element is x, and the
+            selected candidate is accepted with probability
+
+                min(1, sum_j w(y_j | x) / sum_j w(x_j | y)).
+
+            The trust region is not used for multiple tries.
+
+        """
+        i = self.current_iter
+        offset = self._get_offset()
+        no_candidates = self.settings['mtm_no_candidates']
+
+        cur = {'free_params': self.free_params[i - offset, :],
+               'params': self.params[i - offset, :],
+               'log_jacobian': self.log_jacobian[i - offset, 0],
+               'log_prior': self.log_prior[i - offset, 0],
+               'log_like': self.log_like[i - offset, 0],
+               'nat_gradient': self.nat_gradient[i - offset, :],
+               'hess': self.hess[i - offset, :, :]}
+        cur['log_target'] = self._get_log_target(cur)
+
+        # Draw and evaluate the candidates and select one
+        candidates = self._evaluate_candidates(
+            state, self._sample_candidates(cur, no_candidates))
+        log_weights = np.array([self._get_log_weight(candidate, cur)
+                                for candidate in candidates])
+
+        if np.all(np.isinf(log_weights)):
+            print("iteration: " + str(i) + ", no valid candidate so rejecting...")
+            self.accept_prob[i] = 0.0
+            self._reject_params()
+            return
+
+        probs = np.exp(log_weights - np.max(log_weights))
+        selected = candidates[np.random.choice(no_candidates, p=probs / np.sum(probs))]
+        self._record_hessian_correction(selected)
+
+        # Draw and evaluate the reference set
+        references = self._evaluate_candidates(
+            state, self._sample_candidates(selected, no_candidates - 1))
+        references.append(cur)
+        ref_log_weights = np.array([self._get_log_weight(reference, selected)
+                                    for reference in references])
+
+        log_accept_prob = logsumexp(log_weights) - logsumexp(ref_log_weights)
+        accept_prob = np.exp(np.min((0.0, log_accept_prob)))
+
+        # Initialisation for qMH (accept all initially proposed steps)
+        if self.settings['hessian_estimate'] == 'quasi_newton' and \
+                self.settings['qn_accept_all_initial'] and \
+                self.current_iter < self.settings['qn_memory_length']:
+            accept_prob = 1.0
+
+        if self.settings['verbose']:
+            print("candidate log-weights: " + str(["%.3f" % v for v in log_weights]))
+            print("reference log-weights: " + str(["%.3f" % v for v in ref_log_weights]))
+            print("accept_prob: {:.3f}".format(accept_prob))
+
+        self.accept_prob[i] = accept_prob
+        self.prop_free_params[i, :] = selected['free_params']
+        self.prop_params[i, :] = selected['params']
+        self.prop_log_jacobian[i] = selected['log_jacobian']
+        self.prop_log_prior[i] = selected['log_prior']
+        self.prop_log_like[i] = selected['log_like']
+        self.prop_states[i, :] = selected['states']
+        self.prop_grad[i, :] = selected['gradient']
+        self.prop_nat_grad[i, :] = selected['nat_gradient']
+        self.prop_hess[i, :, :] = selected['hess']
+
+        if (np.random.random(1) < self.accept_prob[i, :]):
+            self._accept_params()
+        else:
+            self._reject_params()
+
+    def _sample_candidates(self, cur, no_samples):
+        """ Draws no_samples from the proposal at the (free) parameters cur. """
+        no_param = self.model.no_params_to_estimate
+        cov_root = np.linalg.cholesky(cur['hess'])
+        perturbation = np.random.normal(size=(no_samples, no_param))
+        perturbation = np.matmul(perturbation, cov_root.transpose())
+        return cur['free_params'] + cur['nat_gradient'] + perturbation
+
+    def _evaluate_candidates(self, state, prop_free_params):
+        """ Estimates the log-target, gradient and Hessian for each row of
+            prop_free_params using the pool of workers. """
+        if self.pool is None:
+            context = {'model': self.model, 'state_estimator': state}
+            self.pool = WorkerPool(context, self.settings['mtm_no_workers'])
+
+        estimate_gradient = self.use_grad_info or self.use_hess_info
+        seeds = np.random.randint(0, 2**31 - 1, size=len(prop_free_params))
+        tasks = [(params, estimate_gradient, seed)
+                 for params, seed in zip(prop_free_params, seeds)]
+        output = self.pool.map(_evaluate_params, tasks)
+
+        candidates = []
+        for params, out in zip(prop_free_params, output):
+            candidate = {'free_params': params, 'valid': out is not None}
+            if out is not None:
+                candidate.update(out)
+                candidate.update(self._get_candidate_proposal(out))
+                candidate['log_target'] = self._get_log_target(candidate)
+            candidates.append(candidate)
+        return candidates
+
+    def _get_proposal(self, state):
+        """ Returns the gradient, the Hessian and the natural gradient of the
+            proposal (given by the alg_type) from the results of the state
+            estimator and if the Hessian is a valid covariance matrix. """
+        gradient = get_gradient(self, state)
+        hess = get_hessian(self, state, gradient)
+        return {'gradient': gradient,
+                'hess': hess,
+                'nat_gradient': get_nat_gradient(self, gradient, hess),
+                'valid': is_valid_covariance_matrix(hess)}
+
+    def _get_candidate_proposal(self, results):
+        """ As _get_proposal but for the results of a candidate in multiple-
+            try Metropolis (a dict with gradient_internal and
+            hessian_internal). The count of corrected Hessian estimates and
+            the number of samples in the quasi-Newton estimate are left
+            unchanged and returned in the keys hessian_corrected and
+            no_samples_hess_est (see _record_hessian_correction). """
+        i = self.current_iter
+        no_hessians_corrected = self.no_hessians_corrected
+        no_iters_corrected = len(self.iter_hessians_corrected)
+        no_samples_hess_est = np.array(self.no_samples_hess_est[i])
+
+        try:
+            proposal = self._get_proposal(SimpleNamespace(results=results))
+            proposal['hessian_corrected'] = self.no_hessians_corrected > no_hessians_corrected
+            proposal['no_samples_hess_est'] = np.array(self.no_samples_hess_est[i])
+        finally:
+            self.no_hessians_corrected = no_hessians_corrected
+            del self.iter_hessians_corrected[no_iters_corrected:]
+            self.no_samples_hess_est[i] = no_samples_hess_est
+        return proposal
+
+    def _record_hessian_correction(self, candidate):
+        """ Records the correction of the Hessian estimate (and the number of
+            samples in the quasi-Newton estimate) for the candidate selected
+            in multiple-try Metropolis. """
+        i = self.current_iter
+        self.no_samples_hess_est[i] = candidate['no_samples_hess_est']
+        if candidate['hessian_corrected']:
+            self.no_hessians_corrected += 1
+            self.iter_hessians_corrected.append(i)
+
+    def _get_log_proposal(self, free_params, cur):
+        """ Returns the log-density of proposing the (free) parameters from
+            cur (a dict with free_params, nat_gradient and hess). """
+        return float(multivariate_gaussian.logpdf(free_params,
+                                                  cur['free_params'] + cur['nat_gradient'],
+                                                  cur['hess']))
+
+    def _get_log_target(self, candidate):
+        """ Returns the (tempered) log-target for a candidate. """
+        log_target = candidate['log_prior'] + candidate['log_jacobian']
+        log_target += self.settings['temperature'] * candidate['log_like']
+        return float(log_target)
+
+    def _get_log_weight(self, candidate, cur):
+        """ Returns the log-weight log p(y) - log q(y | x) of the candidate y
+            proposed at cur (x) in multiple-try Metropolis. """
+        if not candidate.get('valid', True):
+            return -np.inf
+        return candidate['log_target'] - self._get_log_proposal(candidate['free_params'], cur)
+
     def _accept_params(self):
         """ Record the accepted parameters. """
         i = self.current_iter
@@ -296,13 +604,10 @@ class MetropolisHastings(BaseParameterInference):
         self.hess[i, :, :] = self.prop_hess[i, :, :]
         self.accepted[i] = 1.0
 
-    def _reject_params(self):
+    def _reject_params(self, offset=None):
         """ Record the rejected parameters. """
-        offset = 1
-        if self.use_hess_info:
-            if self.settings['hessian_estimate'] is 'quasi_newton':
-                if self.current_iter > self.settings['qn_memory_length']:
-                    offset = self.settings['qn_memory_length']
+        if offset is None:
+            offset = self._get_offset()
         i = self.current_iter
         self.free_params[i, :] = self.free_params[i - offset, :]
         self.params[i, :] = self.params[i - offset, :]
@@ -315,6 +620,93 @@ class MetropolisHastings(BaseParameterInference):
         self.hess[i, :, :] = self.hess[i - offset, :, :]
         self.accepted[i] = 0.0
 
+    def _run_independent_phase(self, state, model):
+        """ Runs the remaining iterations using an independent proposal.
+
+            A mixture of Student's t distributions is fitted to the latter
+            half of the burn-in (in the free parameters) and is used as the
+            proposal for the remaining iterations. As the proposed parameters
+            do not depend on the current state of the Markov chain, a batch
+            of proposals is drawn and their log-likelihoods are estimated
+            concurrently by a pool of workers (each with a copy of the model
+            and state estimator). The accept/reject steps are then carried
+            out sequentially for the batch. Gradients and Hessians are not
+            estimated in this phase.
+
+        """
+        no_iters = self.settings['no_iters']
+        no_burnin_iters = self.settings['no_burnin_iters']
+        batch_size = int(self.settings['independent_batch_size'])
+
+        burnin_samples = self.free_params[int(0.5 * no_burnin_iters):no_burnin_iters, :]
+        self.independent_proposal = independent_proposal.fit(
+            burnin_samples,
+            no_components=self.settings['independent_no_components'],
+            dof=self.settings['independent_dof'])
+        print("Switching to independent MH proposal at iteration: " +
+              str(no_burnin_iters) + ".")
+
+        context = {'model': model, 'state_estimator': state}
+        pool = WorkerPool(context, self.settings['independent_no_workers'])
+        cur_log_prop = float(independent_proposal.logpdf(
+            self.independent_proposal, self.free_params[no_burnin_iters - 1, :]))
+
+        try:
+            for start in range(no_burnin_iters, no_iters, batch_size):
+                stop = int(np.min((start + batch_size, no_iters)))
+                prop_free_params = independent_proposal.sample(
+                    self.independent_proposal, stop - start)
+                prop_log_prop = independent_proposal.logpdf(
+                    self.independent_proposal, prop_free_params)
+                seeds = np.random.randint(0, 2**31 - 1, size=stop - start)
+                tasks = [(params, False, seed) for params, seed in zip(prop_free_params, seeds)]
+                output = pool.map(_evaluate_params, tasks)
+
+                for j, i in enumerate(range(start, stop)):
+                    self.current_iter = i
+                    self.prop_free_params[i, :] = prop_free_params[j, :]
+                    self.prop_grad[i, :] = 0.0
+                    self.prop_nat_grad[i, :] = 0.0
+                    self.prop_hess[i, :, :] = self.hess[i - 1, :, :]
+
+                    if output[j] is None:
+                        self.accept_prob[i] = 0.0
+                        print("Proposed parameters: " + str(prop_free_params[j, :]) +
+                              " results in an unstable system so rejecting.")
+                    else:
+                        self.prop_params[i, :] = output[j]['params']
+                        self.prop_log_jacobian[i] = output[j]['log_jacobian']
+                        self.prop_log_prior[i] = output[j]['log_prior']
+                        self.prop_log_like[i] = output[j]['log_like']
+                        self.prop_states[i, :] = output[j]['states']
+
+                        log_target_diff = float(self.prop_log_prior[i] - self.log_prior[i - 1])
+                        log_target_diff += self.settings['temperature'] * \
+                            float(self.prop_log_like[i] - self.log_like[i - 1])
+                        log_target_diff += float(self.prop_log_jacobian[i] - self.log_jacobian[i - 1])
+                        log_prop_diff = cur_log_prop - prop_log_prop[j]
+
+                        try:
+                            accept_prob = np.exp(log_target_diff + log_prop_diff)
+                        except:
+                            if self.settings['verbose']:
+                                print("Accepted as overflow occurred...")
+                            accept_prob = 1.0
+                        self.accept_prob[i] = np.min((1.0, accept_prob))
+
+                    if (np.random.random(1) < self.accept_prob[i, :]):
+                        self._accept_params()
+                        cur_log_prop = prop_log_prop[j]
+                    else:
+                        self._reject_params(offset=1)
+
+                    flag = self.settings['no_iters_between_progress_reports']
+                    flag = np.remainder(i + 1, flag) == 0
+                    if flag:
+                        print_progress_report(self)
+        finally:
+            pool.close()
+
     def _initialise_params(self, state, model):
         """ Initialise the Metropolis-Hastings algorithm. """
         model.store_params(self.settings['initial_params'])
@@ -348,11 +740,7 @@ class MetropolisHastings(BaseParameterInference):
 
     def _propose_params(self, model):
         """ Proposes new parameters given the current parameters. """
-        offset = 1
-        if self.use_hess_info:
-            if self.settings['hessian_estimate'] is 'quasi_newton':
-                if self.current_iter > self.settings['qn_memory_length']:
-                    offset = self.settings['qn_memory_length']
+        offset = self._get_offset()
 
         no_param = self.model.no_params_to_estimate
         cur_params = self.free_params[self.current_iter - offset, :]
@@ -388,11 +776,7 @@ class MetropolisHastings(BaseParameterInference):
 
     def _compute_accept_prob(self, state, model):
         """ Computes acceptance probability. """
-        offset = 1
-        if self.use_hess_info:
-            if self.settings['hessian_estimate'] is 'quasi_newton':
-                if self.current_iter > self.settings['qn_memory_length']:
-                    offset = self.settings['qn_memory_length']
+        offset = self._get_offset()
 
         cur_free_params = self.free_params[self.current_iter - offset, :]
         cur_params = self.params[self.current_iter - offset, :]
@@ -425,6 +809,7 @@ class MetropolisHastings(BaseParameterInference):
             if is_valid_covariance_matrix(prop_hess):
                 log_prior_diff = float(prop_log_prior - cur_log_prior)
                 log_like_diff = float(prop_log_like - cur_log_like)
+                log_like_diff *= self.settings['temperature']
 
                 cur_mean = cur_free_params + cur_nat_grad
                 prop_prop = multivariate_gaussian.logpdf(prop_free_params,
@@ -463,7 +848,7 @@ class MetropolisHastings(BaseParameterInference):
                 prop_hess = np.zeros((model.no_params_to_estimate, model.no_params_to_estimate))
 
             # Initialisation for qMH (accept all initially proposed steps)
-            if self.settings['hessian_estimate'] is 'quasi_newton' and \
+            if self.settings['hessian_estimate'] == 'quasi_newton' and \
                     self.settings['qn_accept_all_initial'] and \
                     self.current_iter < self.settings['qn_memory_length']:
                 accept_prob = 1.0
@@ -515,3 +900,35 @@ class MetropolisHastings(BaseParameterInference):
     compute_ess = compute_ess
     compute_iact = compute_iact
     compute_sjd = compute_sjd
+
+
+def _evaluate_params(task):
+    """ Estimates the log-target (and the gradient and Hessian if
+        estimate_gradient is True) for a proposed (free) parameter in a
+        worker process. Returns None if the parameters are not valid. """
+    prop_free_params, estimate_gradient, seed = task
+    context = get_worker_context()
+    model = context['model']
+    state = context['state_estimator']
+    np.random.seed(seed)
+
+    model.store_free_params(prop_free_params)
+    if not model.check_parameters():
+        return None
+
+    log_jacobian = model.log_jacobian()
+    _, log_prior = model.log_prior()
+    if estimate_gradient:
+        state.smoother(model)
+    else:
+        state.filter(model)
+
+    output = {'params': model.get_params(),
+              'log_jacobian': log_jacobian,
+              'log_prior': log_prior,
+              'log_like': float(state.results['log_like']),
+              'states': state.results['state_trajectory'].reshape(model.no_obs+1)}
+    if estimate_gradient:
+        output.update({'gradient_internal': np.array(state.results['gradient_internal'])})
+        output.update({'hessian_internal': np.array(state.results['hessian_internal'])})
+    return output
@@ -27,6 +27,8 @@ import matplotlib.pylab as plt
 from helpers.file_system import write_to_json
 from palettable.colorbrewer.qualitative import Dark2_8
 
+from parameter.mcmc.recording import is_recorded
+
 # Print small progress reports
 def print_progress_report(mcmc, max_iact_lag=100):
     """ Plots progress report to the screen during a run of MH algorithm.
@@ -67,7 +69,8 @@ def print_progress_report(mcmc, max_iact_lag=100):
             print(["%.2f" % np.log(mcmc.compute_sjd())])
     except:
         print(" Failed to compute IACT and log-SJD.")
-    if mcmc.settings['hessian_estimate'] is not 'kalman':
+    if mcmc.settings['hessian_estimate'] != 'kalman' and \
+            is_recorded(mcmc, 'no_samples_hess_est'):
         if (iter > mcmc.settings['qn_memory_length']):
             no_samples_hess_est = mcmc.no_samples_hess_est[range(iter)]
             idx = np.where(no_samples_hess_est > 0)[0]
@@ -104,6 +107,8 @@ def print_greeting(mcmc, state_estimator):
         i += 1
     print("")
     print("Running MH for {} iterations.".format(mcmc.settings['no_iters']))
+    if hasattr(mcmc, 'memory_plan'):
+        print("Expected peak memory: {:.1f} MB.".format(mcmc.memory_plan['peak']))
     print("")
     print("The rest of the settings are as follows: ")
     for key in mcmc.settings:
@@ -115,9 +120,16 @@ def plot_results(mcmc):
     """ Plots results to the screen after a run of an MCMC algorithm. """
     no_iters = mcmc.settings['no_iters']
     no_burnin_iters = mcmc.settings['no_burnin_iters']
-    params = mcmc.params[range(no_burnin_iters, no_iters), :]
-    prop_params = mcmc.prop_params[range(no_burnin_iters, no_iters), :]
-    prop_nat_grad = mcmc.prop_nat_grad[range(no_burnin_iters, no_iters), :]
+    idx = range(no_burnin_iters, no_iters)
+    params = mcmc.params[idx, :]
+
+    # The proposed traces are only plotted if they are recorded
+    prop_traces = []
+    for name, label in (('prop_params', "Proposed trace of "),
+                        ('prop_nat_grad', "natural gradient of ")):
+        if is_recorded(mcmc, name):
+            prop_traces.append((getattr(mcmc, name)[idx, :], label))
+    no_cols = 2 + len(prop_traces)
 
     no_bins = int(np.floor(np.sqrt(len(params))))
     no_params = mcmc.model.no_params_to_estimate
@@ -126,22 +138,19 @@ def plot_results(mcmc):
     plt.figure()
     for i in range(no_params):
         col = Dark2_8.mpl_colors[i]
-        plt.subplot(no_params, 4, 4 * i + 1)
+        plt.subplot(no_params, no_cols, no_cols * i + 1)
         plt.hist(params[:, i], bins=no_bins, color = col)
         plt.ylabel("Marginal posterior probability of " + param_names[i])
         plt.xlabel("iter")
-        plt.subplot(no_params, 4, 4 * i + 2)
+        plt.subplot(no_params, no_cols, no_cols * i + 2)
         plt.plot(params[:, i], color = col)
         plt.ylabel("Parameter trace of " + param_names[i])
         plt.xlabel("iter")
-        plt.subplot(no_params, 4, 4 * i + 3)
-        plt.plot(prop_params[:, i], color = col)
-        plt.ylabel("Proposed trace of " + param_names[i])
-        plt.xlabel("iter")
-        plt.subplot(no_params, 4, 4 * i + 4)
-        plt.plot(prop_nat_grad[:, i], color = col)
-        plt.ylabel("natural gradient of " + param_names[i])
-        plt.xlabel("iter")
+        for j, (trace, label) in enumerate(prop_traces):
+            plt.subplot(no_params, no_cols, no_cols * i + 3 + j)
+            plt.plot(trace[:, i], color = col)
+            plt.ylabel(label + param_names[i])
+            plt.xlabel("iter")
     plt.show()
 
 def compile_results(mcmc, sim_name=None, sim_desc=None):
@@ -161,16 +170,15 @@ def compile_results(mcmc, sim_name=None, sim_desc=None):
     current_time = time.strftime("%c")
 
     mcmcout = {}
-    mcmcout.update({'params': mcmc.params[idx, :]})
-    mcmcout.update({'prop_params': mcmc.prop_params[idx, :]})
-    mcmcout.update({'states': mcmc.states[idx, :]})
-    mcmcout.update({'accept_prob': mcmc.accept_prob[idx, :]})
-    mcmcout.update({'accepted': mcmc.accepted[idx, :]})
+    for name in ('params', 'prop_params', 'states', 'accept_prob', 'accepted',
+                 'log_like'):
+        if is_recorded(mcmc, name):
+            mcmcout.update({name: getattr(mcmc, name)[idx, :]})
     mcmcout.update({'no_hessians_corrected': mcmc.no_hessians_corrected})
     mcmcout.update({'iter_hessians_corrected': mcmc.iter_hessians_corrected})
-    mcmcout.update({'no_samples_hess_est': mcmc.no_samples_hess_est[idx, :]})
-    mcmcout.update({'nat_gradient': mcmc.nat_gradient[idx, :]})
-    mcmcout.update({'hess': mcmc.hess[idx, :]})
+    for name in ('no_samples_hess_est', 'nat_gradient', 'hess'):
+        if is_recorded(mcmc, name):
+            mcmcout.update({name: getattr(mcmc, name)[idx, :]})
     mcmcout.update({'simulation_description': sim_desc})
     mcmcout.update({'simulation_name': sim_name})
     mcmcout.update({'simulation_time': current_time})
@@ -189,6 +197,8 @@ def compile_results(mcmc, sim_name=None, sim_desc=None):
     settings.update({'simulation_description': sim_desc})
     settings.update({'simulation_name': sim_name})
     settings.update({'simulation_time': current_time})
+    if hasattr(mcmc, 'particle_tuning'):
+        settings.update({'particle_tuning': mcmc.particle_tuning})
 
     return mcmcout, data, settings
 
@@ -196,7 +206,8 @@ def store_results_to_file(mcmc, output_path=None, sim_name=None, sim_desc=None):
     """ Stores the output from a run of the MH algorithm to file.
 
         Compiles the information form the MH algorithm, the settings and
-        the data and writes everything as JSON to file.
+        the data and writes everything as JSON to file. Only the traces
+        which are recorded (see the setting recording) are included.
 
         Args:
             output_path: path to a directory to store the output in.
@@ -216,6 +227,9 @@ def store_results_to_file(mcmc, output_path=None, sim_name=None, sim_desc=None):
     desc = {'description': settings['simulation_description'],
             'time': settings['simulation_time']
            }
+    if getattr(mcmc, 'profiler', None) is not None:
+        mcmc.profiler.save(output_path + '/' + sim_name)
+        desc.update({'profile': mcmc.profile_summary})
     write_to_json(mcout, output_path, sim_name, 'mcmc_output.json')
     write_to_json(data, output_path, sim_name, 'data.json')
     write_to_json(settings, output_path, sim_name, 'settings.json')
@@ -0,0 +1,80 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Metropolis-Hastings chains for a panel of independent series."""
+import numpy as np
+
+from parameter.mcmc.ensemble import EnsembleMetropolisHastings
+
+
+class PanelMetropolisHastings(EnsembleMetropolisHastings):
+    """ Metropolis-Hastings chains for a panel of independent series.
+
+        Runs one MH chain for each series in the panel of the model (see
+        import_panel_data) in lock-step, where chain s samples from the
+        parameter posterior of series s. The log-likelihood (and gradients)
+        of all the proposed parameters are estimated in a single call to
+        filter_panel (or smoother_panel) of the state estimator, e.g.
+        PanelParticleMethods. The settings are the same as for
+        EnsembleMetropolisHastings, where no_chains is given by the number of
+        series in the panel.
+
+    """
+    def __init__(self, model, alg_type, new_settings=None):
+        if model.no_series == 0:
+            raise ValueError("The model does not contain a panel, use import_panel_data.")
+
+        settings = {}
+        if new_settings:
+            settings.update(new_settings)
+        settings.update({'no_chains': model.no_series})
+        super(PanelMetropolisHastings, self).__init__(model, alg_type, settings)
+        self.name = self.name.replace("Ensemble of", "Panel of")
+
+    def _estimate_log_like(self, state_estimator, params, idx):
+        """ Estimates the log-likelihood (and gradients) for the series in idx. """
+        if self.use_grad_info:
+            return state_estimator.smoother_panel(self.model, params, idx)
+        return state_estimator.filter_panel(self.model, params, idx)
+
+    def get_samples(self, series=None):
+        """ Returns the samples after burn-in.
+
+            Args:
+                series: the index or name of a series. If None, the samples
+                        for all series are returned.
+
+            Returns:
+                An array (no_samples x no_params_to_estimate) for a single
+                series or (no_samples x no_series x no_params_to_estimate).
+
+        """
+        idx = range(self.settings['no_burnin_iters'], self.settings['no_iters'])
+        if series is None:
+            return self.params[idx, :, :]
+        if not isinstance(series, (int, np.integer)):
+            series = self.model.panel_names.index(series)
+        return self.params[idx, series, :]
+
+    def compile_results(self, sim_name=None, sim_desc=None):
+        """ Compiles results after a run (traces have the dimensions
+            iterations x series x parameters). """
+        mcmcout, data, settings = super(PanelMetropolisHastings, self).compile_results(sim_name, sim_desc)
+        data.update({'observations': self.model.panel_obs})
+        data.update({'series_names': self.model.panel_names})
+        return mcmcout, data, settings
@@ -0,0 +1,387 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Parallel tempering (replica exchange) with Metropolis-Hastings chains."""
+import multiprocessing
+import time
+import traceback
+
+import numpy as np
+
+from helpers.file_system import write_to_json
+from helpers.parallel import to_shared_array
+from parameter.base_parameter_inference import BaseParameterInference
+from parameter.mcmc.gradient_estimation import get_nat_gradient
+from parameter.mcmc.memory_planner import plan_memory, check_memory_budget
+from parameter.mcmc.metropolis_hastings import MetropolisHastings
+from parameter.mcmc.output import print_progress_report
+from parameter.mcmc.recording import TRACE_NAMES
+
+# Attributes of the MH objects returned from the workers after the run
+_TRACE_NAMES = TRACE_NAMES + ('no_hessians_corrected', 'iter_hessians_corrected',
+                              'time_per_iteration')
+
+
+class ParallelTempering(BaseParameterInference):
+    """ Parallel tempering with Metropolis-Hastings chains.
+
+        Runs no_replicas copies of the MH algorithm (each in a separate
+        worker process) targeting the tempered posteriors
+
+            p(theta) * p(y | theta)**beta_r,  1 = beta_0 > beta_1 > ... ,
+
+        where beta_r is the temperature setting of replica r. Every
+        no_iters_between_swaps iteration, the replicas write their current
+        state to shared memory and swaps of the states of neighbouring
+        replicas (alternating between even and odd pairs) are proposed and
+        accepted with probability
+
+            min(1, exp((beta_r - beta_{r+1}) * (log_like_{r+1} - log_like_r))).
+
+        The iteration in which a swap is proposed replaces an MH step in all
+        replicas. During the burn-in, the ladder is adapted such that the
+        swap rate of each pair of neighbours approaches target_swap_rate by
+        stochastic approximation of log(1 / beta_{r+1} - 1 / beta_r). The
+        step size of the random walk is not adapted but the base_hessian of
+        replica r is scaled by 1 / beta_r. The cold chain (beta_0 = 1) is
+        stored in the attribute cold_chain and is written to file as for the
+        MH algorithm.
+
+        Args:
+            model: a model class to conduct inference on.
+            alg_type: the type of MH algorithm, see MetropolisHastings. qmh
+                      is not supported as it proposes from the state
+                      qn_memory_length iterations back, i.e. it runs
+                      interleaved chains which cannot be swapped by
+                      replacing a single iteration.
+            new_settings: a dict with the following settings:
+                'no_replicas': number of replicas (and processes). (integer)
+
+                'temperatures': initial ladder (decreasing and starting at
+                                1.0). If None, a geometric ladder from 1.0
+                                to 1.0 / max_temperature is used. (array)
+
+                'max_temperature': see temperatures. (float)
+
+                'no_iters_between_swaps': how often swaps are proposed.
+                                          (integer)
+
+                'adapt_temperatures': should the ladder be adapted during
+                                      the burn-in? (boolean)
+
+                'target_swap_rate': target for the adaptation. (float)
+
+                'mh_settings': a dict with settings for the MH algorithm
+                               (shared by all replicas). The memory_budget
+                               is checked for all replicas together.
+
+    """
+    def __init__(self, model, alg_type, new_settings=None):
+        self.settings = {'no_replicas': 4,
+                         'temperatures': None,
+                         'max_temperature': 10.0,
+                         'no_iters_between_swaps': 10,
+                         'adapt_temperatures': True,
+                         'target_swap_rate': 0.234,
+                         'mh_settings': {}
+                         }
+        if new_settings:
+            self.settings.update(new_settings)
+
+        if alg_type == 'qmh':
+            raise ValueError("Parallel tempering is not implemented for qmh " +
+                             "(use mh0, mh1, mh2 or mtm).")
+
+        self.model = model
+        no_replicas = int(self.settings['no_replicas'])
+        if self.settings['temperatures'] is None:
+            max_temperature = self.settings['max_temperature']
+            temperatures = max_temperature**(-np.arange(no_replicas) / np.max((no_replicas - 1, 1)))
+        else:
+            temperatures = np.array(self.settings['temperatures'], dtype=float)
+        if no_replicas < 2:
+            raise ValueError("Parallel tempering requires at least two replicas.")
+        if len(temperatures) != no_replicas or temperatures[0] != 1.0 or \
+                np.any(np.diff(temperatures) >= 0.0):
+            raise ValueError("The temperatures must be decreasing from 1.0 " +
+                             "with one temperature per replica.")
+        self.temperatures = temperatures
+
+        self.replicas = []
+        for r in range(no_replicas):
+            replica = MetropolisHastings(model, alg_type, self.settings['mh_settings'])
+            replica.settings['temperature'] = temperatures[r]
+            self.replicas.append(replica)
+        self.cold_chain = self.replicas[0]
+        self.base_hessian = np.array(self.cold_chain.settings['base_hessian'])
+        for replica, temperature in zip(self.replicas, temperatures):
+            replica.settings['base_hessian'] = self.base_hessian / temperature
+        self.name = "Parallel tempering with " + self.cold_chain.name
+
+        self.swap_iters = []
+        self.swap_accepted = np.zeros((0, no_replicas - 1))
+        self.swap_attempted = np.zeros((0, no_replicas - 1))
+        self.temperature_history = []
+
+    def run(self, state_estimator):
+        """ Runs the parallel tempering algorithm.
+
+            Args:
+                state_estimator: a state estimator object
+
+            Returns:
+                Nothing.
+
+        """
+        self.start_time = time.time()
+        mh_settings = self.cold_chain.settings
+        no_iters = mh_settings['no_iters']
+        no_burnin_iters = mh_settings['no_burnin_iters']
+        no_replicas = len(self.replicas)
+        no_params = self.model.no_params_to_estimate
+        no_iters_between_swaps = int(self.settings['no_iters_between_swaps'])
+
+        print("Parallel tempering with " + str(no_replicas) + " replicas of "
+              + self.cold_chain.name + ".")
+        print("Initial temperatures: " + str(["%.3f" % v for v in self.temperatures]))
+
+        # The memory budget applies to all replicas together
+        self.memory_plan = plan_memory(mh_settings, no_params, self.model.no_obs,
+                                       state_estimator, no_replicas)
+        check_memory_budget(self.memory_plan, mh_settings['memory_budget'],
+                            mh_settings['memory_budget_action'])
+
+        # Current states of the replicas (written by the workers)
+        self.shared = {'free_params': to_shared_array(np.zeros((no_replicas, no_params))),
+                       'params': to_shared_array(np.zeros((no_replicas, no_params))),
+                       'log_like': to_shared_array(np.zeros(no_replicas)),
+                       'log_prior': to_shared_array(np.zeros(no_replicas)),
+                       'log_jacobian': to_shared_array(np.zeros(no_replicas)),
+                       'states': to_shared_array(np.zeros((no_replicas, self.model.no_obs + 1))),
+                       'gradient': to_shared_array(np.zeros((no_replicas, no_params))),
+                       'hess': to_shared_array(np.zeros((no_replicas, no_params, no_params))),
+                       'temperatures': to_shared_array(self.temperatures)
+                       }
+
+        context = multiprocessing.get_context('fork')
+        seeds = np.random.randint(0, 2**31 - 1, size=no_replicas)
+        connections = []
+        processes = []
+        for r in range(no_replicas):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_run_replica,
+                                      args=(self, r, state_estimator,
+                                            child_conn, seeds[r]))
+            process.start()
+            child_conn.close()
+            connections.append(parent_conn)
+            processes.append(process)
+
+        swap_accepted = []
+        swap_attempted = []
+        log_spacing = np.log(np.diff(1.0 / self.temperatures))
+        self.temperature_history = [np.array(self.temperatures)]
+        no_adaptations = 0
+
+        try:
+            swap_iters = list(range(no_iters_between_swaps, no_iters, no_iters_between_swaps))
+            start = 1
+            for i in swap_iters + [no_iters]:
+                for conn in connections:
+                    conn.send(('iterate', start, i))
+                _receive_all(connections)
+                if i == no_iters:
+                    break
+
+                # Propose swaps between neighbours (even or odd pairs)
+                accepted = np.zeros(no_replicas - 1)
+                attempted = np.zeros(no_replicas - 1)
+                swap_prob = np.zeros(no_replicas - 1)
+                partners = np.arange(no_replicas)
+                log_like = self.shared['log_like']
+                for r in range(len(swap_accepted) % 2, no_replicas - 1, 2):
+                    log_prob = (self.temperatures[r] - self.temperatures[r + 1]) * \
+                               (log_like[r + 1] - log_like[r])
+                    swap_prob[r] = np.exp(np.min((0.0, log_prob)))
+                    attempted[r] = 1.0
+                    if np.random.random() < swap_prob[r]:
+                        accepted[r] = 1.0
+                        partners[r], partners[r + 1] = r + 1, r
+                swap_accepted.append(accepted)
+                swap_attempted.append(attempted)
+                self.swap_iters.append(i)
+
+                # Adapt the ladder during the burn-in
+                if self.settings['adapt_temperatures'] and i < no_burnin_iters:
+                    step_size = (no_adaptations + 1.0)**(-0.6)
+                    log_spacing += step_size * attempted * \
+                                   (swap_prob - self.settings['target_swap_rate'])
+                    no_adaptations += 1
+                    self.temperatures = 1.0 / np.cumsum(np.hstack((1.0, np.exp(log_spacing))))
+                    self.shared['temperatures'][:] = self.temperatures
+                    self.temperature_history.append(np.array(self.temperatures))
+
+                for r, conn in enumerate(connections):
+                    conn.send(('swap', i, partners[r]))
+                _receive_all(connections)
+                start = i + 1
+
+            for conn in connections:
+                conn.send(('finish', None, None))
+            output = _receive_all(connections)
+        finally:
+            for process in processes:
+                process.join(timeout=1.0)
+                if process.is_alive():
+                    process.terminate()
+
+        for replica, trace in zip(self.replicas, output):
+            for name in _TRACE_NAMES:
+                setattr(replica, name, trace[name])
+            replica.settings['temperature'] = trace['temperature']
+            replica.settings['base_hessian'] = trace['base_hessian']
+            replica.current_iter = no_iters - 1
+
+        self.swap_accepted = np.array(swap_accepted).reshape((-1, no_replicas - 1))
+        self.swap_attempted = np.array(swap_attempted).reshape((-1, no_replicas - 1))
+        self.time_per_iteration = (time.time() - self.start_time) / no_iters
+
+        print("Run of parallel tempering complete...")
+        print("It took: {:.2f} seconds to run this code.".format((time.time() - self.start_time)))
+        print("Final temperatures: " + str(["%.3f" % v for v in self.temperatures]))
+        print("Swap rates: " + str(["%.3f" % v for v in self.get_swap_rates()]))
+
+    def get_swap_rates(self):
+        """ Returns the rates of accepted swaps between neighbouring replicas
+            after the burn-in. """
+        idx = np.array(self.swap_iters) >= self.cold_chain.settings['no_burnin_iters']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sum(self.swap_accepted[idx], axis=0) / np.sum(self.swap_attempted[idx], axis=0)
+
+    def save_to_file(self, output_path=None, sim_name=None, sim_desc=None):
+        """ Stores the cold chain (as for the MH algorithm) and the swap
+            information to file. """
+        self.cold_chain.save_to_file(output_path, sim_name, sim_desc)
+
+        output = {'temperatures': self.temperatures,
+                  'temperature_history': np.array(self.temperature_history),
+                  'swap_iters': np.array(self.swap_iters),
+                  'swap_accepted': self.swap_accepted,
+                  'swap_attempted': self.swap_attempted,
+                  'swap_rates': self.get_swap_rates(),
+                  'settings': {key: self.settings[key] for key in self.settings
+                               if key != 'mh_settings'}
+                  }
+        write_to_json(output, output_path, sim_name, 'parallel_tempering.json')
+
+
+def _receive_all(connections):
+    """ Waits for a reply from each worker and raises errors in the workers. """
+    output = []
+    for conn in connections:
+        status, message = conn.recv()
+        if status == 'error':
+            raise RuntimeError("Error in parallel tempering worker:\n" + message)
+        output.append(message)
+    return output
+
+
+def _run_replica(sampler, replica_idx, state_estimator, conn, seed):
+    """ Runs a replica in a worker process.
+
+        The worker carries out the MH iterations requested by the main process
+        and after each segment writes the current state of the replica to the
+        shared arrays. At a swap, the state of the partner replica (possibly
+        itself) is copied from the shared arrays and the gradient and Hessian
+        are rescaled to the (possibly adapted) temperature of the replica.
+
+    """
+    try:
+        np.random.seed(seed)
+        mh = sampler.replicas[replica_idx]
+        shared = sampler.shared
+        mh.start_time = time.time()
+
+        if mh.use_grad_info or mh.use_hess_info:
+            state_estimator.settings['estimate_gradient'] = True
+        if hasattr(state_estimator, 'particle_tuning'):
+            mh.particle_tuning = state_estimator.particle_tuning
+
+        mh.current_iter = 0
+        mh._initialise_params(state_estimator, mh.model)
+
+        while True:
+            command, start, stop = conn.recv()
+
+            if command == 'iterate':
+                for i in range(start, stop):
+                    mh.current_iter = i
+                    mh._iterate(state_estimator)
+                    flag = mh.settings['no_iters_between_progress_reports']
+                    if replica_idx == 0 and np.remainder(i + 1, flag) == 0:
+                        print_progress_report(mh)
+
+                # Write the current state
+                if stop < mh.settings['no_iters']:
+                    j = stop - 1
+                    temperature = mh.settings['temperature']
+                    shared['free_params'][replica_idx, :] = mh.free_params[j, :]
+                    shared['params'][replica_idx, :] = mh.params[j, :]
+                    shared['log_like'][replica_idx] = mh.log_like[j, 0]
+                    shared['log_prior'][replica_idx] = mh.log_prior[j, 0]
+                    shared['log_jacobian'][replica_idx] = mh.log_jacobian[j, 0]
+                    shared['states'][replica_idx, :] = mh.states[j, :]
+                    shared['gradient'][replica_idx, :] = mh.gradient[j, :] / temperature
+                    shared['hess'][replica_idx, :, :] = mh.hess[j, :, :] * temperature
+                conn.send(('ok', None))
+
+            elif command == 'swap':
+                i = start
+                partner = stop
+                temperature = shared['temperatures'][replica_idx]
+                mh.settings['temperature'] = temperature
+                mh.settings['base_hessian'] = sampler.base_hessian / temperature
+
+                mh.current_iter = i
+                mh.free_params[i, :] = shared['free_params'][partner, :]
+                mh.params[i, :] = shared['params'][partner, :]
+                mh.log_like[i] = shared['log_like'][partner]
+                mh.log_prior[i] = shared['log_prior'][partner]
+                mh.log_jacobian[i] = shared['log_jacobian'][partner]
+                mh.states[i, :] = shared['states'][partner, :]
+                mh.gradient[i, :] = shared['gradient'][partner, :] * temperature
+                mh.hess[i, :, :] = shared['hess'][partner, :, :] / temperature
+                mh.nat_gradient[i, :] = get_nat_gradient(mh, mh.gradient[i, :],
+                                                         mh.hess[i, :, :])
+                mh.accept_prob[i] = 0.0
+                mh.accepted[i] = 0.0
+                conn.send(('ok', None))
+
+            elif command == 'finish':
+                if mh.pool is not None:
+                    mh.pool.close()
+                mh.time_per_iteration = (time.time() - mh.start_time) / mh.settings['no_iters']
+                trace = {name: getattr(mh, name) for name in _TRACE_NAMES}
+                trace.update({'temperature': mh.settings['temperature'],
+                              'base_hessian': mh.settings['base_hessian']})
+                conn.send(('ok', trace))
+                break
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
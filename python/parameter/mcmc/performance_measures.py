@@ -19,6 +19,8 @@
 """Computes various performance meaures from runs of MCMC algorithms."""
 import numpy as np
 
+from parameter.mcmc.recording import is_recorded
+
 def compute_iact(mcmc, max_lag=None):
     """ Computes the integrated autocorrelation time (IACT).
 
@@ -57,7 +59,7 @@ def compute_iact(mcmc, max_lag=None):
     output = np.zeros(mcmc.model.no_params_to_estimate)
     burn_in_iters = mcmc.settings['no_burnin_iters']
     idx = range(int(burn_in_iters), int(mcmc.current_iter))
-    trace = mcmc.free_params[idx, :]
+    trace = _get_trace(mcmc, idx)
     for i in range(mcmc.model.no_params_to_estimate):
         output[i] = helpter_iact(trace[:, i], max_lag)
     return output
@@ -110,7 +112,14 @@ def compute_sjd(mcmc):
     """
     burn_in_iters = mcmc.settings['no_burnin_iters']
     idx = range(int(burn_in_iters), int(mcmc.current_iter))
-    trace = mcmc.free_params[idx, :]
+    trace = _get_trace(mcmc, idx)
     squared_jumps = np.linalg.norm(np.diff(trace, axis=0), 2, axis=1)**2
 
     return np.mean(squared_jumps)
+
+def _get_trace(mcmc, idx):
+    """ Returns the trace of the free parameters (or of the parameters if the
+        free parameters are not recorded, see the setting recording). """
+    if is_recorded(mcmc, 'free_params'):
+        return mcmc.free_params[idx, :]
+    return mcmc.params[idx, :]
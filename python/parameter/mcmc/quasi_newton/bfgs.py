@@ -63,7 +63,7 @@ def bfgs_estimate(initial_hessian, mcmc, param_diff, grad_diff):
     for i in range(param_diff.shape[0]):
         do_update = False
 
-        if curv_cond is 'enforce':
+        if curv_cond == 'enforce':
             param_diff[i] = -param_diff[i]
             if np.dot(param_diff[i], grad_diff[i]) > 0.0:
                 do_update = True
@@ -71,7 +71,7 @@ def bfgs_estimate(initial_hessian, mcmc, param_diff, grad_diff):
             else:
                 violate_curv_cond += 1
 
-        elif curv_cond is 'damped':
+        elif curv_cond == 'damped':
             param_diff[i] = -param_diff[i]
             inverse_hessian = np.linalg.inv(estimate)
             term1 = np.dot(param_diff[i], grad_diff[i])
@@ -86,7 +86,7 @@ def bfgs_estimate(initial_hessian, mcmc, param_diff, grad_diff):
             new_grad_diff = theta * grad_diff[i] + (1.0 - theta) * grad_guess
             do_update = True
 
-        elif curv_cond is 'ignore':
+        elif curv_cond == 'ignore':
             do_update = True
             new_grad_diff = grad_diff[i]
         else:
@@ -104,6 +104,6 @@ def bfgs_estimate(initial_hessian, mcmc, param_diff, grad_diff):
             tmp_term1 = np.matmul(term1, estimate)
             estimate = np.matmul(tmp_term1, term2) + term3
 
-        if curv_cond is 'enforce' or curv_cond is 'ignore':
+        if curv_cond == 'enforce' or curv_cond == 'ignore':
             estimate = -estimate
     return estimate, no_samples
\ No newline at end of file
@@ -59,7 +59,7 @@ def quasi_newton(mcmc, prop_gradient):
         idx = np.where(accepted > 0)[0]
 
         # No available infomation, so quit
-        if len(idx) is 0:
+        if len(idx) == 0:
             if mcmc.settings['verbose']:
                 print("Not enough samples to estimate Hessian...")
             return None, 0
@@ -88,7 +88,7 @@ def quasi_newton(mcmc, prop_gradient):
                                              param_diff=param_diff,
                                              grad_diff=grad_diff)
 
-    if strategy is 'bfgs':
+    if strategy == 'bfgs':
         return bfgs_estimate(initial_hessian=initial_hessian,
                              mcmc=mcmc,
                              param_diff=param_diff,
@@ -127,13 +127,13 @@ def init_hessian_estimate(mcmc, prop_gradient, param_diff, grad_diff):
     fixed_hessian = mcmc.settings['qn_initial_hessian_fixed']
     identity_matrix = np.diag(np.ones(mcmc.model.no_params_to_estimate))
 
-    if strategy is 'fixed':
+    if strategy == 'fixed':
         return fixed_hessian
 
-    if strategy is 'scaled_gradient':
+    if strategy == 'scaled_gradient':
         return identity_matrix * scaling / np.linalg.norm(prop_gradient, 2)
 
-    if strategy is 'scaled_curvature':
+    if strategy == 'scaled_curvature':
         try:
             scaled_curvature = np.dot(param_diff[0], grad_diff[0])
             scaled_curvature *= np.dot(grad_diff[0], grad_diff[0])
@@ -0,0 +1,154 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Recording levels for the traces of the MH algorithm."""
+import numpy as np
+
+TRACE_NAMES = ('free_params', 'params', 'prop_free_params', 'prop_params',
+               'log_prior', 'log_like', 'log_jacobian', 'states',
+               'prop_log_prior', 'prop_log_like', 'prop_log_jacobian',
+               'prop_states', 'accept_prob', 'accepted', 'no_samples_hess_est',
+               'gradient', 'nat_gradient', 'hess', 'prop_grad',
+               'prop_nat_grad', 'prop_hess')
+
+# The traces recorded for all iterations at each level. The standard level
+# records the traces used by save_to_file, plot, the progress reports and
+# the performance measures.
+RECORDING_LEVELS = {'minimal': ('params', 'log_like', 'accepted'),
+                    'standard': ('free_params', 'params', 'prop_params',
+                                 'log_like', 'states', 'accept_prob',
+                                 'accepted', 'no_samples_hess_est',
+                                 'nat_gradient', 'hess', 'prop_nat_grad'),
+                    'debug': TRACE_NAMES}
+
+
+def get_recorded_traces(settings):
+    """ Returns the names of the traces recorded for all iterations.
+
+        The traces of the level given by settings['recording'] are recorded
+        together with the free parameters if the algorithm uses them after
+        the burn-in (for correcting Hessian estimates or for fitting the
+        independent proposal).
+
+    """
+    if settings['recording'] not in RECORDING_LEVELS:
+        raise ValueError("Unknown recording level (minimal/standard/debug).")
+    recorded = list(RECORDING_LEVELS[settings['recording']])
+    if settings['hessian_estimate'] is not None or settings['independent_phase']:
+        if 'free_params' not in recorded:
+            recorded.append('free_params')
+    return recorded
+
+
+def get_window(settings):
+    """ Returns the number of iterations kept for the traces not recorded.
+
+        The current state is the previous iteration except for qMH, which
+        proposes from the state qn_memory_length iterations back and
+        estimates the Hessian from the proposals in these iterations.
+
+    """
+    if settings['hessian_estimate'] == 'quasi_newton':
+        return int(settings['qn_memory_length']) + 1
+    return 2
+
+
+def allocate_trace(name, shape, settings):
+    """ Returns a recorded trace (array) or a TraceWindow with the shape. """
+    if name in get_recorded_traces(settings):
+        return np.zeros(shape)
+    return TraceWindow(name, shape, get_window(settings))
+
+
+def is_recorded(mcmc, name):
+    """ Checks if a trace of the MH algorithm is recorded for all iterations. """
+    return not isinstance(getattr(mcmc, name), TraceWindow)
+
+
+class TraceWindow(object):
+    """ A trace where only the latest iterations are kept.
+
+        Is indexed as the full trace (the first index is the iteration) but
+        only the window latest written iterations are stored, which is enough
+        to hold the current state of the Markov chain. Iterations after the
+        latest written are zero (as in a newly allocated trace) and indexing
+        earlier iterations raises an IndexError.
+
+        Args:
+            name: the name of the trace. (string)
+            shape: the shape of the full trace. (tuple)
+            window: the number of iterations to keep. (integer)
+
+    """
+    def __init__(self, name, shape, window):
+        self.name = name
+        self.shape = tuple(shape)
+        self.window = int(window)
+        self.data = np.zeros((self.window,) + self.shape[1:])
+        self.latest = -1
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        iters, rest = self._split_key(key)
+        if isinstance(iters, int):
+            if iters > self.latest:
+                return np.zeros(self.data.shape[1:])[rest]
+            return self.data[(self._get_slot(iters),) + rest]
+
+        output = np.zeros((len(iters),) + self.data.shape[1:])
+        written = iters <= self.latest
+        output[written] = self.data[self._get_slot(iters[written])]
+        return output[(slice(None),) + rest]
+
+    def __setitem__(self, key, value):
+        iters, rest = self._split_key(key)
+        if not isinstance(iters, int):
+            raise IndexError("Only single iterations can be written to the " +
+                             "trace " + self.name + " as it is not recorded.")
+        if iters > self.latest:
+            # Clear the slots of the skipped iterations
+            for i in range(max(self.latest + 1, iters - self.window + 1), iters + 1):
+                self.data[i % self.window] = 0.0
+            self.latest = iters
+        self.data[(self._get_slot(iters),) + rest] = value
+
+    def _split_key(self, key):
+        """ Returns the iterations and the rest of an index. """
+        if not isinstance(key, tuple):
+            key = (key,)
+        iters, rest = key[0], key[1:]
+        if isinstance(iters, (int, np.integer)):
+            if iters < 0:
+                iters += self.shape[0]
+            return int(iters), rest
+        if isinstance(iters, slice):
+            iters = range(*iters.indices(self.shape[0]))
+        return np.asarray(iters, dtype=int).reshape(-1), rest
+
+    def _get_slot(self, iters):
+        """ Returns the slots of the iterations (which must be in the window). """
+        if isinstance(iters, int):
+            if iters > self.latest - self.window:
+                return iters % self.window
+        elif np.all(iters > self.latest - self.window):
+            return iters % self.window
+        raise IndexError("The trace " + self.name + " is not recorded for " +
+                         "all iterations, change the setting recording to " +
+                         "record it.")
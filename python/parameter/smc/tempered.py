@@ -0,0 +1,483 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Tempered sequential Monte Carlo sampler for the parameters."""
+import copy
+import time
+from types import SimpleNamespace
+import numpy as np
+from scipy.special import logsumexp
+
+from helpers.file_system import write_to_json
+from helpers.parallel import WorkerPool, get_worker_context
+from parameter.base_parameter_inference import BaseParameterInference
+from parameter.mcmc.metropolis_hastings import MetropolisHastings
+
+
+class TemperedSequentialMonteCarlo(BaseParameterInference):
+    """ Tempered sequential Monte Carlo (SMC) sampler for the parameters.
+
+        Moves a population of parameter particles from a Gaussian reference
+        distribution q(theta) (on the free parameters) to the posterior
+        through the sequence of tempered distributions
+
+        pi_t(theta) propto q(theta)^(1 - g_t) * [p(theta) p(y | theta)]^g_t,
+
+        where 0 = g_0 < g_1 < ... < g_T = 1 and p(theta) includes the
+        Jacobian of the reparameterisation. Each temperature is selected by
+        bisection such that the effective sample size (ESS) of the
+        incremental weights is a fraction of the number of particles. The
+        particles are then resampled and rejuvenated by a number of MH steps
+        targeting pi_t. The proposals are given by the MH algorithm (see
+        MetropolisHastings) with the gradient and Hessian of pi_t, where the
+        base Hessian is the covariance of the particles. The product of the
+        mean incremental weights is an estimate of the marginal likelihood.
+
+        The log-likelihoods of all particles in each step are estimated in a
+        persistent pool of worker processes, where each worker calls
+        filter_batch (or smoother_batch) of the state estimator for a block
+        of particles. If the log-likelihood is estimated by a particle filter,
+        the estimate is stored with each particle (i.e. the moves are
+        pseudo-marginal) and the sampler is an SMC^2 sampler.
+
+        Args:
+            model: a model class to conduct inference on.
+            alg_type: the type of MH kernel to use in the moves. (string)
+                mh0: Gaussian random walk proposal.
+                mh1: the MALA proposal using the gradient of the log-target.
+                mh2: the proposal using the gradient and the Hessian of the
+                     log-target (the covariance of the particles is used
+                     when the Hessian estimate is not positive definite).
+
+                qmh is not supported as the quasi-Newton estimate of the
+                Hessian is computed from the history of a Markov chain.
+
+            new_settings: a dict with the following settings:
+                'no_particles': number of parameter particles. (integer)
+
+                'no_moves': number of MH steps after each resampling.
+
+                'target_ess': the ESS to aim for when selecting the next
+                              temperature as a fraction of no_particles.
+
+                'step_size': the step length of the proposal. (float) If
+                             None, 2.38 / sqrt(no_params) is used.
+
+                'initial_params': the mean of the reference distribution. If
+                                  None, the current parameters of the model
+                                  are used.
+
+                'initial_params_spread': the standard deviation of the
+                                         reference distribution (on the
+                                         free parameters). (float)
+
+                'no_workers': number of worker processes. (integer) If
+                              None, the number of cores is used and if 1,
+                              the particles are evaluated in this process.
+
+                'max_no_stages': the maximum number of temperatures.
+
+    """
+    def __init__(self, model, alg_type, new_settings=None):
+        self.settings = {'no_particles': 500,
+                         'no_moves': 3,
+                         'target_ess': 0.5,
+                         'step_size': None,
+                         'initial_params': None,
+                         'initial_params_spread': 1.0,
+                         'no_workers': None,
+                         'max_no_stages': 1000,
+                         'verbose': False
+                        }
+        if new_settings:
+            self.settings.update(new_settings)
+
+        if alg_type not in ('mh0', 'mh1', 'mh2'):
+            raise ValueError("Unknown MH kernel selected (mh0/mh1/mh2)...")
+        self.alg_type = alg_type
+
+        self.model = model
+        self.no_params_to_estimate = model.no_params_to_estimate
+        if self.settings['step_size'] is None:
+            self.settings['step_size'] = 2.38 / np.sqrt(self.no_params_to_estimate)
+
+        # The MH kernel only provides the proposals, the base Hessian and
+        # the temperature are set before each move
+        kernel_settings = {'no_iters': 2,
+                           'no_burnin_iters': 1,
+                           'step_size': self.settings['step_size'],
+                           'base_hessian': np.eye(self.no_params_to_estimate),
+                           'recording': 'minimal'
+                          }
+        self.kernel = MetropolisHastings(model, alg_type, kernel_settings)
+        self.use_grad_info = self.kernel.use_grad_info
+        self.use_hess_info = self.kernel.use_hess_info
+        self.name = "Tempered SMC sampler with " + self.kernel.name + " moves"
+
+        self.temperatures = []
+        self.ess = []
+        self.accept_rate = []
+        self.log_marginal_likelihood = 0.0
+        self.particles = {}
+        self.pool = None
+
+    def run(self, state_estimator):
+        """ Runs the tempered SMC sampler.
+
+            Args:
+                state_estimator: a state estimator object (with the methods
+                                 filter_batch and smoother_batch).
+
+            Returns:
+                Nothing.
+
+        """
+        self.start_time = time.time()
+        self._print_greeting(state_estimator)
+
+        if self.use_grad_info or self.use_hess_info:
+            state_estimator.settings['estimate_gradient'] = True
+
+        no_particles = self.settings['no_particles']
+        no_workers = self.settings['no_workers']
+        context = {'model': self.model, 'state_estimator': state_estimator}
+        self.pool = WorkerPool(context, no_workers)
+
+        try:
+            # Sample from the reference distribution
+            if self.settings['initial_params'] is not None:
+                self.model.store_params(self.settings['initial_params'])
+            self.reference_mean = np.array(self.model.get_free_params())
+            free_params = np.tile(self.reference_mean, (no_particles, 1))
+            free_params += self.settings['initial_params_spread'] * \
+                           np.random.normal(size=free_params.shape)
+            self.particles = self._evaluate_params(free_params)
+
+            temperature = 0.0
+            self.temperatures = [temperature]
+            self.ess = [float(no_particles)]
+            self.accept_rate = [1.0]
+            self.log_marginal_likelihood = 0.0
+
+            while temperature < 1.0:
+                if len(self.temperatures) > self.settings['max_no_stages']:
+                    raise ValueError("TemperedSequentialMonteCarlo: the maximum " +
+                                     "number of stages is reached.")
+
+                # Select the next temperature and reweight
+                increment = self._log_target(self.particles, 1.0)
+                increment -= self._log_target(self.particles, 0.0)
+                new_temperature = self._next_temperature(increment, temperature)
+                log_weights = self._incremental_log_weights(increment,
+                                                            new_temperature - temperature)
+                self.log_marginal_likelihood += logsumexp(log_weights) - np.log(no_particles)
+                weights = np.exp(log_weights - np.max(log_weights))
+                weights /= np.sum(weights)
+                temperature = new_temperature
+
+                # Resample and move the particles
+                ancestors = _systematic(weights)
+                self.particles = {key: value[ancestors] for key, value in self.particles.items()}
+                accept_rate = self._move_particles(temperature)
+
+                self.temperatures.append(temperature)
+                self.ess.append(1.0 / np.sum(weights**2))
+                self.accept_rate.append(accept_rate)
+                self.print_progress_report()
+        finally:
+            self.pool.close()
+            self.pool = None
+
+        print("Run of tempered SMC sampler complete...")
+        print("It took: {:.2f} seconds to run this code.".format((time.time() - self.start_time)))
+        print("Log-marginal likelihood estimate: {:.3f}".format(self.log_marginal_likelihood))
+        self.time_per_stage = (time.time() - self.start_time) / len(self.temperatures)
+
+    def _log_target(self, state, temperature):
+        """ The logarithm of the tempered target for each particle. """
+        log_reference = self._log_reference(state['free_params'])
+        log_posterior = state['log_prior'] + state['log_jacobian'] + state['log_like']
+        with np.errstate(invalid='ignore'):
+            log_target = (1.0 - temperature) * log_reference + temperature * log_posterior
+        log_target[~state['valid']] = -np.inf
+        return log_target
+
+    def _log_reference(self, free_params):
+        """ The logarithm of the Gaussian reference distribution. """
+        spread = self.settings['initial_params_spread']
+        residual = (free_params - self.reference_mean) / spread
+        no_params = free_params.shape[1]
+        log_norm = -0.5 * no_params * np.log(2.0 * np.pi) - no_params * np.log(spread)
+        return log_norm - 0.5 * np.sum(residual**2, axis=1)
+
+    @staticmethod
+    def _incremental_log_weights(increment, step):
+        """ The incremental log-weights when increasing the temperature by step. """
+        with np.errstate(invalid='ignore'):
+            log_weights = step * increment
+        log_weights[~np.isfinite(increment)] = -np.inf
+        return log_weights
+
+    def _next_temperature(self, increment, temperature):
+        """ Selects the next temperature by bisection such that the ESS of
+            the incremental weights is target_ess times the no. particles. """
+        target = self.settings['target_ess'] * self.settings['no_particles']
+
+        def ess(step):
+            log_weights = self._incremental_log_weights(increment, step)
+            log_weights -= np.max(log_weights)
+            weights = np.exp(log_weights)
+            return np.sum(weights)**2 / np.sum(weights**2)
+
+        if ess(1.0 - temperature) >= target:
+            return 1.0
+
+        lower = 0.0
+        upper = 1.0 - temperature
+        for _ in range(50):
+            middle = 0.5 * (lower + upper)
+            if ess(middle) < target:
+                upper = middle
+            else:
+                lower = middle
+        return temperature + max(lower, 1e-8)
+
+    def _move_particles(self, temperature):
+        """ Rejuvenates the particles by steps of the MH kernel targeting the
+            tempered distribution. Returns the mean acceptance rate. """
+        no_particles = self.settings['no_particles']
+        kernel = self.kernel
+
+        cov = np.atleast_2d(np.cov(self.particles['free_params'], rowvar=False))
+        cov += 1e-10 * np.eye(self.no_params_to_estimate)
+        kernel.settings['base_hessian'] = cov
+        kernel.settings['temperature'] = temperature
+        kernel.no_hessians_corrected = 0
+        kernel.iter_hessians_corrected = []
+
+        accepted = 0.0
+        for _ in range(self.settings['no_moves']):
+            cur = self._get_proposals(self.particles, temperature)
+            prop_free_params = np.array(self.particles['free_params'])
+            for j in range(no_particles):
+                if cur[j]['valid']:
+                    prop_free_params[j] = kernel._sample_candidates(cur[j], 1)[0]
+            prop = self._evaluate_params(prop_free_params)
+            prop_proposals = self._get_proposals(prop, temperature)
+
+            # Compute the acceptance probabilities
+            log_accept_prob = self._log_target(prop, temperature)
+            log_accept_prob -= self._log_target(self.particles, temperature)
+            for j in range(no_particles):
+                if not (cur[j]['valid'] and prop_proposals[j]['valid']):
+                    log_accept_prob[j] = -np.inf
+                    continue
+                log_accept_prob[j] += kernel._get_log_proposal(cur[j]['free_params'],
+                                                               prop_proposals[j])
+                log_accept_prob[j] -= kernel._get_log_proposal(prop_free_params[j], cur[j])
+            log_accept_prob[~np.isfinite(log_accept_prob)] = -np.inf
+
+            accept = np.log(np.random.uniform(size=no_particles)) < log_accept_prob
+            for key in self.particles:
+                self.particles[key][accept] = prop[key][accept]
+            accepted += np.mean(accept)
+        return accepted / self.settings['no_moves']
+
+    def _get_proposals(self, state, temperature):
+        """ Returns the proposal of the MH kernel at each particle.
+
+            The kernel scales the gradient and Hessian of the log-posterior by
+            the temperature, so the contribution of the reference distribution
+            is added to them divided by the temperature. This gives the
+            gradient and Hessian of the tempered target in the proposal.
+
+        """
+        spread = self.settings['initial_params_spread']
+        scale = (1.0 - temperature) / temperature
+        reference_hessian = scale / spread**2 * np.eye(self.no_params_to_estimate)
+
+        proposals = []
+        for j in range(self.settings['no_particles']):
+            proposal = {'free_params': state['free_params'][j],
+                        'valid': state['valid'][j]}
+            if proposal['valid']:
+                reference_gradient = -(state['free_params'][j] - self.reference_mean) / spread**2
+                results = {'gradient_internal': state['gradient'][j] + scale * reference_gradient,
+                           'hessian_internal': state['hessian'][j] + reference_hessian}
+                try:
+                    proposal.update(self.kernel._get_proposal(SimpleNamespace(results=results)))
+                except np.linalg.LinAlgError:
+                    proposal['valid'] = False
+            proposals.append(proposal)
+        return proposals
+
+    def _evaluate_params(self, free_params):
+        """ Evaluates the log-prior, log-Jacobian and log-likelihood (and its
+            gradient and Hessian) for all particles. """
+        no_particles, no_params = free_params.shape
+        model = self.model
+        saved_params = (copy.deepcopy(model.params), copy.deepcopy(model.free_params))
+
+        try:
+            with np.errstate(all='ignore'):
+                model.params = copy.deepcopy(model.true_params)
+                model.transform_params_to_free()
+                for j, param in enumerate(model.params_to_estimate):
+                    model.free_params[param] = free_params[:, j]
+                model.transform_params_from_free()
+
+                params = np.zeros((no_particles, no_params))
+                for j, param in enumerate(model.params_to_estimate):
+                    params[:, j] = model.params[param]
+                log_jacobian = np.ones(no_particles) * model.log_jacobian()
+                log_prior = np.ones(no_particles) * model.log_prior()[1]
+        finally:
+            model.params, model.free_params = saved_params
+
+        valid = np.isfinite(log_jacobian) & np.isfinite(log_prior)
+        valid &= np.all(np.isfinite(params), axis=1)
+        log_like = -np.inf * np.ones(no_particles)
+        gradient = np.zeros((no_particles, no_params))
+        hessian = np.zeros((no_particles, no_params, no_params))
+
+        idx = np.where(valid)[0]
+        if len(idx) > 0:
+            blocks = np.array_split(idx, min(len(idx), max(self.pool.no_workers, 1)))
+            seeds = np.random.randint(0, 2**31 - 1, size=len(blocks))
+            estimate_gradient = self.use_grad_info or self.use_hess_info
+            tasks = [(params[block, :], estimate_gradient, seed)
+                     for block, seed in zip(blocks, seeds)]
+            output = self.pool.map(_estimate_log_like, tasks)
+            for block, out in zip(blocks, output):
+                log_like[block] = out[0]
+                if estimate_gradient:
+                    gradient[block, :] = out[1]
+                    hessian[block, :, :] = out[2]
+
+        with np.errstate(invalid='ignore'):
+            valid &= np.isfinite(log_like) & np.all(np.isfinite(gradient), axis=1)
+            valid &= np.all(np.isfinite(hessian), axis=(1, 2))
+        return {'free_params': free_params,
+                'params': params,
+                'log_jacobian': log_jacobian,
+                'log_prior': log_prior,
+                'log_like': log_like,
+                'gradient': gradient,
+                'hessian': hessian,
+                'valid': valid
+               }
+
+    def _print_greeting(self, state_estimator):
+        print("")
+        print("###################################################################")
+        print("Starting tempered SMC sampler...")
+        print("")
+        print("Sampling from the parameter posterior using: " + self.name)
+        print("in the model: " + self.model.name)
+        print("")
+        print("Likelihood estimated using:")
+        print(state_estimator.name)
+        print("")
+        print("Running {} particles with {} moves per stage.".format(self.settings['no_particles'],
+                                                                  self.settings['no_moves']))
+        print("###################################################################")
+
+    def print_progress_report(self):
+        """ Prints a progress report to the screen after each stage. """
+        if not self.settings['verbose']:
+            return
+        print("###################################################################")
+        print(" Stage: " + str(len(self.temperatures) - 1) + " completed.")
+        print(" Temperature: {:.4f}, ESS: {:.1f} and acceptance rate: {:.3f}.".format(
+            self.temperatures[-1], self.ess[-1], self.accept_rate[-1]))
+        print(" Current posterior mean estimate (tempered): ")
+        print(["%.4f" % v for v in np.mean(self.particles['params'], axis=0)])
+        print("###################################################################")
+
+    def get_samples(self):
+        """ Returns the (equally weighted) particles from the posterior. """
+        return self.particles['params']
+
+    def compile_results(self, sim_name=None, sim_desc=None):
+        """ Compiles results after a run. """
+        current_time = time.strftime("%c")
+
+        smcout = {}
+        smcout.update({'params': self.particles['params']})
+        smcout.update({'free_params': self.particles['free_params']})
+        smcout.update({'log_like': self.particles['log_like']})
+        smcout.update({'log_marginal_likelihood': self.log_marginal_likelihood})
+        smcout.update({'temperatures': np.array(self.temperatures)})
+        smcout.update({'ess': np.array(self.ess)})
+        smcout.update({'accept_rate': np.array(self.accept_rate)})
+        smcout.update({'simulation_description': sim_desc})
+        smcout.update({'simulation_name': sim_name})
+        smcout.update({'simulation_time': current_time})
+        smcout.update({'time_per_stage': self.time_per_stage})
+
+        data = {}
+        data.update({'observations': self.model.obs})
+        data.update({'simulation_description': sim_desc})
+        data.update({'simulation_name': sim_name})
+        data.update({'simulation_time': current_time})
+
+        settings = copy.deepcopy(self.settings)
+        settings.update({'sampler_name': self.name})
+        settings.update({'simulation_description': sim_desc})
+        settings.update({'simulation_name': sim_name})
+        settings.update({'simulation_time': current_time})
+        return smcout, data, settings
+
+    def save_to_file(self, output_path=None, sim_name=None, sim_desc=None):
+        """ Stores the output from a run to file (as JSON). """
+        if output_path is None:
+            raise ValueError("No output path given...")
+
+        smcout, data, settings = self.compile_results(sim_name=sim_name,
+                                                      sim_desc=sim_desc)
+        desc = {'description': settings['simulation_description'],
+                'time': settings['simulation_time']
+               }
+        write_to_json(smcout, output_path, sim_name, 'smc_output.json')
+        write_to_json(data, output_path, sim_name, 'data.json')
+        write_to_json(settings, output_path, sim_name, 'settings.json')
+        write_to_json(desc, output_path, sim_name, 'description.txt')
+
+
+def _estimate_log_like(task):
+    """ Estimates the log-likelihood (and gradients) for a block of particles
+        in a worker process. """
+    params, estimate_gradient, seed = task
+    context = get_worker_context()
+    np.random.seed(seed)
+
+    if estimate_gradient:
+        output = context['state_estimator'].smoother_batch(context['model'], params)
+        return (np.array(output['log_like']), np.array(output['gradient_internal']),
+                np.array(output['hessian_internal']))
+    output = context['state_estimator'].filter_batch(context['model'], params)
+    return np.array(output['log_like']), None, None
+
+
+def _systematic(weights):
+    """ Systematic resampling of the particles. """
+    no_particles = len(weights)
+    positions = (np.arange(no_particles) + np.random.uniform()) / no_particles
+    cum_weights = np.cumsum(weights)
+    cum_weights[-1] = 1.0
+    return np.searchsorted(cum_weights, positions)
@@ -3,6 +3,10 @@ import sys
 import scripts.example1_lgss_kalman as example1
 import scripts.example2_lgss_particles as example2
 import scripts.example3_stochastic_volatility as example3
+import scripts.benchmark_sqmc as benchmark_sqmc
+import scripts.benchmark_suite as benchmark_suite
+import scripts.benchmark_efficiency as benchmark_efficiency
+import scripts.run_experiments as run_experiments
 
 if len(sys.argv) > 1:
     if (len(sys.argv) > 2) and int(sys.argv[2]) == 1:
@@ -13,7 +17,16 @@ if len(sys.argv) > 1:
         print("Running reduced experiment (1 Monte Carlo run).")
         NO_ITERS = 1
 
-    if int(sys.argv[1]) == 1:
+    if (len(sys.argv) > 3) and int(sys.argv[1]) in (1, 2, 3):
+        # Run the jobs of the experiment in parallel (and resume earlier runs)
+        print("Running example " + sys.argv[1] + " using " + sys.argv[3] + " workers.")
+        if int(sys.argv[1]) == 3:
+            NO_ITERS = 1
+        run_experiments.run_experiments(examples=(int(sys.argv[1]),),
+                                        seed_offsets=range(NO_ITERS),
+                                        no_workers=int(sys.argv[3]))
+
+    elif int(sys.argv[1]) == 1:
         print("Running first example.")
         for i in range(NO_ITERS):
             example1.main(seed_offset=i)
@@ -27,6 +40,30 @@ if len(sys.argv) > 1:
         print("Running third example.")
         example3.main(seed_offset=0)
 
+    elif int(sys.argv[1]) == 4:
+        print("Running benchmark of the SQMC filter.")
+        benchmark_sqmc.main(seed_offset=0)
+
+    elif int(sys.argv[1]) == 5:
+        # The optional third argument is the results of an earlier run
+        print("Running benchmark suite.")
+        baseline_file = sys.argv[3] if len(sys.argv) > 3 else None
+        _, comparison = benchmark_suite.main(seed_offset=0,
+                                             quick=(NO_ITERS == 1),
+                                             baseline_file=baseline_file)
+        if comparison is not None and comparison['regression'].any():
+            sys.exit(1)
+
+    elif int(sys.argv[1]) == 6:
+        # The optional third argument is the number of workers
+        print("Running comparison of the statistical efficiency of the MH variants.")
+        no_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        if NO_ITERS == 1:
+            benchmark_efficiency.main(examples=(1,), no_workers=no_workers)
+        else:
+            benchmark_efficiency.main(examples=(1, 2), no_iters=10000,
+                                      no_burnin_iters=3000, no_workers=no_workers)
+
     else:
         raise NameError("Unknown example.")
 else:
@@ -0,0 +1,186 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Script for comparing the statistical efficiency of the MH variants."""
+import contextlib
+import importlib
+import io
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from helpers.file_system import ensure_dir
+from helpers.parallel import run_in_pool
+from parameter.mcmc.performance_measures import compute_ess
+from scripts.run_experiments import EXAMPLES
+
+
+def get_configurations(examples=(1,), seed_offset=0, alg_types=None, settings_grid=None):
+    """ Returns the sampler configurations to compare.
+
+        Each run of the examples (see get_runs in the example scripts) is
+        combined with each combination of the MH settings in settings_grid.
+
+        Args:
+            examples: the numbers of the examples (see run_experiments).
+            seed_offset: the seed offset of the runs.
+            alg_types: the MH variants to include. If None, all are included.
+            settings_grid: a dict with lists of values of MH settings, e.g.
+                           {'qn_memory_length': (10, 20, 40)}. (dict)
+
+        Returns:
+            A list of dicts with the example, the index of the run, its name,
+            the MH variant and the settings to change.
+
+    """
+    grid = sorted((settings_grid or {}).items())
+    names = [name for name, _ in grid]
+    combinations = list(itertools.product(*[values for _, values in grid]))
+
+    configurations = []
+    for example in examples:
+        module = importlib.import_module(EXAMPLES[int(example)])
+        for run_index, run in enumerate(module.get_runs(seed_offset=seed_offset)):
+            alg_type = run.get('alg_type', run.get('mh_version'))
+            if alg_types and alg_type not in alg_types:
+                continue
+            for values in combinations:
+                configurations.append({'example': int(example),
+                                       'run_index': run_index,
+                                       'sim_name': run['sim_name'],
+                                       'alg_type': alg_type,
+                                       'settings': dict(zip(names, values))})
+    return configurations
+
+
+def main(examples=(1,), seed_offset=0, no_iters=2000, no_burnin_iters=500,
+         alg_types=None, settings_grid=None, no_workers=1,
+         output_path='../results/benchmarks', label=None):
+    """ Runs each sampler configuration for a fixed number of iterations.
+
+        For each configuration (see get_configurations), the MH algorithm is
+        run for no_iters iterations (of which no_burnin_iters are burn-in)
+        and the acceptance rate, the rate of corrected Hessian estimates,
+        the effective sample size (ESS) of each parameter (after burn-in),
+        the ESS per second and per likelihood estimate as well as the time
+        spent in the state estimator and in the rest of the MH algorithm are
+        computed. The configurations are run in no_workers processes, which
+        should not be larger than the number of cores as this distorts the
+        times.
+
+        Returns:
+            A pandas.DataFrame with one row for each configuration sorted by
+            the smallest ESS per second over the parameters (the table is
+            also written as a csv file to output_path).
+
+    """
+    configurations = get_configurations(examples, seed_offset, alg_types, settings_grid)
+    tasks = [(configuration, seed_offset, no_iters, no_burnin_iters)
+             for configuration in configurations]
+    print("Running " + str(len(tasks)) + " sampler configurations for " +
+          str(no_iters) + " iterations using " + str(no_workers) + " workers.")
+    output = run_in_pool(_run_configuration, tasks, no_workers=no_workers)
+
+    data_frame = pd.DataFrame(output)
+    data_frame = data_frame.sort_values('min_ess_per_second', ascending=False)
+    data_frame = data_frame.reset_index(drop=True)
+
+    columns = ['sim_name', 'settings', 'acceptance_rate', 'hessian_correction_rate',
+               'min_ess_per_second', 'min_ess_per_evaluation', 'total_time',
+               'state_estimation_fraction']
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(data_frame[columns])
+
+    if output_path:
+        if label is None:
+            label = time.strftime("%Y%m%d_%H%M%S")
+        file_name = os.path.join(output_path, 'efficiency_' + label + '.csv')
+        ensure_dir(file_name)
+        data_frame.to_csv(file_name, index=False, header=True)
+        print("Wrote results to file: " + file_name + ".")
+    return data_frame
+
+
+class _TimedStateEstimator(object):
+    """ Counts and times the calls to the filter and smoother of an estimator. """
+
+    def __init__(self, state_estimator):
+        self.state_estimator = state_estimator
+        self.no_evaluations = 0
+        self.time = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.state_estimator, name)
+
+    def filter(self, model):
+        self._call(self.state_estimator.filter, model)
+
+    def smoother(self, model):
+        self._call(self.state_estimator.smoother, model)
+
+    def _call(self, method, model):
+        start_time = time.perf_counter()
+        try:
+            method(model)
+        finally:
+            self.time += time.perf_counter() - start_time
+            self.no_evaluations += 1
+
+
+def _run_configuration(task):
+    """ Runs the MH algorithm for a configuration and computes the measures. """
+    configuration, seed_offset, no_iters, no_burnin_iters = task
+    module = importlib.import_module(EXAMPLES[configuration['example']])
+    run = module.get_runs(seed_offset=seed_offset)[configuration['run_index']]
+
+    run['mh_settings'].update(configuration['settings'])
+    run['mh_settings'].update({'no_iters': no_iters,
+                               'no_burnin_iters': no_burnin_iters,
+                               'no_iters_between_progress_reports': no_iters + 1})
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        model, state_estimator, mh, _ = module.setup_job(run)
+        timed_estimator = _TimedStateEstimator(state_estimator)
+        mh.run(timed_estimator)
+
+    total_time = mh.time_per_iteration * no_iters
+    ess = compute_ess(mh)
+    no_evaluations = timed_estimator.no_evaluations
+
+    output = {'example': configuration['example'],
+              'sim_name': configuration['sim_name'],
+              'alg_type': configuration['alg_type'],
+              'settings': str(configuration['settings']),
+              'no_iters': no_iters,
+              'acceptance_rate': float(np.mean(mh.accepted[no_burnin_iters:])),
+              'hessian_correction_rate': mh.no_hessians_corrected / float(no_iters),
+              'no_likelihood_evaluations': no_evaluations,
+              'total_time': total_time,
+              'state_estimation_time': timed_estimator.time,
+              'other_time': total_time - timed_estimator.time,
+              'state_estimation_fraction': timed_estimator.time / total_time,
+              'min_ess': float(np.min(ess)),
+              'min_ess_per_second': float(np.min(ess)) / total_time,
+              'min_ess_per_evaluation': float(np.min(ess)) / max(no_evaluations, 1)}
+    for i, param in enumerate(model.params_to_estimate):
+        output['ess_' + param] = float(ess[i])
+        output['ess_per_second_' + param] = float(ess[i]) / total_time
+    return output
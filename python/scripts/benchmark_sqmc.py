@@ -0,0 +1,100 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Script for comparing the SQMC filter with the bootstrap particle filter."""
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from helpers.file_system import ensure_dir
+from models.linear_gaussian_model import LinearGaussianModel
+from state.kalman_methods.standard import KalmanMethods
+from state.particle_methods.standard import ParticleMethods
+from state.particle_methods.cython_lgss import ParticleMethodsCythonLGSS
+
+def main(seed_offset=0, no_reps=50, particle_counts=(100, 250, 500, 1000),
+         output_path='../results/benchmark_sqmc'):
+    """ Runs the benchmark.
+
+        Estimates the log-likelihood of the linear Gaussian model (where the
+        true value is given by the Kalman filter) no_reps times using the
+        bootstrap particle filter and the SQMC filter for each number of
+        particles (and the Cython implementations, where the number of
+        particles is set in the .pyx-file). The variance of the estimates,
+        the CPU time per estimate and the inverse of their product (the
+        efficiency, higher is better) are printed and saved to a csv file.
+
+    """
+    np.random.seed(87655678 + int(seed_offset))
+
+    # System model
+    sys_model = LinearGaussianModel()
+    sys_model.params['mu'] = 0.20
+    sys_model.params['phi'] = 0.50
+    sys_model.params['sigma_v'] = 1.00
+    sys_model.params['sigma_e'] = 0.50
+    sys_model.no_obs = 500
+    sys_model.initial_state = 0.0
+    sys_model.import_data(file_name="../data/linear_gaussian_model/linear_gaussian_model_T500_midSNR.csv")
+    sys_model.fix_true_params()
+    sys_model.create_inference_model(params_to_estimate=('mu', 'phi', 'sigma_v'))
+
+    kf = KalmanMethods()
+    kf.filter(sys_model)
+    true_log_like = float(kf.results['log_like'])
+
+    estimators = []
+    for no_particles in particle_counts:
+        for sqmc in (False, True):
+            settings = {'no_particles': no_particles,
+                        'generate_initial_state': True,
+                        'sqmc': sqmc}
+            estimators.append(('python', no_particles, ParticleMethods(settings)))
+    for sqmc in (False, True):
+        estimators.append(('cython', None, ParticleMethodsCythonLGSS({'sqmc': sqmc})))
+
+    output = []
+    for implementation, no_particles, estimator in estimators:
+        log_like = np.zeros(no_reps)
+        start_time = time.process_time()
+        for i in range(no_reps):
+            estimator.filter(sys_model)
+            log_like[i] = float(estimator.results['log_like'])
+        cpu_time = (time.process_time() - start_time) / no_reps
+
+        variance = np.var(log_like, ddof=1)
+        output.append({'implementation': implementation,
+                       'filter': estimator.name,
+                       'no_particles': no_particles,
+                       'mean_log_like_error': np.mean(log_like) - true_log_like,
+                       'variance': variance,
+                       'cpu_time': cpu_time,
+                       'efficiency': 1.0 / (variance * cpu_time)
+                       })
+        print("{:45s} {:>6s}: variance {:10.4f}, CPU time {:7.3f} s, efficiency {:10.2f}".format(
+            estimator.name, str(no_particles or ''), variance, cpu_time,
+            output[-1]['efficiency']))
+
+    data_frame = pd.DataFrame(output)
+    if output_path:
+        file_name = os.path.join(output_path, 'benchmark_sqmc_' + str(seed_offset) + '.csv')
+        ensure_dir(file_name)
+        data_frame.to_csv(file_name, index=False, header=True)
+        print("Wrote results to file: " + file_name + ".")
+    return data_frame
@@ -0,0 +1,424 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Script for benchmarking the state estimators and the MH algorithm."""
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from helpers.file_system import ensure_dir
+from helpers.parallel import get_peak_memory
+from models.linear_gaussian_model import LinearGaussianModel
+from models.stochastic_volatility_model import StochasticVolatilityModel
+from models.stochastic_volatility_model_leverage import StochasticVolatilityModelLeverage
+from parameter.mcmc.metropolis_hastings import MetropolisHastings
+from state.base_state_inference import BaseStateInference
+from state.kalman_methods.standard import KalmanMethods
+from state.kalman_methods.cython import KalmanMethodsCython
+from state.particle_methods.standard import ParticleMethods
+from state.particle_methods.cython_lgss import ParticleMethodsCythonLGSS
+from state.particle_methods.cython_sv import ParticleMethodsCythonSV
+from state.particle_methods.cython_sv_leverage import ParticleMethodsCythonSVLeverage
+
+MODELS = {'lgss': (LinearGaussianModel, ('mu', 'phi', 'sigma_v')),
+          'sv': (StochasticVolatilityModel, ('mu', 'phi', 'sigma_v')),
+          'sv_leverage': (StochasticVolatilityModelLeverage, ('mu', 'phi', 'sigma_v', 'rho'))}
+
+# The Cython implementations are compiled for a fixed number of observations
+# (the constant NoObs - 1 in the .pyx-files)
+CYTHON_PARTICLE_METHODS = {'lgss': (ParticleMethodsCythonLGSS, 500),
+                           'sv': (ParticleMethodsCythonSV, 725),
+                           'sv_leverage': (ParticleMethodsCythonSVLeverage, 725)}
+CYTHON_KALMAN_NO_OBS = 500
+
+# Columns identifying a benchmark (used when comparing with a baseline)
+KEY_COLUMNS = ['benchmark', 'model', 'implementation', 'estimator', 'method',
+               'no_obs', 'no_particles', 'fixed_lag', 'alg_type']
+
+
+def make_model(model_name, no_obs, seed=87655678):
+    """ Returns a model with no_obs observations simulated from the model. """
+    np.random.seed(seed)
+    model_class, params_to_estimate = MODELS[model_name]
+    model = model_class()
+    if model_name == 'lgss':
+        model.params.update({'mu': 0.20, 'phi': 0.50, 'sigma_v': 1.00, 'sigma_e': 0.50})
+    model.no_obs = no_obs
+    model.initial_state = 0.0
+    model.generate_data()
+    model.fix_true_params()
+    model.create_inference_model(params_to_estimate=params_to_estimate)
+    return model
+
+
+def time_call(func, no_reps=5):
+    """ Times a function and measures the memory allocated by it.
+
+        The function is called once as a warm-up, no_reps times for the
+        timing and once more with tracemalloc enabled (which slows it down)
+        for the memory.
+
+        Returns:
+            A dict with the median and minimum wall-clock time (seconds) and
+            the peak memory (MB) traced during a call. Memory allocated by
+            the C-code (e.g. by malloc in the Cython implementations) is not
+            traced.
+
+    """
+    func()
+    times = np.zeros(no_reps)
+    for i in range(no_reps):
+        start_time = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'median_time': float(np.median(times)),
+            'min_time': float(np.min(times)),
+            'peak_traced_mb': peak_memory / 1024.0**2,
+            'no_reps': no_reps}
+
+
+def get_estimators(model_name, no_obs, particle_counts, fixed_lags):
+    """ Returns the state estimators to benchmark for a model.
+
+        Returns:
+            A list of (implementation, no_particles, fixed_lag, estimator).
+
+    """
+    estimators = []
+    if model_name == 'lgss':
+        estimators.append(('python', None, None, KalmanMethods({'estimate_gradient': True})))
+        if no_obs == CYTHON_KALMAN_NO_OBS:
+            estimators.append(('cython', None, None, KalmanMethodsCython({'estimate_gradient': True})))
+
+    for no_particles in particle_counts:
+        for fixed_lag in fixed_lags:
+            settings = {'no_particles': no_particles,
+                        'fixed_lag': fixed_lag,
+                        'generate_initial_state': True,
+                        'estimate_gradient': True,
+                        'estimate_hessian': True}
+            estimators.append(('python', no_particles, fixed_lag, ParticleMethods(settings)))
+
+    cython_class, cython_no_obs = CYTHON_PARTICLE_METHODS[model_name]
+    if no_obs == cython_no_obs:
+        settings = {'generate_initial_state': True,
+                    'estimate_gradient': True,
+                    'estimate_hessian': True}
+        estimators.append(('cython', None, None, cython_class(settings)))
+    return estimators
+
+
+def benchmark_estimators(model_names=('lgss', 'sv', 'sv_leverage'),
+                         series_lengths=(500, 725), particle_counts=(100, 500),
+                         fixed_lags=(5, 10), no_reps=5):
+    """ Times filter and smoother calls of the state estimators.
+
+        The Python implementations are run for all combinations of series
+        lengths, particle counts and fixed lags. The Cython implementations
+        (and the Cython Kalman methods) are only run for the series length
+        that they are compiled for and their number of particles and lag are
+        given by the constants in the .pyx-files.
+
+        Returns:
+            A list of dicts with the results.
+
+    """
+    output = []
+    for model_name in model_names:
+        for no_obs in series_lengths:
+            model = make_model(model_name, no_obs)
+            estimators = get_estimators(model_name, no_obs, particle_counts, fixed_lags)
+            for implementation, no_particles, fixed_lag, estimator in estimators:
+                for method in ('filter', 'smoother'):
+                    func = getattr(estimator, method)
+                    result = time_call(lambda: func(model), no_reps)
+                    result.update({'benchmark': 'state_estimator',
+                                   'model': model_name,
+                                   'implementation': implementation,
+                                   'estimator': type(estimator).__name__,
+                                   'method': method,
+                                   'no_obs': no_obs,
+                                   'no_particles': no_particles,
+                                   'fixed_lag': fixed_lag,
+                                   'alg_type': None})
+                    output.append(result)
+                    _print_result(result)
+    return output
+
+
+def check_batch_estimators(no_batch=10, no_obs=CYTHON_KALMAN_NO_OBS, tolerance=1e-8):
+    """ Checks that smoother_batch agrees with a loop over smoother.
+
+        The Kalman smoothers (Python and Cython) are run on a batch of
+        parameters drawn around the true values and the log-likelihoods and
+        gradients are compared with those from calling the smoother once for
+        each parameter (the loop in BaseStateInference).
+
+        Returns:
+            The largest relative difference over the estimators.
+
+        Raises:
+            ValueError: if the difference is larger than tolerance.
+
+    """
+    model = make_model('lgss', no_obs)
+    true_params = np.array([model.params[param] for param in model.params_to_estimate])
+    param_matrix = true_params + 0.05 * np.random.randn(no_batch, len(true_params))
+
+    estimators = [KalmanMethods({'estimate_gradient': True})]
+    if no_obs == CYTHON_KALMAN_NO_OBS:
+        estimators.append(KalmanMethodsCython({'estimate_gradient': True}))
+
+    max_difference = 0.0
+    for estimator in estimators:
+        batch = estimator.smoother_batch(model, param_matrix)
+        batch = {key: np.array(value) for key, value in batch.items()}
+        single = BaseStateInference.smoother_batch(estimator, model, param_matrix)
+        for key in ('log_like', 'log_joint_gradient_estimate', 'gradient_internal'):
+            difference = np.max(np.abs(batch[key] - single[key]))
+            difference /= max(np.max(np.abs(single[key])), 1.0)
+            max_difference = max(max_difference, difference)
+            if not difference <= tolerance:
+                raise ValueError("smoother_batch and smoother differ in " + key +
+                                 " for " + type(estimator).__name__ +
+                                 " (relative difference: " + str(difference) + ").")
+    print("smoother_batch agrees with smoother (largest relative difference: " +
+          "{:.2e}".format(max_difference) + ").")
+    return max_difference
+
+
+def benchmark_mh_iterations(alg_types=('mh0', 'mh1', 'mh2', 'qmh', 'mtm'), no_iters=50,
+                            no_obs=500):
+    """ Times single iterations of the MH algorithm for each variant.
+
+        The MH algorithm is run for the linear Gaussian model using the
+        Kalman methods (so the time is dominated by the proposal and the
+        overhead in Python). After the initialisation, no_iters iterations
+        are timed one at a time. The run is then repeated with tracemalloc
+        enabled (which slows it down) for the memory. The candidates of
+        multiple-try Metropolis (mtm) are evaluated in the current process
+        (mtm_no_workers is 1), so an iteration includes the filter calls for
+        all the candidates and the reference set.
+
+        Returns:
+            A list of dicts with the results.
+
+    """
+    model = make_model('lgss', no_obs)
+    output = []
+    for alg_type in alg_types:
+        mh_settings = {'no_iters': no_iters + 1,
+                       'no_burnin_iters': 0,
+                       'step_size': 0.5,
+                       'base_hessian': np.diag((0.10**2, 0.05**2, 0.05**2)),
+                       'initial_params': (0.2, 0.5, 1.0),
+                       'qn_memory_length': 10,
+                       'qn_strategy': 'bfgs',
+                       'mtm_no_workers': 1,
+                       'qn_initial_hessian_fixed': np.eye(3) * 0.01**2,
+                       'no_iters_between_progress_reports': 10 * no_iters
+                       }
+        with contextlib.redirect_stdout(io.StringIO()):
+            mh, state_estimator = _initialise_mh(model, alg_type, mh_settings)
+            times = np.zeros(no_iters)
+            for i in range(1, no_iters + 1):
+                mh.current_iter = i
+                start_time = time.perf_counter()
+                mh._iterate(state_estimator)
+                times[i - 1] = time.perf_counter() - start_time
+
+            mh, state_estimator = _initialise_mh(model, alg_type, mh_settings)
+            tracemalloc.start()
+            try:
+                for i in range(1, no_iters + 1):
+                    mh.current_iter = i
+                    mh._iterate(state_estimator)
+                _, peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        result = {'benchmark': 'mh_iteration',
+                  'model': 'lgss',
+                  'implementation': 'python',
+                  'estimator': type(state_estimator).__name__,
+                  'method': 'iteration',
+                  'no_obs': no_obs,
+                  'no_particles': None,
+                  'fixed_lag': None,
+                  'alg_type': alg_type,
+                  'median_time': float(np.median(times)),
+                  'min_time': float(np.min(times)),
+                  'peak_traced_mb': peak_memory / 1024.0**2,
+                  'no_reps': no_iters}
+        output.append(result)
+        _print_result(result)
+    return output
+
+
+def _initialise_mh(model, alg_type, mh_settings):
+    """ Returns the MH algorithm and the Kalman methods after the
+        initialisation (with a fixed seed). """
+    np.random.seed(87655678)
+    state_estimator = KalmanMethods()
+    mh = MetropolisHastings(model, alg_type, mh_settings)
+    if mh.use_grad_info or mh.use_hess_info:
+        state_estimator.settings['estimate_gradient'] = True
+    mh._initialise_params(state_estimator, model)
+    return mh, state_estimator
+
+
+def compare_to_baseline(data_frame, baseline_file, tolerance=0.25):
+    """ Compares the results of a benchmark with a stored baseline.
+
+        Args:
+            data_frame: the results from main. (pandas.DataFrame)
+            baseline_file: relative search path to the JSON file written by
+                           main for the baseline. (string)
+            tolerance: a benchmark is a regression if its median time is
+                       larger than (1 + tolerance) times the baseline.
+
+        Returns:
+            A pandas.DataFrame with the median times, their ratio and a
+            column regression for the benchmarks in both runs.
+
+    """
+    with open(baseline_file, 'r') as fin:
+        baseline = pd.DataFrame(json.load(fin)['results'])
+
+    comparison = pd.merge(_fill_keys(data_frame), _fill_keys(baseline),
+                          on=KEY_COLUMNS, suffixes=('', '_baseline'))
+    comparison = comparison[KEY_COLUMNS + ['median_time', 'median_time_baseline']]
+    comparison['ratio'] = comparison['median_time'] / comparison['median_time_baseline']
+    comparison['regression'] = comparison['ratio'] > 1.0 + tolerance
+
+    for _, row in comparison[comparison['regression']].iterrows():
+        print("Regression in {} {} {} {} (T={}, N={}, lag={}, {}): {:.2f}x slower.".format(
+            row['benchmark'], row['model'], row['estimator'], row['method'],
+            row['no_obs'], row['no_particles'], row['fixed_lag'], row['alg_type'],
+            row['ratio']))
+    print("Compared {} benchmarks with baseline: {} ({} regressions).".format(
+        comparison.shape[0], baseline_file, int(comparison['regression'].sum())))
+    return comparison
+
+
+def main(seed_offset=0, quick=False, output_path='../results/benchmarks',
+         label=None, baseline_file=None, tolerance=0.25):
+    """ Runs the benchmark suite.
+
+        The results are printed and written to output_path as a csv file
+        and a JSON file (with information about the machine and the versions
+        of Python and NumPy). The JSON file of an earlier run can be given
+        as baseline_file to detect regressions. Before the timings, the
+        batched Kalman smoothers are checked against the single-call
+        smoothers (see check_batch_estimators).
+
+        Args:
+            seed_offset: offset of the random seed.
+            quick: run a reduced suite (for testing the setup). (boolean)
+            output_path: directory for the results (None: not written).
+            label: name of the files (default: the current date and time).
+            baseline_file: JSON file from an earlier run to compare with.
+            tolerance: relative slowdown counted as a regression.
+
+        Returns:
+            A pandas.DataFrame with the results and one with the comparison
+            to the baseline (None if no baseline is given).
+
+    """
+    np.random.seed(87655678 + int(seed_offset))
+    check_batch_estimators()
+
+    if quick:
+        output = benchmark_estimators(model_names=('lgss',), series_lengths=(500,),
+                                      particle_counts=(100,), fixed_lags=(5,), no_reps=2)
+        output += benchmark_mh_iterations(alg_types=('mh0', 'mh1'), no_iters=10)
+    else:
+        output = benchmark_estimators()
+        output += benchmark_mh_iterations()
+    data_frame = pd.DataFrame(output)[KEY_COLUMNS + ['median_time', 'min_time',
+                                                     'peak_traced_mb', 'no_reps']]
+
+    if output_path:
+        if label is None:
+            label = time.strftime("%Y%m%d_%H%M%S")
+        file_name = os.path.join(output_path, 'benchmark_' + label)
+        ensure_dir(file_name)
+        data_frame.to_csv(file_name + '.csv', index=False, header=True)
+        with open(file_name + '.json', 'w') as fout:
+            json.dump({'metadata': _get_metadata(),
+                       'results': json.loads(data_frame.to_json(orient='records'))},
+                      fout, indent=2)
+        print("Wrote results to files: " + file_name + ".csv/.json.")
+
+    comparison = None
+    if baseline_file:
+        comparison = compare_to_baseline(data_frame, baseline_file, tolerance)
+    return data_frame, comparison
+
+
+def _fill_keys(data_frame):
+    """ Converts the key columns to strings (for merging). """
+    data_frame = data_frame.copy()
+    for column in KEY_COLUMNS:
+        data_frame[column] = [_key_to_string(value) for value in data_frame[column]]
+    return data_frame
+
+
+def _key_to_string(value):
+    """ Returns a key as a string (integers stored as floats due to NaNs). """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return 'none'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _get_metadata():
+    """ Returns information about the machine and the run. """
+    metadata = {'created': time.strftime("%c"),
+                'python': sys.version,
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'peak_memory_mb': get_peak_memory()}
+    return metadata
+
+
+def _print_result(result):
+    print("{:16s} {:12s} {:7s} {:32s} {:9s} T={:<5} N={:<5} lag={:<4} {:5s}: {:10.5f} s, {:8.2f} MB".format(
+        result['benchmark'], result['model'], result['implementation'],
+        result['estimator'], result['method'], result['no_obs'],
+        str(result['no_particles'] or ''), str(result['fixed_lag'] or ''),
+        str(result['alg_type'] or ''), result['median_time'],
+        result['peak_traced_mb']))
@@ -20,8 +20,15 @@
 import numpy as np
 import scripts.helper_linear_gaussian as mh
 
-def main(seed_offset=0):
-    """Runs the experiment."""
+def get_runs(seed_offset=0):
+    """ Returns the runs of the experiment.
+
+        Each run is a dict with the arguments to the helper that runs the MH
+        algorithm and saves the output (see run_job), where the keys
+        sim_name and output_path give the directory of the output.
+
+    """
+    runs = []
 
     hessian_estimate = np.array([[ 0.00397222, -0.00228247,  0.00964908],
                                  [-0.00228247,  0.00465944, -0.00961161],
@@ -60,25 +67,27 @@ def main(seed_offset=0):
 
     mh_settings.update({'step_size': 2.562 / np.sqrt(3)})
     sim_name = 'example2_mh0pre_' + str(seed_offset)
-    mh.run(mh_settings=mh_settings,
-           cython_code=True,
-           kf_settings=None,
-           pf_settings=pf_settings,
-           filter_method='particle',
-           alg_type='mh0',
-           sim_name=sim_name,
-           seed_offset=seed_offset)
+    runs.append(dict(mh_settings=dict(mh_settings),
+                     cython_code=True,
+                     kf_settings=None,
+                     pf_settings=pf_settings,
+                     filter_method='particle',
+                     alg_type='mh0',
+                     sim_name=sim_name,
+                     seed_offset=seed_offset,
+                     output_path='../results/example2'))
 
     mh_settings.update({'step_size': 0.5 * 1.125 / np.sqrt(3**(1/3))})
     sim_name = 'example2_mh1pre_' + str(seed_offset)
-    mh.run(mh_settings=mh_settings,
-           cython_code=True,
-           kf_settings=None,
-           pf_settings=pf_settings,
-           filter_method='particle',
-           alg_type='mh1',
-           sim_name=sim_name,
-           seed_offset=seed_offset)
+    runs.append(dict(mh_settings=dict(mh_settings),
+                     cython_code=True,
+                     kf_settings=None,
+                     pf_settings=pf_settings,
+                     filter_method='particle',
+                     alg_type='mh1',
+                     sim_name=sim_name,
+                     seed_offset=seed_offset,
+                     output_path='../results/example2'))
 
     mh_settings.update({'step_size': 0.5})
     mh_settings.update({'base_hessian': 0.01**2 * np.eye(3)})
@@ -88,14 +97,15 @@ def main(seed_offset=0):
                 'Hessian such that the gradient gives a step of 0.01. Non-PD ',
                 'estimates are replaced with an empirical approximation of the ',
                 'Hessian.')
-    mh.run(mh_settings=mh_settings,
-           cython_code=True,
-           kf_settings=None,
-           pf_settings=pf_settings,
-           filter_method='particle',
-           alg_type='qmh',
-           sim_name=sim_name,
-           seed_offset=seed_offset)
+    runs.append(dict(mh_settings=dict(mh_settings),
+                     cython_code=True,
+                     kf_settings=None,
+                     pf_settings=pf_settings,
+                     filter_method='particle',
+                     alg_type='qmh',
+                     sim_name=sim_name,
+                     seed_offset=seed_offset,
+                     output_path='../results/example2'))
 
     mh_settings.update({'qn_strategy': 'bfgs',
                         'qn_only_accepted_info': True,
@@ -106,16 +116,34 @@ def main(seed_offset=0):
                 'Hessian such that the gradient gives a step of 0.01. Non-PD ',
                 'estimates are replaced with an empirical approximation of the ',
                 'Hessian.')
-    mh.run(mh_settings=mh_settings,
-           cython_code=True,
-           kf_settings=None,
-           pf_settings=pf_settings,
-           filter_method='particle',
-           alg_type='qmh',
-           sim_name=sim_name,
-           seed_offset=seed_offset)
-
-    return None
+    runs.append(dict(mh_settings=dict(mh_settings),
+                     cython_code=True,
+                     kf_settings=None,
+                     pf_settings=pf_settings,
+                     filter_method='particle',
+                     alg_type='qmh',
+                     sim_name=sim_name,
+                     seed_offset=seed_offset,
+                     output_path='../results/example2'))
+
+    return runs
+
+
+def run_job(run):
+    """Runs the MH algorithm for a run given by get_runs."""
+    mh.run(**run)
+
+
+def setup_job(run):
+    """ Returns the model, state estimator, MH algorithm and output path for
+        a run given by get_runs (without running it). """
+    return mh.setup(**run)
+
+
+def main(seed_offset=0):
+    """Runs the experiment."""
+    for run in get_runs(seed_offset=seed_offset):
+        run_job(run)
 
 
 if __name__ == '__main__':
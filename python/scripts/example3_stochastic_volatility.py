@@ -20,8 +20,15 @@
 import numpy as np
 import scripts.helper_stochastic_volatility as mh
 
-def main(seed_offset=0):
-    """Runs the experiment."""
+def get_runs(seed_offset=0):
+    """ Returns the runs of the experiment.
+
+        Each run is a dict with the arguments to the helper that runs the MH
+        algorithm and saves the output (see run_job), where the keys
+        sim_name and output_path give the directory of the output.
+
+    """
+    runs = []
 
     hessian_estimate = np.array([[ 0.38292444, -0.06509644, -0.01497287, 0.0],
                                  [-0.06509644,  0.08919909, -0.04952799, 0.0],
@@ -65,14 +72,32 @@ def main(seed_offset=0):
                 'Hessian such that the gradient gives a step of 0.01. Non-PD ',
                 'estimates are replaced with an empirical approximation of ',
                 'the Hessian.')
-    mh.run('qmh',
-            mh_settings=mh_settings,
-            pf_settings=pf_settings,
-            sim_name=sim_name,
-            sim_desc=sim_desc,
-            seed_offset=seed_offset)
-
-    return None
+    runs.append(dict(mh_version='qmh',
+                     mh_settings=dict(mh_settings),
+                     pf_settings=pf_settings,
+                     sim_name=sim_name,
+                     sim_desc=sim_desc,
+                     seed_offset=seed_offset,
+                     output_path='../results/example3'))
+
+    return runs
+
+
+def run_job(run):
+    """Runs the MH algorithm for a run given by get_runs."""
+    mh.run(**run)
+
+
+def setup_job(run):
+    """ Returns the model, state estimator, MH algorithm and output path for
+        a run given by get_runs (without running it). """
+    return mh.setup(**run)
+
+
+def main(seed_offset=0):
+    """Runs the experiment."""
+    for run in get_runs(seed_offset=seed_offset):
+        run_job(run)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,82 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Script for running the MH algorithm with remote worker servers."""
+import numpy as np
+
+from helpers.worker_service import start_local_workers
+from models.linear_gaussian_model import LinearGaussianModel
+from state.kalman_methods.standard import KalmanMethods
+from state.remote import RemoteStateInference
+from parameter.mcmc.metropolis_hastings import MetropolisHastings
+
+def main(seed_offset=0, no_workers=2, addresses=None):
+    """ Runs the MH algorithm for the linear Gaussian model, where the
+        log-likelihood and its gradients are estimated by worker servers.
+
+        If addresses (a list of (host, port)) is None, no_workers servers
+        are started on this machine. Otherwise, the servers must already be
+        running (e.g. on other machines, by calling serve_forever on a
+        WorkerServer) with the same model and data.
+
+    """
+    np.random.seed(87655678 + int(seed_offset))
+
+    # System model
+    sys_model = LinearGaussianModel()
+    sys_model.params['mu'] = 0.20
+    sys_model.params['phi'] = 0.50
+    sys_model.params['sigma_v'] = 1.00
+    sys_model.params['sigma_e'] = 0.50
+    sys_model.no_obs = 500
+    sys_model.initial_state = 0.0
+    sys_model.import_data(file_name="../data/linear_gaussian_model/linear_gaussian_model_T500_midSNR.csv")
+    sys_model.fix_true_params()
+    sys_model.create_inference_model(params_to_estimate=('mu', 'phi', 'sigma_v'))
+
+    # Worker servers
+    processes = []
+    if addresses is None:
+        kf = KalmanMethods({'initial_state': 0.0, 'initial_cov': 1e-5})
+        addresses, processes = start_local_workers(sys_model, kf, no_workers)
+    state_estimator = RemoteStateInference(addresses)
+    print("Connected to " + str(len(addresses)) + " workers: " + str(addresses) + ".")
+
+    # Metropolis-Hastings
+    mh_settings = {'no_iters': 1000,
+                   'no_burnin_iters': 250,
+                   'step_size': 1.0,
+                   'base_hessian': np.diag((0.10**2, 0.05**2, 0.05**2)),
+                   'initial_params': (0.2, 0.5, 1.0),
+                   'no_iters_between_progress_reports': 250,
+                   'mtm_no_candidates': len(addresses) + 1,
+                   'mtm_no_workers': len(addresses)
+                   }
+    mh = MetropolisHastings(sys_model, 'mh1', mh_settings)
+    try:
+        mh.run(state_estimator)
+    finally:
+        if processes:
+            state_estimator.client.shutdown_servers()
+            for process in processes:
+                process.join()
+        else:
+            state_estimator.close()
+
+    print("Posterior mean: " + str(np.mean(mh.params[mh_settings['no_burnin_iters']:, :], axis=0)))
+    return mh
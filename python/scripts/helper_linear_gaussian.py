@@ -25,9 +25,10 @@ from state.kalman_methods.cython import KalmanMethodsCython
 from state.particle_methods.standard import ParticleMethods
 from state.particle_methods.cython_lgss import ParticleMethodsCythonLGSS
 
-def run(mh_settings, cython_code=True, kf_settings=None, pf_settings=None,
-        filter_method='kalman', alg_type='mh0', sim_name='test', sim_desc=".",
-        seed_offset=0):
+def setup(mh_settings, cython_code=True, kf_settings=None, pf_settings=None,
+          filter_method='kalman', alg_type='mh0', sim_name='test', sim_desc=".",
+          seed_offset=0, output_path=None):
+    """ Returns the model, state estimator, MH algorithm and output path. """
 
     # Set random seed for repreducibility
     np.random.seed(87655678 + int(seed_offset))
@@ -62,16 +63,32 @@ def run(mh_settings, cython_code=True, kf_settings=None, pf_settings=None,
     # Metropolis-Hastings
     mh = MetropolisHastings(sys_model, alg_type, mh_settings)
 
-    if filter_method is 'kalman':
-        mh.run(kf)
-        output_path='../results/example1'
-    elif filter_method is 'particle':
-        output_path='../results/example2'
-        mh.run(pf)
+    if filter_method == 'kalman':
+        state_estimator = kf
+        default_output_path='../results/example1'
+    elif filter_method == 'particle':
+        state_estimator = pf
+        default_output_path='../results/example2'
     else:
         raise NameError("Unknown filter_method (kalman/particle).")
 
+    if output_path is None:
+        output_path = default_output_path
+    return sys_model, state_estimator, mh, output_path
+
+
+def run(mh_settings, cython_code=True, kf_settings=None, pf_settings=None,
+        filter_method='kalman', alg_type='mh0', sim_name='test', sim_desc=".",
+        seed_offset=0, output_path=None):
+
+    _, state_estimator, mh, output_path = setup(mh_settings, cython_code,
+                                                kf_settings, pf_settings,
+                                                filter_method, alg_type,
+                                                sim_name, sim_desc,
+                                                seed_offset, output_path)
+    mh.run(state_estimator)
+
     # Save to file
     mh.save_to_file(output_path=output_path,
                     sim_name=sim_name,
-                    sim_desc=sim_desc)
\ No newline at end of file
+                    sim_desc=sim_desc)
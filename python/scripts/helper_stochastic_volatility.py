@@ -24,8 +24,9 @@ from state.particle_methods.standard import ParticleMethods
 from parameter.mcmc.metropolis_hastings import MetropolisHastings
 
 
-def run(mh_version, mh_settings, pf_settings, cython_code=True, sim_name='test',
-        sim_desc='', seed_offset=0):
+def setup(mh_version, mh_settings, pf_settings, cython_code=True, sim_name='test',
+          sim_desc='', seed_offset=0, output_path='../results/example3'):
+    """ Returns the model, state estimator, MH algorithm and output path. """
 
     np.random.seed(87655678 + int(seed_offset))
 
@@ -54,9 +55,18 @@ def run(mh_version, mh_settings, pf_settings, cython_code=True, sim_name='test',
 
     # Metropolis-Hastings
     mh = MetropolisHastings(sys_model, mh_version, mh_settings)
+    return sys_model, pf, mh, output_path
+
+
+def run(mh_version, mh_settings, pf_settings, cython_code=True, sim_name='test',
+        sim_desc='', seed_offset=0, output_path='../results/example3'):
+
+    _, pf, mh, output_path = setup(mh_version, mh_settings, pf_settings,
+                                   cython_code, sim_name, sim_desc,
+                                   seed_offset, output_path)
     mh.run(pf)
 
-    mh.save_to_file(output_path='../results/example3',
+    mh.save_to_file(output_path=output_path,
                     sim_name=sim_name,
                     sim_desc=sim_desc)
 
@@ -0,0 +1,214 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Script for running the examples in parallel from a table of jobs."""
+import contextlib
+import importlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from helpers.file_system import ensure_dir
+from helpers.parallel import get_peak_memory
+
+EXAMPLES = {1: 'scripts.example1_lgss_kalman',
+            2: 'scripts.example2_lgss_particles',
+            3: 'scripts.example3_stochastic_volatility'}
+
+JOB_TABLE_FILE = '../results/experiments/job_table.json'
+
+# The last file written by save_to_file in the directory of a run
+OUTPUT_FILE = 'description.txt.gz'
+
+
+def build_job_table(examples, seed_offsets, alg_types=None):
+    """ Expands examples, MH algorithms and seeds into a list of jobs.
+
+        Args:
+            examples: the numbers of the examples (see EXAMPLES).
+            seed_offsets: the seed offsets (Monte Carlo runs) of each example.
+            alg_types: the MH variants to run (e.g. ('mh0', 'qmh')). If None,
+                       all runs of the examples are included.
+
+        Returns:
+            A list of jobs (dicts), where each job is identified by its
+            job_id and is one run given by get_runs of an example.
+
+    """
+    jobs = []
+    output_dirs = {}
+    for example in examples:
+        module = importlib.import_module(EXAMPLES[int(example)])
+        for seed_offset in seed_offsets:
+            runs = module.get_runs(seed_offset=int(seed_offset))
+            for run_index, run in enumerate(runs):
+                alg_type = run.get('alg_type', run.get('mh_version'))
+                if alg_types and alg_type not in alg_types:
+                    continue
+
+                output_dir = os.path.join(run['output_path'], run['sim_name'])
+                if output_dir in output_dirs:
+                    raise ValueError("The jobs " + output_dirs[output_dir] +
+                                     " and " + run['sim_name'] + " (seed offset " +
+                                     str(seed_offset) + ") write to the same " +
+                                     "directory: " + output_dir + ".")
+
+                job_id = 'example' + str(example) + '/' + run['sim_name']
+                output_dirs[output_dir] = job_id
+                jobs.append({'job_id': job_id,
+                             'example': int(example),
+                             'seed_offset': int(seed_offset),
+                             'run_index': run_index,
+                             'alg_type': alg_type,
+                             'output_dir': output_dir,
+                             'status': 'pending',
+                             'runtime': None,
+                             'peak_memory_mb': None,
+                             'finished': None,
+                             'error': None
+                             })
+    return jobs
+
+
+def load_job_table(file_name=JOB_TABLE_FILE):
+    """ Returns the jobs in a job table file as a dict (by job_id). """
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, 'r') as fin:
+        jobs = json.load(fin)['jobs']
+    return {job['job_id']: job for job in jobs}
+
+
+def save_job_table(jobs, file_name=JOB_TABLE_FILE):
+    """ Writes the jobs (a dict by job_id) to a job table file. """
+    ensure_dir(file_name)
+    tmp_file_name = file_name + '.tmp'
+    with open(tmp_file_name, 'w') as fout:
+        json.dump({'jobs': [jobs[job_id] for job_id in sorted(jobs)]}, fout, indent=2)
+    os.replace(tmp_file_name, file_name)
+
+
+def is_done(job):
+    """ Checks if the output of a job exists. """
+    return os.path.exists(os.path.join(job['output_dir'], OUTPUT_FILE))
+
+
+def run_experiments(examples, seed_offsets, no_workers=None, alg_types=None,
+                    job_table_file=JOB_TABLE_FILE, profile_iters=None):
+    """ Runs the jobs of the examples in a pool of worker processes.
+
+        The jobs (see build_job_table) are merged with the job table in
+        job_table_file, which is updated when each job is completed with
+        its status, runtime (wall-clock seconds) and the peak memory of its
+        worker process (in MB). Jobs with existing output are skipped, so an
+        interrupted experiment is resumed by running it again. The output
+        of each job is written to a log file next to the job table.
+
+        Args:
+            examples: the numbers of the examples (see EXAMPLES).
+            seed_offsets: the seed offsets (Monte Carlo runs) of each example.
+            no_workers: number of worker processes. (integer) If None, the
+                        number of cores is used.
+            alg_types: the MH variants to run. If None, all are run.
+            job_table_file: relative search path to the job table. (string)
+            profile_iters: the window of iterations to profile in each job
+                           (see the MH setting profile_iters). (tuple)
+
+        Returns:
+            The job table (dict by job_id).
+
+    """
+    if no_workers is None:
+        no_workers = multiprocessing.cpu_count()
+
+    table = load_job_table(job_table_file)
+    jobs = build_job_table(examples, seed_offsets, alg_types)
+    pending = []
+    for job in jobs:
+        if job['job_id'] in table:
+            job.update({key: table[job['job_id']][key]
+                        for key in ('status', 'runtime', 'peak_memory_mb', 'finished')})
+        if is_done(job):
+            job['status'] = 'done'
+        else:
+            job['status'] = 'pending'
+            pending.append(job)
+        table[job['job_id']] = job
+    save_job_table(table, job_table_file)
+
+    log_dir = os.path.join(os.path.dirname(job_table_file), 'logs')
+    tasks = [(job['job_id'], job['example'], job['seed_offset'], job['run_index'],
+              os.path.join(log_dir, job['job_id'].replace('/', '_') + '.log'),
+              profile_iters)
+             for job in pending]
+    print("Running " + str(len(tasks)) + " jobs (skipping " +
+          str(len(jobs) - len(tasks)) + " completed jobs) using " +
+          str(no_workers) + " workers.")
+    if not tasks:
+        return table
+
+    # A new process for each job so that the peak memory is per job
+    pool = multiprocessing.get_context('fork').Pool(processes=int(no_workers),
+                                                    maxtasksperchild=1)
+    try:
+        for i, result in enumerate(pool.imap_unordered(_run_job, tasks)):
+            table[result['job_id']].update(result)
+            save_job_table(table, job_table_file)
+            print("Job " + str(i + 1) + " of " + str(len(tasks)) + ": " +
+                  result['job_id'] + " " + result['status'] + " in " +
+                  "{:.1f}".format(result['runtime']) + " seconds.")
+    except KeyboardInterrupt:
+        print("Interrupted, run again to resume the remaining jobs.")
+        raise
+    finally:
+        pool.terminate()
+        pool.join()
+
+    no_failed = sum(1 for job in jobs if table[job['job_id']]['status'] == 'failed')
+    if no_failed > 0:
+        print(str(no_failed) + " jobs failed, see the log files in: " + log_dir + ".")
+    return table
+
+
+def _run_job(task):
+    """ Runs a job in a worker process and returns its status. """
+    job_id, example, seed_offset, run_index, log_file, profile_iters = task
+    module = importlib.import_module(EXAMPLES[example])
+    run = module.get_runs(seed_offset=seed_offset)[run_index]
+    if profile_iters is not None:
+        run['mh_settings']['profile_iters'] = tuple(profile_iters)
+
+    ensure_dir(log_file)
+    start_time = time.time()
+    error = None
+    with open(log_file, 'w') as fout, contextlib.redirect_stdout(fout):
+        try:
+            module.run_job(run)
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+
+    return {'job_id': job_id,
+            'status': 'done' if error is None else 'failed',
+            'runtime': time.time() - start_time,
+            'peak_memory_mb': get_peak_memory(),
+            'finished': time.strftime("%c"),
+            'error': error
+            }
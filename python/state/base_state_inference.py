@@ -18,6 +18,7 @@
 
 """The base state inference object."""
 
+import copy
 import numpy as np
 
 class BaseStateInference(object):
@@ -31,6 +32,7 @@ class BaseStateInference(object):
     gradient = []
     gradient_internal = []
     hessian_internal = []
+    batch_results = {}
 
     def __repr__(self):
         self.name
@@ -44,6 +46,10 @@ class BaseStateInference(object):
         gradient = {}
         gradient_internal = []
 
+        # Keep the estimates without the log-prior (used when combining models)
+        self.results.update({'log_like_gradient_estimate': np.array(gradient_estimate, dtype=float),
+                             'log_like_hessian_estimate': np.array(hessian_estimate, dtype=float)})
+
         i = 0
         for param in model.params.keys():
             if param in model.params_to_estimate:
@@ -70,3 +76,136 @@ class BaseStateInference(object):
             self.results.update({'gradient': gradient})
             idx = model.params_to_estimate_idx
             self.results.update({'hessian_internal': np.array(hessian_estimate[np.ix_(idx, idx)])})
+
+    def filter_batch(self, model, param_matrix):
+        """ Estimates the log-likelihood for a batch of parameters.
+
+            The default implementation runs the filter once for each
+            parameter vector. Estimators that can evaluate the batch in a
+            single vectorised pass override this method.
+
+            Args:
+                model: a model object (with data and inference model).
+                param_matrix: an array of size P x no_params_to_estimate with
+                              one parameter vector in each row. The order of
+                              the parameters is the same as in the list
+                              params_to_estimate.
+
+            Returns:
+                A dict with the array log_like of length P. It is also stored
+                in the attribute batch_results. The parameters in the model
+                are not changed.
+
+        """
+        return self._run_batch(model, param_matrix, run_smoother=False)
+
+    def smoother_batch(self, model, param_matrix):
+        """ Estimates the log-likelihood and gradients for a batch of parameters.
+
+            As filter_batch but runs the smoother. If estimate_gradient is set,
+            the stacked estimates log_joint_gradient_estimate (P x no_params),
+            log_joint_hessian_estimate (P x no_params x no_params),
+            gradient_internal (P x no_params_to_estimate) and hessian_internal
+            (P x no_params_to_estimate x no_params_to_estimate) are returned
+            as well.
+
+        """
+        return self._run_batch(model, param_matrix, run_smoother=True)
+
+    def _run_batch(self, model, param_matrix, run_smoother):
+        """ Runs a filter or smoother in a loop over a batch of parameters. """
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        no_batch = param_matrix.shape[0]
+        saved_params = self._save_model_params(model)
+
+        log_like = np.zeros(no_batch)
+        estimates = {'log_joint_gradient_estimate': [],
+                     'log_joint_hessian_estimate': [],
+                     'gradient_internal': [],
+                     'hessian_internal': []
+                    }
+
+        try:
+            for i in range(no_batch):
+                model.store_params(param_matrix[i, :])
+                if run_smoother:
+                    self.smoother(model)
+                else:
+                    self.filter(model)
+                log_like[i] = float(self.results['log_like'])
+                if run_smoother and self.settings['estimate_gradient']:
+                    for key in estimates:
+                        estimates[key].append(np.array(self.results[key], dtype=float))
+        finally:
+            self._restore_model_params(model, saved_params)
+
+        self.batch_results = {'params': param_matrix, 'log_like': log_like}
+        if run_smoother and self.settings['estimate_gradient']:
+            for key in estimates:
+                self.batch_results.update({key: np.array(estimates[key])})
+        return self.batch_results
+
+    def _store_batch_results(self, model, param_matrix, log_like,
+                             log_joint_gradient=None, log_joint_hessian=None):
+        """ Compiles the stacked estimates and inserts the log-prior
+            derivatives into the gradients and Hessians of each row (as in
+            _estimate_gradient_and_hessian for a single parameter). """
+        self.batch_results = {'params': param_matrix, 'log_like': log_like}
+        if log_joint_gradient is None:
+            return self.batch_results
+
+        no_batch = param_matrix.shape[0]
+        no_params = model.no_params_to_estimate
+        gradient_internal = np.zeros((no_batch, no_params))
+        hessian_internal = np.zeros((no_batch, no_params, no_params))
+        saved_params = self._save_model_params(model)
+        saved_results = self.results
+
+        try:
+            for i in range(no_batch):
+                model.store_params(param_matrix[i, :])
+                self.results = {'log_joint_gradient_estimate': np.array(log_joint_gradient[i]),
+                                'log_joint_hessian_estimate': np.array(log_joint_hessian[i])}
+                self._estimate_gradient_and_hessian(model)
+                gradient_internal[i, :] = self.results['gradient_internal']
+                hessian_internal[i, :, :] = self.results['hessian_internal']
+                log_joint_gradient[i] = self.results['log_joint_gradient_estimate']
+                log_joint_hessian[i] = self.results['log_joint_hessian_estimate']
+        finally:
+            self.results = saved_results
+            self._restore_model_params(model, saved_params)
+
+        self.batch_results.update({'log_joint_gradient_estimate': log_joint_gradient,
+                                   'log_joint_hessian_estimate': log_joint_hessian,
+                                   'gradient_internal': gradient_internal,
+                                   'hessian_internal': hessian_internal
+                                  })
+        return self.batch_results
+
+    @staticmethod
+    def _get_batch_param_matrix(model, param_matrix):
+        """ Returns the batch of parameters as a P x no_params_to_estimate array. """
+        param_matrix = np.array(param_matrix, dtype=float)
+        return param_matrix.reshape((-1, model.no_params_to_estimate))
+
+    @staticmethod
+    def _get_batch_all_params(model, param_matrix):
+        """ Returns all the parameters of the model (in the order of
+            model.params) for each row of the batch. """
+        saved_params = BaseStateInference._save_model_params(model)
+        all_params = np.zeros((param_matrix.shape[0], model.no_params))
+        try:
+            for i in range(param_matrix.shape[0]):
+                model.store_params(param_matrix[i, :])
+                all_params[i, :] = model.get_all_params()
+        finally:
+            BaseStateInference._restore_model_params(model, saved_params)
+        return all_params
+
+    @staticmethod
+    def _save_model_params(model):
+        return copy.deepcopy(model.params), copy.deepcopy(model.free_params)
+
+    @staticmethod
+    def _restore_model_params(model, saved_params):
+        model.params, model.free_params = saved_params
@@ -0,0 +1,143 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""State inference for hierarchical models."""
+import numpy as np
+
+from helpers.parallel import WorkerPool, get_worker_context
+from state.base_state_inference import BaseStateInference
+
+
+class HierarchicalStateInference(BaseStateInference):
+    """ State inference for hierarchical models.
+
+        Runs a state estimator (e.g. KalmanMethods or ParticleMethods) for
+        each series in a HierarchicalModel and combines the log-likelihoods,
+        gradients and Hessians into the estimates for the hierarchical model.
+        The series are processed concurrently in a persistent pool of worker
+        processes, which is created at the first call and reads the
+        observations from shared memory. Call close() to terminate the pool.
+
+        Args:
+            state_estimator: the state estimator to use for each series.
+            new_settings: a dict with the settings:
+                'no_workers': number of worker processes. (integer) If None,
+                              the number of cores is used and if 1, all series
+                              are processed in the current process.
+
+    """
+
+    def __init__(self, state_estimator, new_settings=None):
+        self.name = "Hierarchical state inference using " + state_estimator.name
+        self.state_estimator = state_estimator
+        self.settings = {'no_workers': None,
+                         'estimate_gradient': False
+                         }
+        if new_settings:
+            self.settings.update(new_settings)
+        self.results = {}
+        self.pool = None
+
+    def filter(self, model):
+        """Runs the filter for each series."""
+        self._run(model, run_smoother=False)
+
+    def smoother(self, model):
+        """Runs the smoother for each series."""
+        self._run(model, run_smoother=True)
+        if self.settings['estimate_gradient']:
+            self._estimate_gradient_and_hessian(model)
+
+    def close(self):
+        """Terminates the worker processes."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def _run(self, model, run_smoother):
+        """ Evaluates the series in the pool and combines the estimates. """
+        if self.pool is None:
+            no_workers = self.settings['no_workers']
+            if no_workers is None or no_workers > model.no_series:
+                no_workers = model.no_series
+            context = {'model': model, 'state_estimator': self.state_estimator}
+            self.pool = WorkerPool(context, no_workers)
+
+        estimate_gradient = run_smoother and self.settings['estimate_gradient']
+        tasks = []
+        for i in range(model.no_series):
+            tasks.append((i, model.get_series_params(i), run_smoother, estimate_gradient))
+        output = self.pool.map(_estimate_series, tasks)
+
+        param_names = list(model.params.keys())
+        no_params = len(param_names)
+        log_like = 0.0
+        gradient = np.zeros(no_params)
+        hessian = np.zeros((no_params, no_params))
+
+        for i in range(model.no_series):
+            log_like += output[i][0]
+            if not estimate_gradient:
+                continue
+
+            # Map the parameters of the series model into the hierarchical model
+            series_params = list(model.series_models[i].params.keys())
+            idx = []
+            series_idx = []
+            for j, param in enumerate(series_params):
+                if param in model.shared_params:
+                    idx.append(param_names.index(param))
+                    series_idx.append(j)
+                elif param in model.local_params:
+                    idx.append(param_names.index(model._local_name(param, i)))
+                    series_idx.append(j)
+            gradient[idx] += np.array(output[i][1])[series_idx]
+            hessian[np.ix_(idx, idx)] += np.array(output[i][2])[np.ix_(series_idx, series_idx)]
+
+        self.results.update({'log_like': log_like,
+                             'state_trajectory': np.zeros(model.no_obs + 1),
+                             'series_log_like': np.array([out[0] for out in output])
+                            })
+        if estimate_gradient:
+            self.results.update({'log_joint_gradient_estimate': gradient,
+                                 'log_joint_hessian_estimate': hessian
+                                })
+
+
+def _estimate_series(task):
+    """ Runs the state estimator for one series in a worker process. """
+    series, params, run_smoother, estimate_gradient = task
+    context = get_worker_context()
+    state_estimator = context['state_estimator']
+    model = context['model'].series_models[series]
+
+    model.params = params
+    model.transform_params_to_free()
+    state_estimator.settings['estimate_gradient'] = estimate_gradient
+
+    if run_smoother:
+        state_estimator.smoother(model)
+    else:
+        state_estimator.filter(model)
+
+    log_like = float(state_estimator.results['log_like'])
+    if not estimate_gradient:
+        return log_like, None, None
+    return (log_like,
+            np.array(state_estimator.results['log_like_gradient_estimate']),
+            np.array(state_estimator.results['log_like_hessian_estimate']))
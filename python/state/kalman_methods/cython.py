@@ -20,6 +20,8 @@
 import numpy as np
 
 from state.kalman_methods.cython_helper import kf_filter, rts_smoother
+from state.kalman_methods.cython_helper import kf_filter_batch, rts_smoother_batch
+from state.kalman_methods.cython_helper import kf_sensitivity
 from state.base_state_inference import BaseStateInference
 
 class KalmanMethodsCython(BaseStateInference):
@@ -29,7 +31,8 @@ class KalmanMethodsCython(BaseStateInference):
         self.name = "Kalman methods (Cython implementation)"
         self.settings = {'initial_state': 0.0,
                          'initial_cov': 1e-5,
-                         'estimate_gradient': False
+                         'estimate_gradient': False,
+                         'gradient_method': 'segal_weinstein'
                          }
         if new_settings:
             self.settings.update(new_settings)
@@ -52,7 +55,13 @@ class KalmanMethodsCython(BaseStateInference):
         self.results.update({'state_trajectory': np.zeros(model.no_obs+1)})
 
     def smoother(self, model):
-        """Kalman smoother."""
+        """Kalman smoother (see KalmanMethods.smoother for gradient_method)."""
+        if self.settings['estimate_gradient'] and \
+                self.settings['gradient_method'] == 'sensitivity':
+            self._sensitivity_filter(model)
+            self._estimate_gradient_and_hessian(model)
+            return
+
         self.name = "Kalman smoother (RTS)"
         obs = np.array(model.obs.flatten())
         params = model.get_all_params()
@@ -93,3 +102,56 @@ class KalmanMethodsCython(BaseStateInference):
         self.results.update({'state_trajectory': np.zeros(model.no_obs+1)})
 
         self._estimate_gradient_and_hessian(model)
+
+    def _sensitivity_filter(self, model):
+        """Kalman filter with sensitivity recursions for the exact score and
+        observed information matrix."""
+        self.name = "Kalman filter with sensitivity recursions"
+        obs = np.array(model.obs.flatten())
+        params = model.get_all_params()
+        xhatf, Pf, ll, grad, hess = kf_sensitivity(obs, mu=params[0], phi=params[1],
+                                                   sigmav=params[2], sigmae=params[3],
+                                                   initial_state=self.settings['initial_state'],
+                                                   initial_cov=self.settings['initial_cov'])
+
+        self.results.update({'filt_state_est': np.array(xhatf).reshape((model.no_obs+1, 1))})
+        self.results.update({'filt_state_cov': np.array(Pf).reshape((model.no_obs+1, 1))})
+        self.results.update({'log_like': float(ll)})
+        self.results.update({'log_joint_gradient_estimate': np.array(grad)})
+        self.results.update({'log_joint_hessian_estimate': np.array(hess)})
+        self.results.update({'state_trajectory': np.zeros(model.no_obs+1)})
+
+    def filter_batch(self, model, param_matrix):
+        """Kalman filter for a batch of parameters (loop inside Cython)."""
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        all_params = self._get_batch_all_params(model, param_matrix)
+        obs = np.array(model.obs.flatten())
+        log_like = kf_filter_batch(obs, np.ascontiguousarray(all_params),
+                                   initial_state=self.settings['initial_state'],
+                                   initial_cov=self.settings['initial_cov'])
+        return self._store_batch_results(model, param_matrix, np.array(log_like))
+
+    def smoother_batch(self, model, param_matrix):
+        """Kalman smoother for a batch of parameters (loop inside Cython)."""
+        if self.settings['gradient_method'] == 'sensitivity':
+            return super(KalmanMethodsCython, self).smoother_batch(model, param_matrix)
+
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        all_params = self._get_batch_all_params(model, param_matrix)
+        obs = np.array(model.obs.flatten())
+        log_like, grad = rts_smoother_batch(obs, np.ascontiguousarray(all_params),
+                                            initial_state=self.settings['initial_state'],
+                                            initial_cov=self.settings['initial_cov'])
+        if not self.settings['estimate_gradient']:
+            return self._store_batch_results(model, param_matrix, np.array(log_like))
+
+        # Compute estimates of gradients and Hessians
+        log_joint_gradient_estimate = np.sum(grad, axis=2)
+        part1 = np.einsum('bit,bjt->bij', grad, grad)
+        part2 = np.einsum('bi,bj->bij', log_joint_gradient_estimate,
+                          log_joint_gradient_estimate)
+        log_joint_hessian_estimate = part1 - part2 / model.no_obs
+
+        return self._store_batch_results(model, param_matrix, np.array(log_like),
+                                         log_joint_gradient_estimate,
+                                         log_joint_hessian_estimate)
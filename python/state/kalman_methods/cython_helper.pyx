@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 import cython
+import numpy as np
 
 from libc.stdlib cimport rand, RAND_MAX
 from libc.math cimport log, sqrt, exp, isfinite
@@ -74,7 +75,265 @@ def rts_smoother(double [:] obs, double mu, double phi, double sigmav, double si
     cdef double[NoObs] kalman_gain
     cdef double[4][NoObs] gradient_part
     cdef double log_like = 0.0
+
+    log_like = _rts_smoother(obs, mu, phi, sigmav, sigmae, initial_state, initial_cov,
+                             pred_state_est, pred_state_cov, filt_state_est,
+                             filt_state_cov, smo_state_est, smo_state_cov_twostep,
+                             smo_state_cov, smo_gain, kalman_gain, &gradient_part[0][0])
+
+    return pred_state_est, pred_state_cov, filt_state_est, filt_state_cov, log_like, smo_state_est, smo_state_cov, gradient_part
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def kf_sensitivity(double [:] obs, double mu, double phi, double sigmav, double sigmae,
+                   double initial_state, double initial_cov):
+    """Kalman filter with first- and second-order sensitivity recursions with
+    respect to (mu, atanh(phi), log(sigmav), log(sigmae)). Returns the
+    filtered states, the log-likelihood, the score and the negative Hessian."""
+
+    cdef double[NoObs] filt_state_est
+    cdef double[NoObs] filt_state_cov
+    cdef double log_like = 0.0
+
+    cdef double[4] gradient
+    cdef double[4][4] hessian
+
+    # Derivatives of the parameters with respect to the free parameters
+    cdef double[4] d_mu
+    cdef double[4] d_phi
+    cdef double[4] d_sigmav2
+    cdef double[4] d_sigmae2
+    cdef double[4][4] dd_phi
+    cdef double[4][4] dd_sigmav2
+    cdef double[4][4] dd_sigmae2
+
+    # Sensitivities of the filter
+    cdef double[4] d_state
+    cdef double[4] d_cov
+    cdef double[4] d_pred_state
+    cdef double[4] d_pred_cov
+    cdef double[4] d_obs_cov
+    cdef double[4] d_innovation
+    cdef double[4] d_gain
+    cdef double[4][4] dd_state
+    cdef double[4][4] dd_cov
+    cdef double[4][4] dd_pred_state
+    cdef double[4][4] dd_pred_cov
+    cdef double[4][4] dd_obs_cov
+    cdef double[4][4] dd_innovation
+    cdef double[4][4] dd_gain
+
+    cdef double sigmav2 = sigmav * sigmav
+    cdef double sigmae2 = sigmae * sigmae
+    cdef double state = 0.0
+    cdef double cov = 0.0
+    cdef double pred_state_est = 0.0
+    cdef double pred_state_cov = 0.0
+    cdef double pred_obs_cov = 0.0
+    cdef double innovation = 0.0
+    cdef double kalman_gain = 0.0
+    cdef int i
+    cdef int j
+    cdef int k
+
+    for j in range(4):
+        gradient[j] = 0.0
+        d_mu[j] = 0.0
+        d_phi[j] = 0.0
+        d_sigmav2[j] = 0.0
+        d_sigmae2[j] = 0.0
+        d_state[j] = 0.0
+        d_cov[j] = 0.0
+        for k in range(4):
+            hessian[j][k] = 0.0
+            dd_phi[j][k] = 0.0
+            dd_sigmav2[j][k] = 0.0
+            dd_sigmae2[j][k] = 0.0
+            dd_state[j][k] = 0.0
+            dd_cov[j][k] = 0.0
+
+    d_mu[0] = 1.0
+    d_phi[1] = 1.0 - phi * phi
+    dd_phi[1][1] = -2.0 * phi * (1.0 - phi * phi)
+    d_sigmav2[2] = 2.0 * sigmav2
+    dd_sigmav2[2][2] = 4.0 * sigmav2
+    d_sigmae2[3] = 2.0 * sigmae2
+    dd_sigmae2[3][3] = 4.0 * sigmae2
+
+    for i in range(NoObs):
+        filt_state_est[i] = 0.0
+        filt_state_cov[i] = 0.0
+    filt_state_est[0] = initial_state
+    filt_state_cov[0] = initial_cov
+
+    for i in range(1, NoObs):
+        state = filt_state_est[i-1]
+        cov = filt_state_cov[i-1]
+
+        # Prediction step
+        pred_state_est = mu + phi * (state - mu)
+        pred_state_cov = phi * phi * cov + sigmav2
+        pred_obs_cov = pred_state_cov + sigmae2
+        innovation = obs[i] - pred_state_est
+
+        for j in range(4):
+            d_pred_state[j] = (1.0 - phi) * d_mu[j] + (state - mu) * d_phi[j] + phi * d_state[j]
+            d_pred_cov[j] = 2.0 * phi * cov * d_phi[j] + phi * phi * d_cov[j] + d_sigmav2[j]
+            d_obs_cov[j] = d_pred_cov[j] + d_sigmae2[j]
+            d_innovation[j] = -d_pred_state[j]
+
+        for j in range(4):
+            for k in range(4):
+                dd_pred_state[j][k] = (state - mu) * dd_phi[j][k] + phi * dd_state[j][k]
+                dd_pred_state[j][k] += d_phi[j] * (d_state[k] - d_mu[k])
+                dd_pred_state[j][k] += d_phi[k] * (d_state[j] - d_mu[j])
+
+                dd_pred_cov[j][k] = 2.0 * cov * (d_phi[j] * d_phi[k] + phi * dd_phi[j][k])
+                dd_pred_cov[j][k] += 2.0 * phi * (d_phi[j] * d_cov[k] + d_phi[k] * d_cov[j])
+                dd_pred_cov[j][k] += phi * phi * dd_cov[j][k] + dd_sigmav2[j][k]
+
+                dd_obs_cov[j][k] = dd_pred_cov[j][k] + dd_sigmae2[j][k]
+                dd_innovation[j][k] = -dd_pred_state[j][k]
+
+        # Log-likelihood and its derivatives
+        log_like += norm_logpdf(obs[i], pred_state_est, sqrt(pred_obs_cov))
+
+        for j in range(4):
+            gradient[j] += -0.5 * d_obs_cov[j] / pred_obs_cov
+            gradient[j] += -innovation * d_innovation[j] / pred_obs_cov
+            gradient[j] += 0.5 * innovation * innovation * d_obs_cov[j] / (pred_obs_cov * pred_obs_cov)
+
+            for k in range(4):
+                hessian[j][k] += -0.5 * dd_obs_cov[j][k] / pred_obs_cov
+                hessian[j][k] += 0.5 * d_obs_cov[j] * d_obs_cov[k] / (pred_obs_cov * pred_obs_cov)
+                hessian[j][k] += -(d_innovation[j] * d_innovation[k] + innovation * dd_innovation[j][k]) / pred_obs_cov
+                hessian[j][k] += innovation * (d_innovation[j] * d_obs_cov[k] + d_obs_cov[j] * d_innovation[k]) / (pred_obs_cov * pred_obs_cov)
+                hessian[j][k] += 0.5 * innovation * innovation * dd_obs_cov[j][k] / (pred_obs_cov * pred_obs_cov)
+                hessian[j][k] += -innovation * innovation * d_obs_cov[j] * d_obs_cov[k] / (pred_obs_cov * pred_obs_cov * pred_obs_cov)
+
+        # Correction step
+        kalman_gain = pred_state_cov / pred_obs_cov
+        filt_state_est[i] = pred_state_est + kalman_gain * innovation
+        filt_state_cov[i] = (1.0 - kalman_gain) * pred_state_cov
+
+        for j in range(4):
+            d_gain[j] = (d_pred_cov[j] - kalman_gain * d_obs_cov[j]) / pred_obs_cov
+
+        for j in range(4):
+            for k in range(4):
+                dd_gain[j][k] = dd_pred_cov[j][k] - d_gain[j] * d_obs_cov[k] - d_gain[k] * d_obs_cov[j]
+                dd_gain[j][k] = (dd_gain[j][k] - kalman_gain * dd_obs_cov[j][k]) / pred_obs_cov
+
+                dd_state[j][k] = dd_pred_state[j][k] + innovation * dd_gain[j][k]
+                dd_state[j][k] += d_gain[j] * d_innovation[k] + d_gain[k] * d_innovation[j]
+                dd_state[j][k] += kalman_gain * dd_innovation[j][k]
+
+                dd_cov[j][k] = (1.0 - kalman_gain) * dd_pred_cov[j][k] - pred_state_cov * dd_gain[j][k]
+                dd_cov[j][k] -= d_gain[j] * d_pred_cov[k] + d_gain[k] * d_pred_cov[j]
+
+        for j in range(4):
+            d_state[j] = d_pred_state[j] + innovation * d_gain[j] + kalman_gain * d_innovation[j]
+            d_cov[j] = (1.0 - kalman_gain) * d_pred_cov[j] - pred_state_cov * d_gain[j]
+
+    for j in range(4):
+        for k in range(4):
+            hessian[j][k] = -hessian[j][k]
+
+    return filt_state_est, filt_state_cov, log_like, gradient, hessian
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def kf_filter_batch(double [:] obs, double [:, :] params, double initial_state,
+                    double initial_cov):
+    """Kalman filter for a batch of parameters. Each row of params contains
+    (mu, phi, sigmav, sigmae). Returns an array with the log-likelihoods."""
+    cdef int no_batch = params.shape[0]
+    cdef double[:] log_like = np.zeros(no_batch)
+
+    cdef double mu, phi, sigmav2, sigmae2
+    cdef double pred_state_est = 0.0
+    cdef double pred_state_cov = 0.0
+    cdef double filt_state_est = 0.0
+    cdef double filt_state_cov = 0.0
+    cdef double pred_obs_cov = 0.0
+    cdef double kalman_gain = 0.0
     cdef int i
+    cdef int k
+
+    for k in range(no_batch):
+        mu = params[k, 0]
+        phi = params[k, 1]
+        sigmav2 = params[k, 2] * params[k, 2]
+        sigmae2 = params[k, 3] * params[k, 3]
+
+        filt_state_est = initial_state
+        filt_state_cov = initial_cov
+
+        for i in range(1, NoObs):
+            # Prediction step
+            pred_state_est = mu + phi * (filt_state_est - mu)
+            pred_state_cov = phi * filt_state_cov * phi + sigmav2
+
+            # Correction step
+            pred_obs_cov = pred_state_cov + sigmae2
+            kalman_gain = pred_state_cov / pred_obs_cov
+            filt_state_est = pred_state_est + kalman_gain * (obs[i] - pred_state_est)
+            filt_state_cov = pred_state_cov - kalman_gain * pred_state_cov
+
+            log_like[k] += norm_logpdf(obs[i], pred_state_est, sqrt(pred_obs_cov))
+
+    return np.asarray(log_like)
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def rts_smoother_batch(double [:] obs, double [:, :] params, double initial_state,
+                       double initial_cov):
+    """Kalman filter and RTS smoother for a batch of parameters. Each row of
+    params contains (mu, phi, sigmav, sigmae). Returns arrays with the
+    log-likelihoods and the gradient contributions (batch x 4 x NoObs)."""
+    cdef int no_batch = params.shape[0]
+    cdef double[:] log_like = np.zeros(no_batch)
+    cdef double[:, :, :] gradient = np.zeros((no_batch, 4, NoObs))
+
+    cdef double[NoObs] pred_state_est
+    cdef double[NoObs] pred_state_cov
+    cdef double[NoObs] filt_state_est
+    cdef double[NoObs] filt_state_cov
+    cdef double[NoObs] smo_state_est
+    cdef double[NoObs] smo_state_cov_twostep
+    cdef double[NoObs] smo_state_cov
+    cdef double[NoObs] smo_gain
+    cdef double[NoObs] kalman_gain
+    cdef double[4][NoObs] gradient_part
+    cdef int i
+    cdef int j
+    cdef int k
+
+    for k in range(no_batch):
+        log_like[k] = _rts_smoother(obs, params[k, 0], params[k, 1], params[k, 2],
+                                    params[k, 3], initial_state, initial_cov,
+                                    pred_state_est, pred_state_cov, filt_state_est,
+                                    filt_state_cov, smo_state_est, smo_state_cov_twostep,
+                                    smo_state_cov, smo_gain, kalman_gain, &gradient_part[0][0])
+        for i in range(4):
+            for j in range(NoObs):
+                gradient[k, i, j] = gradient_part[i][j]
+
+    return np.asarray(log_like), np.asarray(gradient)
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+cdef double _rts_smoother(double [:] obs, double mu, double phi, double sigmav, double sigmae,
+                          double initial_state, double initial_cov,
+                          double *pred_state_est, double *pred_state_cov,
+                          double *filt_state_est, double *filt_state_cov,
+                          double *smo_state_est, double *smo_state_cov_twostep,
+                          double *smo_state_cov, double *smo_gain,
+                          double *kalman_gain, double *gradient_part):
+    """Kalman filter and RTS smoother writing into the given buffers. The
+    gradient contributions are stored as gradient_part[k * NoObs + i].
+    Returns the log-likelihood."""
+    cdef double log_like = 0.0
 
     cdef double scaled_innovation = 0.0
     cdef double cov_change = 0.0
@@ -93,9 +352,8 @@ def rts_smoother(double [:] obs, double mu, double phi, double sigmav, double si
     cdef double psi = 0.0
     cdef double quad_term = 0.0
     cdef double isigmav2 = 0.0
-
-    filt_state_est[0] = initial_state
-    filt_state_cov[0] = initial_cov
+    cdef int i
+    cdef int j
 
     for i in range(NoObs):
         pred_state_est[i] = 0.0
@@ -110,7 +368,10 @@ def rts_smoother(double [:] obs, double mu, double phi, double sigmav, double si
 
     for i in range(4):
         for j in range(NoObs):
-            gradient_part[i][j] = 0.0
+            gradient_part[i * NoObs + j] = 0.0
+
+    filt_state_est[0] = initial_state
+    filt_state_cov[0] = initial_cov
 
     # Filter
     for i in range(1, NoObs):
@@ -145,7 +406,7 @@ def rts_smoother(double [:] obs, double mu, double phi, double sigmav, double si
     two_step = (1.0 - kalman_gain[NoObs - 1]) * phi * filt_state_cov[NoObs - 1]
     smo_state_cov_twostep[NoObs - 1] = two_step
 
-    for i in range((NoObs - 1), 0, -1):
+    for i in range((NoObs - 2), 0, -1):
         term1 = filt_state_cov[i] * smo_gain[i-1]
         term2 = smo_gain[i-1] * smo_gain[i-1]
         term3 = smo_state_cov_twostep[i+1]
@@ -162,22 +423,22 @@ def rts_smoother(double [:] obs, double mu, double phi, double sigmav, double si
         quad_term = next_state - mu - phi * (cur_state - mu)
         isigmav2 = 1.0 / (sigmav * sigmav)
 
-        gradient_part[0][i] = isigmav2 * (1.0 - phi) * quad_term
+        gradient_part[0 * NoObs + i] = isigmav2 * (1.0 - phi) * quad_term
 
         term1 = isigmav2 * (1.0 - phi * phi)
         term2 = psi - phi * eta1
         term2 -= cur_state * mu * (1.0 - 2.0 * phi)
         term2 += - next_state * mu + mu * mu * (1.0 - phi)
-        gradient_part[1][i] = term1 * term2
+        gradient_part[1 * NoObs + i] = term1 * term2
 
         term1 = eta - 2 * phi * psi + phi * phi * eta1
         term2 = -2.0 * (next_state - phi * smo_state_est[i-1])
         term2 *= (1.0 - phi) * mu
         term3 = mu * mu * (1.0 - phi) * (1.0 - phi)
-        gradient_part[2][i] = isigmav2 * (term1 + term2 + term3) - 1.0
-        gradient_part[3][i] = 0.0
+        gradient_part[2 * NoObs + i] = isigmav2 * (term1 + term2 + term3) - 1.0
+        gradient_part[3 * NoObs + i] = 0.0
 
-    return pred_state_est, pred_state_cov, filt_state_est, filt_state_cov, log_like, smo_state_est, smo_state_cov, gradient_part
+    return log_like
 
 @cython.cdivision(True)
 @cython.boundscheck(False)
@@ -0,0 +1,293 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Square-root Kalman methods for multivariate linear Gaussian models."""
+import numpy as np
+from scipy.linalg import solve_triangular
+from state.base_state_inference import BaseStateInference
+
+
+class SquareRootKalmanMethods(BaseStateInference):
+    """ Square-root Kalman methods for multivariate linear Gaussian models.
+
+        The covariance matrices are propagated as lower Cholesky factors
+        which are updated using QR factorisations of the stacked factors
+        (array algorithms). This keeps the covariance matrices symmetric and
+        positive definite also for high-dimensional and badly conditioned
+        models. The model must provide the methods get_system_matrices and
+        get_system_matrix_derivatives, see MultivariateLinearGaussianModel.
+
+        The covariance recursions do not depend on the data for
+        time-invariant models. When the predictive covariance factor has
+        converged (the largest change is below settings['steady_state_tol']
+        relative to its size), the factors are frozen and the remaining time
+        steps only update the state estimates. Set the tolerance to None to
+        disable this.
+
+    """
+
+    def __init__(self, new_settings=None):
+        self.name = "Square-root Kalman methods"
+        self.settings = {'initial_state': 0.0,
+                         'initial_cov': 1e-5,
+                         'estimate_gradient': False,
+                         'steady_state_tol': 1e-10
+                         }
+        if new_settings:
+            self.settings.update(new_settings)
+
+    def filter(self, model):
+        """Square-root Kalman filter."""
+        self.name = "Square-root Kalman filter"
+        self._filter(model, store_cov_roots=False)
+
+    def smoother(self, model):
+        """ Square-root Kalman smoother (RTS).
+
+            The gradient of the log-likelihood is computed using Fisher's
+            identity from the smoothed marginals and lag-one covariances of
+            the states. The Hessian is estimated by the Segal-Weinstein
+            estimator as for the scalar Kalman smoother.
+
+        """
+        self._filter(model, store_cov_roots=True)
+        self.name = "Square-root Kalman smoother (RTS)"
+
+        system = model.get_system_matrices()
+        transition = system['transition']
+        state_cov_root = system['state_cov_root']
+        state_dim = transition.shape[0]
+
+        pred_state_est = self.results['pred_state_est']
+        filt_state_est = self.results['filt_state_est']
+        pred_cov_root = self.results['pred_state_cov_root']
+        filt_cov_root = self.results['filt_state_cov_root']
+        steady_state_time = self.results['steady_state_time']
+
+        smo_state_est = np.zeros((model.no_obs + 1, state_dim))
+        smo_cov_root = np.zeros((model.no_obs + 1, state_dim, state_dim))
+        smo_gain = np.zeros((model.no_obs, state_dim, state_dim))
+
+        smo_state_est[-1] = filt_state_est[-1]
+        smo_cov_root[-1] = filt_cov_root[-1]
+        identity = np.eye(state_dim)
+
+        for i in range((model.no_obs - 1), -1, -1):
+            # The smoother gain is constant when the filter is in steady-state
+            if steady_state_time and i > steady_state_time and i < model.no_obs - 1:
+                smo_gain[i] = smo_gain[i + 1]
+            else:
+                filt_cov = np.dot(filt_cov_root[i], filt_cov_root[i].T)
+                gain = np.dot(transition, filt_cov)
+                gain = solve_triangular(pred_cov_root[i + 1], gain, lower=True)
+                gain = solve_triangular(pred_cov_root[i + 1].T, gain, lower=False)
+                smo_gain[i] = gain.T
+
+            diff = smo_state_est[i + 1] - pred_state_est[i + 1]
+            smo_state_est[i] = filt_state_est[i] + np.dot(smo_gain[i], diff)
+
+            pre_array = np.hstack((np.dot(identity - np.dot(smo_gain[i], transition), filt_cov_root[i]),
+                                   np.dot(smo_gain[i], state_cov_root),
+                                   np.dot(smo_gain[i], smo_cov_root[i + 1])))
+            smo_cov_root[i] = _triangularise(pre_array)
+
+        self.results.update({'smo_state_est': smo_state_est,
+                             'smo_state_cov_root': smo_cov_root
+                             })
+
+        if self.settings['estimate_gradient']:
+            gradient_part = self._compute_gradient_parts(model, smo_state_est,
+                                                         smo_cov_root, smo_gain)
+            log_joint_gradient_estimate = np.sum(gradient_part, axis=1)
+
+            part1 = np.dot(gradient_part, gradient_part.T)
+            part2 = np.outer(log_joint_gradient_estimate, log_joint_gradient_estimate)
+            log_joint_hessian_estimate = part1 - part2 / model.no_obs
+
+            self.results.update({'log_joint_gradient_estimate': log_joint_gradient_estimate,
+                                 'log_joint_hessian_estimate': log_joint_hessian_estimate
+                                 })
+            self._estimate_gradient_and_hessian(model)
+
+    def _filter(self, model, store_cov_roots):
+        """ Runs the square-root Kalman filter.
+
+            The prediction step computes the factor of the predictive
+            covariance from [F S_f, S_q] and the correction step computes the
+            factor of the innovation covariance, the scaled gain and the
+            factor of the filtered covariance from a single QR factorisation
+            of the pre-array [[S_r, C S_p], [0, S_p]].
+
+        """
+        system = model.get_system_matrices()
+        state_mean = system['state_mean']
+        transition = system['transition']
+        state_cov_root = system['state_cov_root']
+        obs_matrix = system['obs_matrix']
+        obs_cov_root = system['obs_cov_root']
+        state_dim = transition.shape[0]
+        obs_dim = obs_matrix.shape[0]
+        obs = np.array(model.obs, dtype=float).reshape((model.no_obs + 1, obs_dim))
+        tolerance = self.settings['steady_state_tol']
+
+        pred_state_est = np.zeros((model.no_obs + 1, state_dim))
+        filt_state_est = np.zeros((model.no_obs + 1, state_dim))
+        if store_cov_roots:
+            pred_cov_roots = np.zeros((model.no_obs + 1, state_dim, state_dim))
+            filt_cov_roots = np.zeros((model.no_obs + 1, state_dim, state_dim))
+        log_like = 0.0
+        steady_state_time = None
+
+        filt_state_est[0] = self.settings['initial_state']
+        filt_cov_root = np.sqrt(self.settings['initial_cov']) * np.eye(state_dim)
+        pred_cov_root = np.zeros((state_dim, state_dim))
+        pre_array = np.zeros((obs_dim + state_dim, obs_dim + state_dim))
+        pre_array[0:obs_dim, 0:obs_dim] = obs_cov_root
+        if store_cov_roots:
+            filt_cov_roots[0] = filt_cov_root
+
+        for i in range(1, model.no_obs + 1):
+            # Prediction step
+            diff = filt_state_est[i - 1] - state_mean
+            pred_state_est[i] = state_mean + np.dot(transition, diff)
+
+            if steady_state_time is None:
+                last_pred_cov_root = pred_cov_root
+                pred_cov_root = _triangularise(np.hstack((np.dot(transition, filt_cov_root),
+                                                          state_cov_root)))
+
+                # Correction step (covariance factors)
+                pre_array[0:obs_dim, obs_dim:] = np.dot(obs_matrix, pred_cov_root)
+                pre_array[obs_dim:, obs_dim:] = pred_cov_root
+                post_array = _triangularise(pre_array)
+                innovation_cov_root = post_array[0:obs_dim, 0:obs_dim]
+                scaled_gain = post_array[obs_dim:, 0:obs_dim]
+                filt_cov_root = post_array[obs_dim:, obs_dim:]
+                log_det = 2.0 * np.sum(np.log(np.abs(np.diag(innovation_cov_root))))
+
+                if tolerance is not None and i > 1:
+                    change = np.max(np.abs(pred_cov_root - last_pred_cov_root))
+                    if change < tolerance * np.max(np.abs(pred_cov_root)):
+                        steady_state_time = i
+
+            # Correction step (state estimate)
+            innovation = obs[i] - np.dot(obs_matrix, pred_state_est[i])
+            scaled_innovation = solve_triangular(innovation_cov_root, innovation, lower=True)
+            filt_state_est[i] = pred_state_est[i] + np.dot(scaled_gain, scaled_innovation)
+
+            log_like += -0.5 * obs_dim * np.log(2.0 * np.pi) - 0.5 * log_det
+            log_like += -0.5 * np.sum(scaled_innovation**2)
+
+            if store_cov_roots:
+                pred_cov_roots[i] = pred_cov_root
+                filt_cov_roots[i] = filt_cov_root
+
+        self.results.update({'pred_state_est': pred_state_est,
+                             'filt_state_est': filt_state_est,
+                             'log_like': log_like,
+                             'steady_state_time': steady_state_time,
+                             'state_trajectory': np.zeros(model.no_obs+1)
+                             })
+        if store_cov_roots:
+            self.results.update({'pred_state_cov_root': pred_cov_roots,
+                                 'filt_state_cov_root': filt_cov_roots
+                                 })
+
+    def _compute_gradient_parts(self, model, smo_state_est, smo_cov_root, smo_gain):
+        """ Computes the gradient of the log joint distribution for each time.
+
+            Uses Fisher's identity, i.e. the expected value of the gradient of
+            the log joint distribution of states and observations with
+            respect to the smoothing distribution. The expected values of the
+            quadratic forms are computed from the smoothed means, covariances
+            and lag-one covariances for all time steps at once.
+
+            Returns:
+                An array (no_params x no_obs) with the contribution from the
+                state transition into x[t] and observation y[t] for each time
+                step t = 1, ..., no_obs.
+
+        """
+        system = model.get_system_matrices()
+        derivatives = model.get_system_matrix_derivatives()
+        state_mean = system['state_mean']
+        transition = system['transition']
+        obs_matrix = system['obs_matrix']
+        obs_dim = obs_matrix.shape[0]
+        obs = np.array(model.obs, dtype=float).reshape((model.no_obs + 1, obs_dim))
+
+        state_cov_inv = _cov_root_inverse(system['state_cov_root'])
+        obs_cov_inv = _cov_root_inverse(system['obs_cov_root'])
+
+        # Smoothed moments of the transition residuals r[t] = x[t+1] - a - F x[t]
+        smo_cov = np.matmul(smo_cov_root, np.transpose(smo_cov_root, (0, 2, 1)))
+        cur_state = smo_state_est[0:model.no_obs]
+        next_state = smo_state_est[1:]
+        cur_cov = smo_cov[0:model.no_obs]
+        next_cov = smo_cov[1:]
+        lag_one_cov = np.matmul(next_cov, np.transpose(smo_gain, (0, 2, 1)))
+
+        intercept = state_mean - np.dot(transition, state_mean)
+        residual = next_state - intercept - np.dot(cur_state, transition.T)
+        residual_cov = next_cov - np.matmul(lag_one_cov, transition.T)
+        residual_cov -= np.matmul(transition, np.transpose(lag_one_cov, (0, 2, 1)))
+        residual_cov += np.matmul(np.matmul(transition, cur_cov), transition.T)
+        residual_second = residual_cov + np.einsum('ti,tj->tij', residual, residual)
+        cross_second = np.transpose(lag_one_cov, (0, 2, 1)) - np.matmul(cur_cov, transition.T)
+        cross_second += np.einsum('ti,tj->tij', cur_state, residual)
+
+        # Smoothed moments of the observation residuals u[t] = y[t] - C x[t]
+        obs_residual = obs[1:] - np.dot(next_state, obs_matrix.T)
+        obs_second = np.matmul(np.matmul(obs_matrix, next_cov), obs_matrix.T)
+        obs_second += np.einsum('ti,tj->tij', obs_residual, obs_residual)
+
+        gradient_part = np.zeros((len(model.params), model.no_obs))
+        for i, param in enumerate(model.params.keys()):
+            derivative = derivatives[param]
+            d_state_cov = np.dot(state_cov_inv, derivative['state_cov'])
+            d_obs_cov = np.dot(obs_cov_inv, derivative['obs_cov'])
+            d_intercept = derivative['state_mean']
+            d_intercept = d_intercept - np.dot(transition, d_intercept)
+            d_intercept -= np.dot(derivative['transition'], state_mean)
+            d_transition = np.dot(state_cov_inv, derivative['transition'])
+
+            gradient_part[i] = -0.5 * np.trace(d_state_cov)
+            gradient_part[i] += 0.5 * np.einsum('ij,tji->t', np.dot(d_state_cov, state_cov_inv), residual_second)
+            gradient_part[i] += np.dot(residual, np.dot(state_cov_inv, d_intercept))
+            gradient_part[i] += np.einsum('ij,tji->t', d_transition, cross_second)
+            gradient_part[i] += -0.5 * np.trace(d_obs_cov)
+            gradient_part[i] += 0.5 * np.einsum('ij,tji->t', np.dot(d_obs_cov, obs_cov_inv), obs_second)
+
+        return gradient_part
+
+
+def _triangularise(pre_array):
+    """ Returns the lower triangular L with L L' = A A' for the pre-array A
+        (with at least as many columns as rows) using a QR factorisation. """
+    upper = np.linalg.qr(pre_array.T, mode='r')
+    lower = upper.T
+    signs = np.sign(np.diag(lower))
+    signs[signs == 0.0] = 1.0
+    return lower * signs
+
+
+def _cov_root_inverse(cov_root):
+    """ Returns the inverse of the covariance matrix given its lower
+        Cholesky factor. """
+    cov_root_inv = solve_triangular(cov_root, np.eye(cov_root.shape[0]), lower=True)
+    return np.dot(cov_root_inv.T, cov_root_inv)
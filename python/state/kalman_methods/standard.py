@@ -29,7 +29,8 @@ class KalmanMethods(BaseStateInference):
         self.name = "Kalman methods"
         self.settings = {'initial_state': 0.0,
                          'initial_cov': 1e-5,
-                         'estimate_gradient': False
+                         'estimate_gradient': False,
+                         'gradient_method': 'segal_weinstein'
                          }
         if new_settings:
             self.settings.update(new_settings)
@@ -55,24 +56,15 @@ class KalmanMethods(BaseStateInference):
 
         for i in range(1, model.no_obs + 1):
             # Prediction step
-            pred_state_est[i] = mu
-            pred_state_est[i] += phi * (filt_state_est[i - 1] - mu)
-            pred_state_cov[i] = phi * filt_state_cov[i - 1] * phi
-            pred_state_cov[i] += sigmav2
+            pred_state_est[i], pred_state_cov[i] = kalman_predict(filt_state_est[i - 1],
+                                                                  filt_state_cov[i - 1],
+                                                                  mu, phi, sigmav2)
 
             # Correction step
-            pred_obs_cov = pred_state_cov[i] + sigmae2
-            kalman_gain[i] = pred_state_cov[i] / pred_obs_cov
-
-            scaled_innovation = (model.obs[i] - pred_state_est[i])
-            scaled_innovation *= kalman_gain[i]
-            filt_state_est[i] = pred_state_est[i] + scaled_innovation
-            cov_change = kalman_gain[i] * pred_state_cov[i]
-            filt_state_cov[i] = pred_state_cov[i] - cov_change
-
-            mean = pred_state_est[i]
-            stdev = np.sqrt(pred_obs_cov)
-            log_like += norm.logpdf(model.obs[i], mean, stdev)
+            correction = kalman_correct(pred_state_est[i], pred_state_cov[i],
+                                        model.obs[i], 1.0, sigmae2)
+            filt_state_est[i], filt_state_cov[i], kalman_gain[i], obs_log_like = correction
+            log_like += obs_log_like
 
         self.results.update({'pred_state_est': pred_state_est,
                              'pred_state_cov': pred_state_cov,
@@ -84,7 +76,26 @@ class KalmanMethods(BaseStateInference):
                              })
 
     def smoother(self, model):
-        """Kalman smoother."""
+        """ Kalman smoother.
+
+            The gradient and Hessian of the log-likelihood are computed using
+            the method given by settings['gradient_method']:
+
+                'segal_weinstein': Fisher's identity using the RTS smoother
+                                   and the Segal-Weinstein estimator of the
+                                   Hessian.
+                'sensitivity': the exact score and observed information matrix
+                               computed by differentiating the Kalman filter
+                               recursions (see _sensitivity_filter). No
+                               smoothed states are computed in this case.
+
+        """
+        if self.settings['estimate_gradient'] and \
+                self.settings['gradient_method'] == 'sensitivity':
+            self._sensitivity_filter(model)
+            self._estimate_gradient_and_hessian(model)
+            return
+
         self.name = "Kalman smoother (RTS)"
         self.filter(model)
 
@@ -176,3 +187,276 @@ class KalmanMethods(BaseStateInference):
                              })
         if self.settings['estimate_gradient']:
             self._estimate_gradient_and_hessian(model)
+
+    def _sensitivity_filter(self, model):
+        """ Kalman filter with first- and second-order sensitivity recursions.
+
+            Propagates the derivatives of the filtered mean and variance with
+            respect to the free parameters (mu, atanh(phi), log(sigma_v),
+            log(sigma_e)) together with the filter. This gives the exact
+            gradient and negative Hessian (observed information matrix) of the
+            log-likelihood in a single forward pass with memory that does not
+            grow with the number of observations.
+
+        """
+        self.name = "Kalman filter with sensitivity recursions"
+
+        mu = model.params['mu']
+        phi = model.params['phi']
+        sigmav2 = model.params['sigma_v']**2
+        sigmae2 = model.params['sigma_e']**2
+        no_params = 4
+
+        # Derivatives of the parameters with respect to the free parameters
+        basis = np.eye(no_params)
+        d_mu = basis[0]
+        d_phi = (1.0 - phi**2) * basis[1]
+        dd_phi = -2.0 * phi * (1.0 - phi**2) * np.outer(basis[1], basis[1])
+        d_sigmav2 = 2.0 * sigmav2 * basis[2]
+        dd_sigmav2 = 4.0 * sigmav2 * np.outer(basis[2], basis[2])
+        d_sigmae2 = 2.0 * sigmae2 * basis[3]
+        dd_sigmae2 = 4.0 * sigmae2 * np.outer(basis[3], basis[3])
+
+        filt_state_est = np.zeros(model.no_obs + 1)
+        filt_state_cov = np.zeros(model.no_obs + 1)
+        filt_state_est[0] = self.settings['initial_state']
+        filt_state_cov[0] = self.settings['initial_cov']
+
+        d_state = np.zeros(no_params)
+        dd_state = np.zeros((no_params, no_params))
+        d_cov = np.zeros(no_params)
+        dd_cov = np.zeros((no_params, no_params))
+
+        log_like = 0.0
+        gradient = np.zeros(no_params)
+        hessian = np.zeros((no_params, no_params))
+
+        def sym_outer(x, y):
+            return np.outer(x, y) + np.outer(y, x)
+
+        for i in range(1, model.no_obs + 1):
+            # Prediction step
+            state = filt_state_est[i - 1]
+            pred_state_est = mu + phi * (state - mu)
+            d_pred_state = (1.0 - phi) * d_mu + (state - mu) * d_phi + phi * d_state
+            dd_pred_state = (state - mu) * dd_phi + phi * dd_state
+            dd_pred_state += sym_outer(d_phi, d_state - d_mu)
+
+            cov = filt_state_cov[i - 1]
+            pred_state_cov = phi**2 * cov + sigmav2
+            d_pred_cov = 2.0 * phi * cov * d_phi + phi**2 * d_cov + d_sigmav2
+            dd_pred_cov = 2.0 * cov * (np.outer(d_phi, d_phi) + phi * dd_phi)
+            dd_pred_cov += 2.0 * phi * sym_outer(d_phi, d_cov)
+            dd_pred_cov += phi**2 * dd_cov + dd_sigmav2
+
+            # Log-likelihood and its derivatives
+            pred_obs_cov = pred_state_cov + sigmae2
+            d_obs_cov = d_pred_cov + d_sigmae2
+            dd_obs_cov = dd_pred_cov + dd_sigmae2
+            innovation = float(model.obs[i]) - pred_state_est
+            d_innovation = -d_pred_state
+            dd_innovation = -dd_pred_state
+
+            log_like += -0.5 * np.log(2.0 * np.pi * pred_obs_cov)
+            log_like += -0.5 * innovation**2 / pred_obs_cov
+
+            gradient += -0.5 * d_obs_cov / pred_obs_cov
+            gradient += -innovation * d_innovation / pred_obs_cov
+            gradient += 0.5 * innovation**2 * d_obs_cov / pred_obs_cov**2
+
+            hessian += -0.5 * dd_obs_cov / pred_obs_cov
+            hessian += 0.5 * np.outer(d_obs_cov, d_obs_cov) / pred_obs_cov**2
+            hessian += -(np.outer(d_innovation, d_innovation) + innovation * dd_innovation) / pred_obs_cov
+            hessian += innovation * sym_outer(d_innovation, d_obs_cov) / pred_obs_cov**2
+            hessian += 0.5 * innovation**2 * dd_obs_cov / pred_obs_cov**2
+            hessian += -innovation**2 * np.outer(d_obs_cov, d_obs_cov) / pred_obs_cov**3
+
+            # Correction step
+            kalman_gain = pred_state_cov / pred_obs_cov
+            d_gain = (d_pred_cov - kalman_gain * d_obs_cov) / pred_obs_cov
+            dd_gain = dd_pred_cov - sym_outer(d_gain, d_obs_cov)
+            dd_gain = (dd_gain - kalman_gain * dd_obs_cov) / pred_obs_cov
+
+            filt_state_est[i] = pred_state_est + kalman_gain * innovation
+            d_state = d_pred_state + innovation * d_gain + kalman_gain * d_innovation
+            dd_state = dd_pred_state + innovation * dd_gain
+            dd_state += sym_outer(d_gain, d_innovation) + kalman_gain * dd_innovation
+
+            filt_state_cov[i] = (1.0 - kalman_gain) * pred_state_cov
+            d_cov = (1.0 - kalman_gain) * d_pred_cov - pred_state_cov * d_gain
+            dd_cov = (1.0 - kalman_gain) * dd_pred_cov - pred_state_cov * dd_gain
+            dd_cov -= sym_outer(d_gain, d_pred_cov)
+
+        self.results.update({'filt_state_est': filt_state_est,
+                             'filt_state_cov': filt_state_cov,
+                             'log_like': log_like,
+                             'state_trajectory': np.zeros(model.no_obs+1),
+                             'log_joint_gradient_estimate': gradient,
+                             'log_joint_hessian_estimate': -hessian
+                             })
+
+    def filter_batch(self, model, param_matrix):
+        """Kalman filter for a batch of parameters (vectorised over the batch)."""
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        all_params = self._get_batch_all_params(model, param_matrix)
+        filt = self._filter_batch(model, all_params)
+        return self._store_batch_results(model, param_matrix, filt['log_like'])
+
+    def smoother_batch(self, model, param_matrix):
+        """Kalman smoother for a batch of parameters (vectorised over the batch)."""
+        if self.settings['gradient_method'] == 'sensitivity':
+            return super(KalmanMethods, self).smoother_batch(model, param_matrix)
+
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        all_params = self._get_batch_all_params(model, param_matrix)
+        filt = self._filter_batch(model, all_params)
+
+        if not self.settings['estimate_gradient']:
+            return self._store_batch_results(model, param_matrix, filt['log_like'])
+
+        mu = all_params[:, 0]
+        phi = all_params[:, 1]
+        sigmav2 = all_params[:, 2]**2
+        no_batch = all_params.shape[0]
+
+        pred_state_est = filt['pred_state_est']
+        pred_state_cov = filt['pred_state_cov']
+        filt_state_est = filt['filt_state_est']
+        filt_state_cov = filt['filt_state_cov']
+        kalman_gain = filt['kalman_gain']
+
+        smo_gain = np.zeros((no_batch, model.no_obs + 1))
+        smo_state_cov_twostep = np.zeros((no_batch, model.no_obs + 1))
+        smo_state_est = np.zeros((no_batch, model.no_obs + 1))
+        smo_state_cov = np.zeros((no_batch, model.no_obs + 1))
+
+        smo_state_est[:, -1] = filt_state_est[:, -1]
+        smo_state_cov[:, -1] = filt_state_cov[:, -1]
+
+        for i in range((model.no_obs - 1), 0, -1):
+            smo_gain[:, i] = filt_state_cov[:, i] * phi / pred_state_cov[:, i + 1]
+            diff = smo_state_est[:, i + 1] - pred_state_est[:, i + 1]
+            smo_state_est[:, i] = filt_state_est[:, i] + smo_gain[:, i] * diff
+            diff = smo_state_cov[:, i + 1] - pred_state_cov[:, i + 1]
+            smo_state_cov[:, i] = filt_state_cov[:, i] + smo_gain[:, i]**2 * diff
+
+        # Calculate the two-step smoothing covariance
+        smo_state_cov_twostep[:, model.no_obs - 1] = (1 - kalman_gain[:, -1]) * phi * filt_state_cov[:, -1]
+        for i in range((model.no_obs - 1), 0, -1):
+            term1 = filt_state_cov[:, i] * smo_gain[:, i - 1]
+            term2 = smo_gain[:, i - 1]**2
+            term3 = smo_state_cov_twostep[:, i + 1]
+            term4 = phi * filt_state_cov[:, i]
+            smo_state_cov_twostep[:, i] = term1 + term2 * (term3 - term4)
+
+        # Gradient and Hessian estimation using Segal-Weinstein estimator
+        next_state = smo_state_est[:, 1:model.no_obs]
+        cur_state = smo_state_est[:, 0:(model.no_obs - 1)]
+        eta = next_state**2 + smo_state_cov[:, 1:model.no_obs]
+        eta1 = cur_state**2 + smo_state_cov[:, 0:(model.no_obs - 1)]
+        psi = cur_state * next_state + smo_state_cov_twostep[:, 1:model.no_obs]
+        mu = mu[:, np.newaxis]
+        phi = phi[:, np.newaxis]
+        isigmav2 = 1.0 / sigmav2[:, np.newaxis]
+        quad_term = next_state - mu - phi * (cur_state - mu)
+
+        gradient_part = np.zeros((no_batch, 4, model.no_obs))
+        gradient_part[:, 0, 1:] = isigmav2 * quad_term * (1.0 - phi)
+
+        term1 = isigmav2 * (1.0 - phi**2)
+        term2 = psi - phi * eta1
+        term2 -= cur_state * mu * (1.0 - 2.0 * phi)
+        term2 += -next_state * mu + mu**2 * (1.0 - phi)
+        gradient_part[:, 1, 1:] = term1 * term2
+
+        term1 = eta - 2 * phi * psi + phi**2 * eta1
+        term2 = -2.0 * (next_state - phi * cur_state) * (1.0 - phi) * mu
+        term3 = mu**2 * (1.0 - phi)**2
+        gradient_part[:, 2, 1:] = isigmav2 * (term1 + term2 + term3) - 1.0
+
+        log_joint_gradient_estimate = np.sum(gradient_part, axis=2)
+        part1 = np.einsum('bit,bjt->bij', gradient_part, gradient_part)
+        part2 = np.einsum('bi,bj->bij', log_joint_gradient_estimate,
+                          log_joint_gradient_estimate)
+        log_joint_hessian_estimate = part1 - part2 / model.no_obs
+
+        return self._store_batch_results(model, param_matrix, filt['log_like'],
+                                         log_joint_gradient_estimate,
+                                         log_joint_hessian_estimate)
+
+    def _filter_batch(self, model, all_params):
+        """Kalman filter with the batch of parameters as the first dimension."""
+        mu = all_params[:, 0]
+        phi = all_params[:, 1]
+        sigmav2 = all_params[:, 2]**2
+        sigmae2 = all_params[:, 3]**2
+        no_batch = all_params.shape[0]
+        obs = np.array(model.obs).flatten()
+
+        pred_state_est = np.zeros((no_batch, model.no_obs + 1))
+        pred_state_cov = np.zeros((no_batch, model.no_obs + 1))
+        filt_state_est = np.zeros((no_batch, model.no_obs + 1))
+        filt_state_cov = np.zeros((no_batch, model.no_obs + 1))
+        kalman_gain = np.zeros((no_batch, model.no_obs + 1))
+        log_like = np.zeros(no_batch)
+
+        filt_state_est[:, 0] = self.settings['initial_state']
+        filt_state_cov[:, 0] = self.settings['initial_cov']
+
+        for i in range(1, model.no_obs + 1):
+            # Prediction step
+            pred_state_est[:, i], pred_state_cov[:, i] = kalman_predict(filt_state_est[:, i - 1],
+                                                                        filt_state_cov[:, i - 1],
+                                                                        mu, phi, sigmav2)
+
+            # Correction step
+            correction = kalman_correct(pred_state_est[:, i], pred_state_cov[:, i],
+                                        obs[i], 1.0, sigmae2)
+            filt_state_est[:, i], filt_state_cov[:, i], kalman_gain[:, i], obs_log_like = correction
+            log_like += obs_log_like
+
+        return {'pred_state_est': pred_state_est,
+                'pred_state_cov': pred_state_cov,
+                'kalman_gain': kalman_gain,
+                'filt_state_est': filt_state_est,
+                'filt_state_cov': filt_state_cov,
+                'log_like': log_like
+                }
+
+
+def kalman_predict(filt_state_est, filt_state_cov, mean, transition, noise_var):
+    """ Prediction step of the Kalman filter for a scalar state.
+
+        The state dynamics are x[t+1] = mean + transition * (x[t] - mean) +
+        v[t] with Var(v[t]) = noise_var. All arguments can be arrays (e.g.
+        one element for each parameter in a batch or each particle in a
+        Rao-Blackwellised particle filter).
+
+        Returns:
+            The predicted state estimate and its covariance.
+
+    """
+    pred_state_est = mean + transition * (filt_state_est - mean)
+    pred_state_cov = transition * filt_state_cov * transition + noise_var
+    return pred_state_est, pred_state_cov
+
+
+def kalman_correct(pred_state_est, pred_state_cov, obs, obs_matrix, obs_noise_var):
+    """ Correction step of the Kalman filter for a scalar state.
+
+        The observation is y[t] = obs_matrix * x[t] + e[t] with Var(e[t]) =
+        obs_noise_var. All arguments can be arrays (see kalman_predict).
+
+        Returns:
+            The filtered state estimate, its covariance, the Kalman gain and
+            the log-density of the observation given the past observations.
+
+    """
+    pred_obs_est = obs_matrix * pred_state_est
+    pred_obs_cov = obs_matrix * pred_state_cov * obs_matrix + obs_noise_var
+    kalman_gain = pred_state_cov * obs_matrix / pred_obs_cov
+
+    filt_state_est = pred_state_est + kalman_gain * (obs - pred_obs_est)
+    filt_state_cov = pred_state_cov - kalman_gain * obs_matrix * pred_state_cov
+    log_like = norm.logpdf(obs, pred_obs_est, np.sqrt(pred_obs_cov))
+    return filt_state_est, filt_state_cov, kalman_gain, log_like
@@ -21,7 +21,7 @@ from __future__ import absolute_import
 import cython
 
 from libc.stdlib cimport rand, RAND_MAX
-from libc.math cimport log, sqrt, exp, isfinite
+from libc.math cimport log, sqrt, exp, floor, isfinite
 from libc.float cimport FLT_MAX
 from libc.stdlib cimport malloc, free
 
@@ -29,6 +29,8 @@ DEF FixedLag = 10
 DEF NoParticles = 1000
 DEF NoObs = 501
 DEF PI = 3.1415
+DEF NoTrajectories = 100
+DEF MaxRejectionAttempts = 10
 
 @cython.cdivision(True)
 @cython.boundscheck(False)
@@ -139,6 +141,137 @@ def bpf_lgss(double [:] obs, double mu, double phi, double sigmav, double sigmae
     # Compile the rest of the output
     return filt_state_est, log_like, state_trajectory
 
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def sqmc_lgss(double [:] obs, double mu, double phi, double sigmav, double sigmae):
+
+    # Initialise variables
+    cdef int *ancestry = <int *>malloc(NoParticles * NoObs * sizeof(int))
+    cdef int *old_ancestry = <int *>malloc(NoParticles * NoObs * sizeof(int))
+    cdef double *weights = <double *>malloc(NoParticles * NoObs * sizeof(double))
+    cdef double *particles = <double *>malloc(NoParticles * NoObs * sizeof(double))
+    cdef double *first_coord = <double *>malloc(NoParticles * sizeof(double))
+    cdef double *second_coord = <double *>malloc(NoParticles * sizeof(double))
+    cdef double *cum_weights = <double *>malloc(NoParticles * sizeof(double))
+    cdef IndexedValue *sorted_particles = <IndexedValue *>malloc(NoParticles * sizeof(IndexedValue))
+
+    cdef int[NoParticles] ancestors
+    cdef double[NoObs] filt_state_est
+    cdef double[NoObs] state_trajectory
+    cdef double[NoParticles] unnorm_weights
+    cdef double[NoParticles] shifted_weights
+    cdef double log_like = 0.0
+
+    # Define helpers
+    cdef double mean = 0.0
+    cdef double stDev = 0.0
+    cdef double max_weight = 0.0
+    cdef double norm_factor
+    cdef double foo_double
+    cdef int idx
+    cdef int cur_idx
+
+    # Define counters
+    cdef int i
+    cdef int j
+    cdef int k
+
+    # Pre-allocate variables
+    for i in range(NoObs):
+        filt_state_est[i] = 0.0
+        state_trajectory[i] = 0.0
+        for j in range(NoParticles):
+            ancestry[i + j * NoObs] = 0
+            old_ancestry[i + j * NoObs] = 0
+            particles[i + j * NoObs] = 0.0
+            weights[i + j * NoObs] = 0.0
+
+    # Generate initial state from a quasi-random point set
+    kronecker_point_set(first_coord, second_coord)
+    stDev = sigmav / sqrt(1.0 - (phi * phi))
+    for j in range(NoParticles):
+        particles[0 + j * NoObs] = mu + stDev * norm_ppf(second_coord[j])
+        weights[0 + j * NoObs] = 1.0 / NoParticles
+        ancestry[0 + j * NoObs] = j
+        filt_state_est[0] += weights[0 + j * NoObs] * particles[0 + j * NoObs]
+
+    for i in range(1, NoObs):
+
+        # Sort the particles and compute the empirical CDF in this order
+        for j in range(NoParticles):
+            sorted_particles[j].value = particles[i - 1 + j * NoObs]
+            sorted_particles[j].index = j
+        sort_particles(sorted_particles)
+
+        cum_weights[0] = weights[i - 1 + sorted_particles[0].index * NoObs]
+        for j in range(1, NoParticles):
+            cum_weights[j] = cum_weights[j-1] + weights[i - 1 + sorted_particles[j].index * NoObs]
+        for j in range(NoParticles):
+            cum_weights[j] /= cum_weights[NoParticles - 1]
+
+        # Resample particles using the (sorted) first coordinate of the points
+        kronecker_point_set(first_coord, second_coord)
+        cur_idx = 0
+        for j in range(NoParticles):
+            while cum_weights[cur_idx] < first_coord[j] and cur_idx < NoParticles - 1:
+                cur_idx += 1
+            ancestors[j] = sorted_particles[cur_idx].index
+
+        # Update ancestry
+        for k in range(i):
+            for j in range(NoParticles):
+                old_ancestry[k + j * NoObs] = ancestry[k + j * NoObs]
+
+        for j in range(NoParticles):
+            ancestry[i + j * NoObs] = ancestors[j]
+            for k in range(i):
+                ancestry[k + j * NoObs] = old_ancestry[k + ancestors[j] * NoObs]
+
+        # Propagate particles using the second coordinate of the points
+        for j in range(NoParticles):
+            mean = mu + phi * (particles[i - 1 + ancestors[j] * NoObs] - mu)
+            particles[i + j * NoObs] = mean + sigmav * norm_ppf(second_coord[j])
+
+        # Weight particles
+        for j in range(NoParticles):
+            unnorm_weights[j] = norm_logpdf(obs[i], particles[i + j * NoObs], sigmae)
+
+        max_weight = my_max(unnorm_weights)
+        norm_factor = 0.0
+        for j in range(NoParticles):
+            shifted_weights[j] = exp(unnorm_weights[j] - max_weight)
+            foo_double = norm_factor + shifted_weights[j]
+            if isfinite(foo_double) != 0:
+                norm_factor = foo_double
+
+        # Normalise weights and compute state filtering estimate
+        filt_state_est[i] = 0.0
+        for j in range(NoParticles):
+            weights[i + j * NoObs] = shifted_weights[j] / norm_factor
+            if isfinite(weights[i + j * NoObs] * particles[i + j * NoObs]) != 0:
+                filt_state_est[i] += weights[i + j * NoObs] * particles[i + j * NoObs]
+
+        # Estimate log-likelihood
+        log_like += max_weight + log(norm_factor) - log(NoParticles)
+
+    # Sample trajectory
+    idx = sampleParticle(weights)
+    for i in range(NoObs):
+        j = ancestry[i + idx * NoObs]
+        state_trajectory[i] = particles[i + j * NoObs]
+
+    free(particles)
+    free(weights)
+    free(ancestry)
+    free(old_ancestry)
+    free(first_coord)
+    free(second_coord)
+    free(cum_weights)
+    free(sorted_particles)
+
+    # Compile the rest of the output
+    return filt_state_est, log_like, state_trajectory
+
 @cython.cdivision(True)
 @cython.boundscheck(False)
 def flps_lgss(double [:] obs, double mu, double phi, double sigmav, double sigmae):
@@ -334,6 +467,176 @@ def flps_lgss(double [:] obs, double mu, double phi, double sigmav, double sigma
     # Compile the rest of the output
     return filt_state_est, smo_state_est, log_like, gradient, state_trajectory
 
+@cython.cdivision(True)
+@cython.boundscheck(False)
+def ffbsi_lgss(double [:] obs, double mu, double phi, double sigmav, double sigmae):
+
+    # Initialise variables
+    cdef int *ancestors = <int *>malloc(NoParticles * sizeof(int))
+    cdef int *trajectories = <int *>malloc(NoTrajectories * NoObs * sizeof(int))
+    cdef double *particles = <double *>malloc(NoObs * NoParticles * sizeof(double))
+    cdef double *weights = <double *>malloc(NoObs * NoParticles * sizeof(double))
+    cdef double *weights_at_t = <double *>malloc(NoParticles * sizeof(double))
+    cdef double *cum_weights = <double *>malloc(NoParticles * sizeof(double))
+    cdef double *unnorm_weights = <double *>malloc(NoParticles * sizeof(double))
+    cdef double *shifted_weights = <double *>malloc(NoParticles * sizeof(double))
+
+    cdef double[NoObs] filt_state_est
+    cdef double[NoObs] smo_state_est
+    cdef double[NoObs] state_trajectory
+
+    cdef double sub_gradient[4]
+    cdef double gradient[4][NoObs]
+
+    cdef double log_like = 0.0
+
+    # Define helpers
+    cdef double mean = 0.0
+    cdef double stDev = 0.0
+    cdef double max_weight = 0.0
+    cdef double norm_factor
+    cdef double foo_double
+    cdef int accepted
+
+    cdef double q_matrix = 1.0 / (sigmav * sigmav)
+    cdef double state_quad_term = 0.0
+    cdef double curr_particle = 0.0
+    cdef double next_particle = 0.0
+
+    # Define counters
+    cdef int i
+    cdef int j
+    cdef int k
+    cdef int m
+    cdef int idx
+
+    for i in range(NoObs):
+        filt_state_est[i] = 0.0
+        smo_state_est[i] = 0.0
+        state_trajectory[i] = 0.0
+        for j in range(NoParticles):
+            particles[i + j * NoObs] = 0.0
+            weights[i + j * NoObs] = 0.0
+        for m in range(NoTrajectories):
+            trajectories[i + m * NoObs] = 0
+
+    for k in range(4):
+        sub_gradient[k] = 0.0
+        for i in range(NoObs):
+            gradient[k][i] = 0.0
+
+    # Generate initial state
+    stDev = sigmav / sqrt(1.0 - (phi * phi))
+    for j in range(NoParticles):
+        particles[0 + j * NoObs] = mu + stDev * random_gaussian()
+        weights[0 + j * NoObs] = 1.0 / NoParticles
+        filt_state_est[0] += weights[0 + j * NoObs] * particles[0 + j * NoObs]
+
+    # Run the particle filter
+    for i in range(1, NoObs):
+
+        # Resample particles
+        for j in range(NoParticles):
+            weights_at_t[j] = weights[i - 1 + j * NoObs]
+        systematic(ancestors, weights_at_t)
+
+        # Propagate particles
+        for j in range(NoParticles):
+            curr_particle = particles[i - 1 + ancestors[j] * NoObs]
+            mean = mu + phi * (curr_particle - mu)
+            particles[i + j * NoObs] = mean + sigmav * random_gaussian()
+
+        # Weight particles
+        for j in range(NoParticles):
+            unnorm_weights[j] = norm_logpdf(obs[i], particles[i + j * NoObs], sigmae)
+
+        max_weight = my_max(unnorm_weights)
+        norm_factor = 0.0
+        for j in range(NoParticles):
+            shifted_weights[j] = exp(unnorm_weights[j] - max_weight)
+            foo_double = norm_factor + shifted_weights[j]
+            if isfinite(foo_double) != 0:
+                norm_factor = foo_double
+
+        # Normalise weights and compute state filtering estimate
+        for j in range(NoParticles):
+            weights[i + j * NoObs] = shifted_weights[j] / norm_factor
+            if isfinite(weights[i + j * NoObs] * particles[i + j * NoObs]) != 0:
+                filt_state_est[i] += weights[i + j * NoObs] * particles[i + j * NoObs]
+
+        # Estimate log-likelihood
+        log_like += max_weight + log(norm_factor) - log(NoParticles)
+
+    # Sample the final state of each trajectory
+    compute_cdf(cum_weights, weights, NoObs - 1)
+    for m in range(NoTrajectories):
+        trajectories[NoObs - 1 + m * NoObs] = sample_from_cdf(cum_weights)
+
+    # Simulate the trajectories backwards in time by rejection sampling
+    for i in range(NoObs - 2, -1, -1):
+        compute_cdf(cum_weights, weights, i)
+
+        for m in range(NoTrajectories):
+            next_particle = particles[i + 1 + trajectories[i + 1 + m * NoObs] * NoObs]
+            accepted = 0
+
+            for k in range(MaxRejectionAttempts):
+                idx = sample_from_cdf(cum_weights)
+                curr_particle = particles[i + idx * NoObs]
+                state_quad_term = next_particle - mu - phi * (curr_particle - mu)
+                if random_uniform() < exp(-0.5 * q_matrix * state_quad_term * state_quad_term):
+                    accepted = 1
+                    break
+
+            # Sample directly from the backward kernel
+            if accepted == 0:
+                norm_factor = 0.0
+                for j in range(NoParticles):
+                    curr_particle = particles[i + j * NoObs]
+                    state_quad_term = next_particle - mu - phi * (curr_particle - mu)
+                    shifted_weights[j] = weights[i + j * NoObs] * exp(-0.5 * q_matrix * state_quad_term * state_quad_term)
+                    norm_factor += shifted_weights[j]
+
+                if norm_factor > 0.0:
+                    foo_double = random_uniform() * norm_factor
+                    idx = 0
+                    norm_factor = shifted_weights[0]
+                    while norm_factor < foo_double and idx < NoParticles - 1:
+                        idx += 1
+                        norm_factor += shifted_weights[idx]
+
+            trajectories[i + m * NoObs] = idx
+
+    # Estimate the smoothed state and the gradients of the log joint distribution
+    for i in range(NoObs):
+        for m in range(NoTrajectories):
+            curr_particle = particles[i + trajectories[i + m * NoObs] * NoObs]
+            smo_state_est[i] += curr_particle / NoTrajectories
+
+            if i < NoObs - 1:
+                next_particle = particles[i + 1 + trajectories[i + 1 + m * NoObs] * NoObs]
+                state_quad_term = next_particle - mu - phi * (curr_particle - mu)
+                sub_gradient[0] = q_matrix * state_quad_term * (1.0 - phi)
+                sub_gradient[1] = q_matrix * state_quad_term * (curr_particle - mu) * (1.0 - phi**2)
+                sub_gradient[2] = q_matrix * state_quad_term * state_quad_term - 1.0
+                sub_gradient[3] = 0.0
+                for k in range(4):
+                    gradient[k][i] += sub_gradient[k] / NoTrajectories
+
+        state_trajectory[i] = particles[i + trajectories[i] * NoObs]
+
+    free(particles)
+    free(weights)
+    free(weights_at_t)
+    free(cum_weights)
+    free(ancestors)
+    free(trajectories)
+    free(unnorm_weights)
+    free(shifted_weights)
+
+    # Compile the rest of the output
+    return filt_state_est, smo_state_est, log_like, gradient, state_trajectory
+
 @cython.cdivision(True)
 @cython.boundscheck(False)
 cdef double norm_logpdf(double x, double m, double s):
@@ -433,4 +736,133 @@ cdef int sampleParticle(double weights[NoParticles]):
             cur_idx += 1
         else:
             break
-    return cur_idx
\ No newline at end of file
+    return cur_idx
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+cdef void compute_cdf(double *cum_weights, double *weights, int time_index):
+    """Helper for computing the empirical CDF of the weights at a time index."""
+    cdef int j = 0
+    cum_weights[0] = weights[time_index]
+    for j in range(1, NoParticles):
+        cum_weights[j] = cum_weights[j-1] + weights[time_index + j * NoObs]
+
+    for j in range(NoParticles):
+        cum_weights[j] /= cum_weights[NoParticles - 1]
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+cdef int sample_from_cdf(double *cum_weights):
+    """Helper for sampling an index from an empirical CDF by bisection."""
+    cdef double rnd_number = random_uniform()
+    cdef int lower = 0
+    cdef int upper = NoParticles - 1
+    cdef int middle = 0
+
+    while lower < upper:
+        middle = (lower + upper) // 2
+        if cum_weights[middle] < rnd_number:
+            lower = middle + 1
+        else:
+            upper = middle
+    return lower
+
+cdef struct IndexedValue:
+    double value
+    int index
+
+@cython.boundscheck(False)
+cdef void sift_down(IndexedValue *values, int start, int end):
+    """Helper for restoring the heap property in sort_particles."""
+    cdef int root = start
+    cdef int child
+    cdef IndexedValue foo_value
+
+    while 2 * root + 1 <= end:
+        child = 2 * root + 1
+        if child + 1 <= end and values[child].value < values[child + 1].value:
+            child += 1
+        if values[root].value < values[child].value:
+            foo_value = values[root]
+            values[root] = values[child]
+            values[child] = foo_value
+            root = child
+        else:
+            return
+
+@cython.boundscheck(False)
+cdef void sort_particles(IndexedValue *values):
+    """Helper for sorting the particles by their value (heapsort)."""
+    cdef int start = (NoParticles - 2) // 2
+    cdef int end = NoParticles - 1
+    cdef IndexedValue foo_value
+
+    while start >= 0:
+        sift_down(values, start, NoParticles - 1)
+        start -= 1
+
+    while end > 0:
+        foo_value = values[end]
+        values[end] = values[0]
+        values[0] = foo_value
+        end -= 1
+        sift_down(values, 0, end)
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+cdef void kronecker_point_set(double *first_coord, double *second_coord):
+    """Helper for generating the randomly shifted point set {(j / N, j * g)}
+    (modulo one), where g is the golden ratio conjugate, with the points
+    sorted by the first coordinate."""
+    cdef double shift_first = random_uniform() * NoParticles
+    cdef double shift_second = random_uniform()
+    cdef int offset = <int>shift_first
+    cdef int point_idx
+    cdef double foo_double
+    cdef int j
+
+    if offset >= NoParticles:
+        offset = NoParticles - 1
+    for j in range(NoParticles):
+        first_coord[j] = (j + shift_first - offset) / NoParticles
+        point_idx = (j - offset + NoParticles) % NoParticles
+        foo_double = point_idx * 0.6180339887498949 + shift_second
+        second_coord[j] = foo_double - floor(foo_double)
+
+@cython.cdivision(True)
+cdef double norm_ppf(double p):
+    """Helper for computing the inverse of the standard Gaussian CDF using the
+    rational approximation by Acklam (relative error below 1.2e-9)."""
+    cdef double q
+    cdef double r
+    cdef double p_low = 0.02425
+
+    if p <= 0.0:
+        p = 1e-16
+    if p >= 1.0:
+        p = 1.0 - 1e-16
+
+    if p < p_low:
+        q = sqrt(-2.0 * log(p))
+        return (((((-7.784894002430293e-03 * q - 3.223964580411365e-01) * q
+                   - 2.400758277161838e+00) * q - 2.549732539343734e+00) * q
+                 + 4.374664141464968e+00) * q + 2.938163982698783e+00) / \
+               ((((7.784695709041462e-03 * q + 3.224671290700398e-01) * q
+                  + 2.445134137142996e+00) * q + 3.754408661907416e+00) * q + 1.0)
+
+    if p > 1.0 - p_low:
+        q = sqrt(-2.0 * log(1.0 - p))
+        return -(((((-7.784894002430293e-03 * q - 3.223964580411365e-01) * q
+                    - 2.400758277161838e+00) * q - 2.549732539343734e+00) * q
+                  + 4.374664141464968e+00) * q + 2.938163982698783e+00) / \
+                ((((7.784695709041462e-03 * q + 3.224671290700398e-01) * q
+                   + 2.445134137142996e+00) * q + 3.754408661907416e+00) * q + 1.0)
+
+    q = p - 0.5
+    r = q * q
+    return (((((-3.969683028665376e+01 * r + 2.209460984245205e+02) * r
+               - 2.759285104469687e+02) * r + 1.383577518672690e+02) * r
+             - 3.066479806614716e+01) * r + 2.506628277459239e+00) * q / \
+           (((((-5.447609879822406e+01 * r + 1.615858368580409e+02) * r
+               - 1.556989798598866e+02) * r + 6.680131188771972e+01) * r
+             - 1.328068155288572e+01) * r + 1.0)
@@ -18,7 +18,7 @@
 
 """Particle methods."""
 import numpy as np
-from state.particle_methods.cython_sv_leverage_helper import bpf_sv, flps_sv
+from state.particle_methods.cython_sv_leverage_helper import bpf_sv, sqmc_sv, flps_sv, ffbsi_sv
 from state.base_state_inference import BaseStateInference
 
 class ParticleMethodsCythonSVLeverage(BaseStateInference):
@@ -29,35 +29,58 @@ class ParticleMethodsCythonSVLeverage(BaseStateInference):
         self.settings = {'no_particles': 100,
                          'resampling_method': 'systematic',
                          'fixed_lag': 0,
+                         'smoothing_method': 'fixed_lag',
                          'initial_state': 0.0,
                          'generate_initial_state': False,
                          'estimate_gradient': False,
-                         'estimate_hessian': False
+                         'estimate_hessian': False,
+                         'sqmc': False
                          }
         if new_settings:
             self.settings.update(new_settings)
 
     def filter(self, model):
-        """Bootstrap particle filter for SV model with leverage."""
-        self.name = "Bootstrap particle filter (Cython)"
+        """Bootstrap particle filter for SV model with leverage.
+
+            If the setting sqmc is True, the sequential quasi-Monte Carlo
+            filter is used instead.
+
+        """
+        if self.settings['sqmc']:
+            self.name = "Sequential quasi-Monte Carlo filter (Cython)"
+            particle_filter = sqmc_sv
+        else:
+            self.name = "Bootstrap particle filter (Cython)"
+            particle_filter = bpf_sv
         obs = np.array(model.obs.flatten())
         params = model.get_all_params()
-        xhatf, ll, xtraj = bpf_sv(obs, mu=params[0],
-                                  phi=params[1], sigmav=params[2], rho=params[3])
+        xhatf, ll, xtraj = particle_filter(obs, mu=params[0],
+                                           phi=params[1], sigmav=params[2], rho=params[3])
         self.results.update({'filt_state_est': np.array(xhatf).reshape((model.no_obs+1, 1))})
         self.results.update({'state_trajectory': np.array(xtraj).reshape((model.no_obs+1, 1))})
         self.results.update({'log_like': ll})
 
     def smoother(self, model):
-        """Fixed-lag particle smoother for SV model with leverage."""
-        self.name = "Fixed-lag particle smoother (Cython)"
+        """Fixed-lag or FFBSi particle smoother for SV model with leverage.
+
+            The smoother is selected by the setting smoothing_method
+            ('fixed_lag' or 'ffbsi'). The number of backward trajectories in
+            FFBSi is given by the constant NoTrajectories in the .pyx-file.
+
+        """
+        if self.settings['smoothing_method'] == 'ffbsi':
+            self.name = "Forward filtering backward simulation smoother (Cython)"
+            smoother = ffbsi_sv
+        else:
+            self.name = "Fixed-lag particle smoother (Cython)"
+            smoother = flps_sv
         obs = np.array(model.obs.flatten())
         params = model.get_all_params()
-        xhatf, xhats, ll, gradient, xtraj = flps_sv(obs,
-                                                    mu=params[0],
-                                                    phi=params[1],
-                                                    sigmav=params[2],
-                                                    rho=params[3])
+        xhatf, xhats, ll, gradient, xtraj = smoother(obs,
+                                                     mu=params[0],
+                                                     phi=params[1],
+                                                     sigmav=params[2],
+                                                     rho=params[3])
 
         # Compute estimate of gradient and Hessian
         gradient = np.array(gradient).reshape((model.no_params, model.no_obs+1))
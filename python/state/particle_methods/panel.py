@@ -0,0 +1,214 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Particle methods for a panel of independent series."""
+import numpy as np
+from state.particle_methods.standard import ParticleMethods
+
+
+class PanelParticleMethods(ParticleMethods):
+    """ Particle methods for a panel of independent series.
+
+        Runs the bootstrap particle filter (and the fixed-lag smoother) for S
+        independent series, each with its own parameters, in one pass over
+        the data. The particles are stored as an S x N array (flattened when
+        calling the model) and the parameters and observations of the model
+        are replaced by arrays with the values corresponding to each
+        particle. Hence, the model must support array-valued parameters
+        (as the stochastic volatility models do) and the panel must be
+        imported into the model using import_panel_data.
+
+        The fixed-lag smoother is run online using a buffer of the last
+        fixed_lag + 1 time steps, so the memory does not grow with the number
+        of observations. The Hessian is estimated using the Segal-Weinstein
+        estimator for each series.
+
+    """
+
+    def __init__(self, new_settings=None):
+        super(PanelParticleMethods, self).__init__()
+        self.name = "Panel particle methods"
+        self.settings.update({'fixed_lag': 10})
+        if new_settings:
+            self.settings.update(new_settings)
+
+    def filter_panel(self, model, param_matrix, series_idx=None):
+        """ Bootstrap particle filter for a panel of series.
+
+            Args:
+                model: a model object with a panel (see import_panel_data).
+                param_matrix: an array of size S x no_params_to_estimate with
+                              the parameters for each series. The order of
+                              the parameters is the same as in the list
+                              params_to_estimate.
+                series_idx: the indices of the series in model.panel_obs
+                            corresponding to the rows of param_matrix. If
+                            None, all series are used in order.
+
+            Returns:
+                A dict with the arrays log_like (S) and filt_state_est
+                (S x no_obs+1). It is also stored in the attribute
+                batch_results. The parameters in the model are not changed.
+
+        """
+        self.name = "Bootstrap particle filter (panel)"
+        return self._run_panel(model, param_matrix, series_idx, estimate_gradient=False)
+
+    def smoother_panel(self, model, param_matrix, series_idx=None):
+        """ Fixed-lag particle smoother for a panel of series.
+
+            As filter_panel but if estimate_gradient is set, the stacked
+            estimates log_joint_gradient_estimate, log_joint_hessian_estimate,
+            gradient_internal and hessian_internal are returned as well (see
+            smoother_batch).
+
+        """
+        self.name = "Bootstrap particle filter and fixed-lag particle smoother (panel)"
+        estimate_gradient = self.settings['estimate_gradient']
+        return self._run_panel(model, param_matrix, series_idx, estimate_gradient)
+
+    def filter_batch(self, model, param_matrix):
+        """ Runs filter_panel with one row of param_matrix for each series. """
+        return self.filter_panel(model, param_matrix)
+
+    def smoother_batch(self, model, param_matrix):
+        """ Runs smoother_panel with one row of param_matrix for each series. """
+        return self.smoother_panel(model, param_matrix)
+
+    def _run_panel(self, model, param_matrix, series_idx, estimate_gradient):
+        """ Runs the particle filter (and the online fixed-lag smoother). """
+        if model.no_series == 0:
+            raise ValueError("The model does not contain a panel, use import_panel_data.")
+
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        all_params = self._get_batch_all_params(model, param_matrix)
+        if series_idx is None:
+            series_idx = np.arange(model.no_series)
+        series_idx = np.array(series_idx, dtype=int).flatten()
+        if len(series_idx) != param_matrix.shape[0]:
+            raise ValueError("The panel requires one parameter vector for each series.")
+
+        no_series = len(series_idx)
+        no_obs = model.no_obs + 1
+        no_params = model.no_params
+        no_particles = self.settings['no_particles']
+        fixed_lag = int(self.settings['fixed_lag'])
+        if estimate_gradient and fixed_lag < 1:
+            raise ValueError("The panel smoother requires a fixed lag of at least one.")
+
+        buffer_length = fixed_lag + 1
+        particles = np.zeros((buffer_length, no_series * no_particles))
+        ancestors = np.zeros((buffer_length, no_series * no_particles), dtype=int)
+        weights = np.ones((no_series, no_particles)) / no_particles
+        filt_state_est = np.zeros((no_series, no_obs))
+        log_like = np.zeros(no_series)
+        gradient = np.zeros((no_series, no_params))
+        gradient_outer = np.zeros((no_series, no_params, no_params))
+
+        saved_params = self._save_model_params(model)
+        saved_obs = model.obs
+
+        try:
+            j = 0
+            for param in model.params.keys():
+                model.params[param] = np.repeat(all_params[:, j], no_particles)
+                j += 1
+            model.obs = np.repeat(model.panel_obs[:, series_idx], no_particles, axis=1)
+
+            # Generate or set initial state
+            if self.settings['generate_initial_state']:
+                initial_state = model.generate_initial_state(no_series * no_particles)
+                particles[0, :] = np.array(initial_state).flatten()
+            else:
+                particles[0, :] = self.settings['initial_state']
+            filt_state_est[:, 0] = np.mean(particles[0, :].reshape((no_series, no_particles)), axis=1)
+
+            for i in range(1, no_obs):
+                # Resample and propagate particles
+                new_ancestors = self._resample_batch(weights)
+                cur_particles = particles[(i - 1) % buffer_length, new_ancestors]
+                particles[i % buffer_length, :] = np.array(model.generate_state(cur_particles, i)).flatten()
+                ancestors[i % buffer_length, :] = new_ancestors
+
+                # Weight particles
+                unnormalised_weights = model.evaluate_obs(particles[i % buffer_length, :], i)
+                unnormalised_weights = unnormalised_weights.reshape((no_series, no_particles))
+
+                max_weight = np.max(unnormalised_weights, axis=1)
+                shifted_weights = np.exp(unnormalised_weights - max_weight[:, np.newaxis])
+                normalisation_factor = np.sum(shifted_weights, axis=1)
+                weights = shifted_weights / normalisation_factor[:, np.newaxis]
+
+                # Estimate log-likelihood and the filtered state
+                log_like += max_weight + np.log(normalisation_factor)
+                log_like -= np.log(no_particles)
+                cur_particles = particles[i % buffer_length, :].reshape((no_series, no_particles))
+                filt_state_est[:, i] = np.sum(weights * cur_particles, axis=1)
+
+                # Estimate the gradient at the time step which leaves the lag
+                if estimate_gradient and i >= fixed_lag:
+                    sub_gradient = self._estimate_gradient_panel(model, i - fixed_lag, i,
+                                                                 particles, ancestors, weights)
+                    gradient += sub_gradient
+                    gradient_outer += np.einsum('si,sj->sij', sub_gradient, sub_gradient)
+
+            # Estimate the gradient at the remaining time steps
+            if estimate_gradient:
+                for i in range(max(0, no_obs - fixed_lag), no_obs - 1):
+                    sub_gradient = self._estimate_gradient_panel(model, i, no_obs - 1,
+                                                                 particles, ancestors, weights)
+                    gradient += sub_gradient
+                    gradient_outer += np.einsum('si,sj->sij', sub_gradient, sub_gradient)
+        finally:
+            self._restore_model_params(model, saved_params)
+            model.obs = saved_obs
+
+        if estimate_gradient:
+            hessian = gradient_outer - np.einsum('si,sj->sij', gradient, gradient) / model.no_obs
+            self._store_batch_results(model, param_matrix, log_like, gradient, hessian)
+        else:
+            self._store_batch_results(model, param_matrix, log_like)
+
+        self.batch_results.update({'series_idx': series_idx,
+                                   'filt_state_est': filt_state_est
+                                  })
+        return self.batch_results
+
+    def _estimate_gradient_panel(self, model, time_index, lag, particles, ancestors, weights):
+        """ Estimates the gradient of the log joint distribution at time_index
+            for each series using the particles and weights at time lag. """
+        no_series, no_particles = weights.shape
+        buffer_length = particles.shape[0]
+
+        # Reconstruct particle trajectories
+        cur_ancestor = np.arange(no_series * no_particles)
+        for j in range(lag, time_index, -1):
+            next_ancestor = cur_ancestor
+            cur_ancestor = ancestors[j % buffer_length, cur_ancestor]
+
+        sub_grad = model.log_joint_gradient(particles[(time_index + 1) % buffer_length, next_ancestor],
+                                            particles[time_index % buffer_length, cur_ancestor],
+                                            time_index)
+
+        gradient = np.zeros((no_series, model.no_params))
+        j = 0
+        for param in sub_grad:
+            sub_grad_param = np.array(sub_grad[param]).reshape((no_series, no_particles))
+            gradient[:, j] = np.nansum(sub_grad_param * weights, axis=1)
+            j += 1
+        return gradient
@@ -0,0 +1,167 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Rao-Blackwellised particle methods."""
+import numpy as np
+from state.kalman_methods.standard import kalman_predict, kalman_correct
+from state.particle_methods.standard import ParticleMethods
+
+
+class RaoBlackwellisedParticleMethods(ParticleMethods):
+    """ Rao-Blackwellised (marginalised) particle methods.
+
+        For conditionally linear Gaussian models, where the state consists of
+        a non-linear part and a scalar linear part which is given by a linear
+        Gaussian model conditional on the non-linear part. The non-linear
+        state is estimated by the bootstrap particle filter and the linear
+        state is marginalised by running a Kalman filter for each particle
+        (vectorised over the particles). The particles are weighted by the
+        predictive density of the observation from the Kalman filter. This
+        reduces the variance of the log-likelihood estimate considerably
+        compared with running the particle filter on the full state.
+
+        The model must implement generate_initial_state, generate_state and
+        evaluate_state for the non-linear state (which cannot depend on the
+        linear state) and get_linear_system, which returns the linear
+        Gaussian model given the non-linear state (see
+        StochasticVolatilityModelTrend). The initial linear state is given by
+        the settings initial_linear_state and initial_linear_cov.
+
+        Only the filter is implemented, so the estimator can be used with
+        the MH algorithm without gradient information (mh0).
+
+    """
+
+    def __init__(self, new_settings=None):
+        super(RaoBlackwellisedParticleMethods, self).__init__()
+        self.name = "Rao-Blackwellised particle methods"
+        self.settings.update({'initial_linear_state': 0.0,
+                              'initial_linear_cov': 1.0
+                             })
+        if new_settings:
+            self.settings.update(new_settings)
+
+        if self.settings['estimate_gradient']:
+            raise ValueError("Gradient estimation is not implemented for " +
+                             "the Rao-Blackwellised particle filter.")
+
+    def filter(self, model):
+        """Rao-Blackwellised bootstrap particle filter"""
+        self.name = "Rao-Blackwellised bootstrap particle filter"
+        no_obs = model.no_obs + 1
+        no_particles = self.settings['no_particles']
+
+        if self.settings['verbose']:
+            print("")
+            print("Particle filter running with model parameters:")
+            print(["%.3f" % v for v in model.get_all_params()])
+
+        # Initalise variables
+        ancestors = np.zeros((no_particles, no_obs))
+        ancestors_resamp = np.zeros((no_particles, no_obs))
+        particles = np.zeros((no_particles, no_obs))
+        weights = np.zeros((no_particles, no_obs))
+        filt_state_est = np.zeros((no_obs, 1))
+        filt_linear_state_est = np.zeros((no_obs, 1))
+        filt_linear_state_cov = np.zeros((no_obs, 1))
+        log_like = np.zeros(no_obs)
+
+        # Generate or set initial state
+        if self.settings['generate_initial_state']:
+            particles[:, 0] = model.generate_initial_state(no_particles)
+        else:
+            particles[:, 0] = self.settings['initial_state']
+        weights[:, 0] = 1.0 / no_particles
+
+        linear_state_est = self.settings['initial_linear_state'] * np.ones(no_particles)
+        linear_state_cov = self.settings['initial_linear_cov'] * np.ones(no_particles)
+        filt_linear_state_est[0] = self.settings['initial_linear_state']
+        filt_linear_state_cov[0] = self.settings['initial_linear_cov']
+
+        for i in range(1, no_obs):
+            # Resample particles
+            new_ancestors = self._resample(weights[:, i-1])
+
+            ancestors_resamp[:, 0:(i-1)] = ancestors_resamp[new_ancestors, 0:(i-1)]
+            ancestors_resamp[:, i] = new_ancestors
+            ancestors[:, i] = new_ancestors
+
+            # Propagate particles
+            particles[:, i] = model.generate_state(particles[new_ancestors, i-1], i)
+
+            # Kalman filter for the linear state of each particle
+            system = model.get_linear_system(particles[:, i], i)
+            pred_state_est, pred_state_cov = kalman_predict(linear_state_est[new_ancestors],
+                                                            linear_state_cov[new_ancestors],
+                                                            system['mean'],
+                                                            system['transition'],
+                                                            system['state_var'])
+            correction = kalman_correct(pred_state_est, pred_state_cov, model.obs[i],
+                                        system['obs_matrix'], system['obs_var'])
+            linear_state_est, linear_state_cov, _, unnormalised_weights = correction
+
+            # Weight particles
+            max_weight = np.max(unnormalised_weights)
+            shifted_weights = np.exp(unnormalised_weights - max_weight)
+            normalisation_factor = np.sum(shifted_weights)
+            weights[:, i] = shifted_weights / normalisation_factor
+
+            # Estimate log-likelihood
+            log_like[i] = max_weight
+            log_like[i] += np.log(normalisation_factor)
+            log_like[i] -= np.log(no_particles)
+
+            # Estimate the filtered states
+            filt_state_est[i] = np.sum(weights[:, i] * particles[:, i])
+            filt_linear_state_est[i] = np.sum(weights[:, i] * linear_state_est)
+            second_moment = np.sum(weights[:, i] * (linear_state_cov + linear_state_est**2))
+            filt_linear_state_cov[i] = second_moment - filt_linear_state_est[i]**2
+
+        # Sample a trajectory
+        particle_index = np.random.choice(no_particles, 1, p=weights[:, -1])
+        ancestory_trajectory = ancestors_resamp[particle_index, -1].astype(int)
+        state_trajectory = particles[ancestory_trajectory, :]
+
+        # Compile the rest of the output
+        self.results.update({'filt_state_est': filt_state_est,
+                             'filt_linear_state_est': filt_linear_state_est,
+                             'filt_linear_state_cov': filt_linear_state_cov,
+                             'log_like': np.sum(log_like),
+                             'state_trajectory': state_trajectory
+                            })
+        self.particles = particles
+        self.weights = weights
+        self.ancestors = ancestors
+        self.ancestors_resamp = ancestors_resamp
+
+        if self.settings['verbose']:
+            print("Log-likelihood estimate is: " + str(self.results['log_like']))
+
+    def filter_batch(self, model, param_matrix):
+        """Runs the Rao-Blackwellised particle filter for each row of the batch."""
+        return self._run_batch(model, param_matrix, run_smoother=False)
+
+    def smoother(self, model):
+        """ Runs the filter (smoothing is not implemented for the
+            Rao-Blackwellised particle filter). The MH algorithm enables
+            estimate_gradient for mh1, mh2 and qmh when the run starts, so
+            these are rejected here before the first iteration. """
+        if self.settings['estimate_gradient']:
+            raise ValueError("Gradient estimation is not implemented for " +
+                             "the Rao-Blackwellised particle filter.")
+        self.filter(model)
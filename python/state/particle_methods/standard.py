@@ -18,13 +18,27 @@
 
 """Particle methods."""
 import numpy as np
+from scipy.stats import norm
+from helpers.quasi_random import kronecker_point_set
 from state.particle_methods.resampling import multinomial
 from state.particle_methods.resampling import stratified
 from state.particle_methods.resampling import systematic
 from state.base_state_inference import BaseStateInference
 
 class ParticleMethods(BaseStateInference):
-    """Particle methods."""
+    """ Particle methods.
+
+        If settings['sqmc'] is True, the filter (and the fixed-lag and FFBSi
+        smoothers which use it) is run as a sequential quasi-Monte Carlo
+        (SQMC) filter for models with a scalar state. The random numbers
+        used for resampling and propagation are replaced by a randomly
+        shifted low-discrepancy point set and the particles are sorted
+        before resampling (the Hilbert ordering in one dimension). This
+        reduces the variance of the log-likelihood estimate compared with
+        the bootstrap particle filter. The resampling method in the
+        settings is not used in this case.
+
+    """
 
     def __init__(self, new_settings=None):
         self.name = "Particle methods"
@@ -34,6 +48,11 @@ class ParticleMethods(BaseStateInference):
                          'initial_state': 0.0,
                          'generate_initial_state': False,
                          'estimate_gradient': False,
+                         'smoothing_method': 'fixed_lag',
+                         'paris_no_backward_samples': 2,
+                         'ffbsi_no_trajectories': 100,
+                         'max_rejection_attempts': 10,
+                         'sqmc': False,
                          'verbose': False
                          }
         if new_settings:
@@ -42,6 +61,8 @@ class ParticleMethods(BaseStateInference):
     def filter(self, model):
         """Bootstrap particle filter"""
         self.name = "Bootstrap particle filter"
+        if self.settings['sqmc']:
+            self.name = "Sequential quasi-Monte Carlo filter"
         no_obs = model.no_obs + 1
         no_particles = self.settings['no_particles']
 
@@ -59,7 +80,12 @@ class ParticleMethods(BaseStateInference):
         log_like = np.zeros(no_obs)
 
         # Generate or set initial state
-        if self.settings['generate_initial_state']:
+        if self.settings['generate_initial_state'] and self.settings['sqmc']:
+            _, uniforms = kronecker_point_set(no_particles)
+            particles[:, 0] = model.generate_initial_state(no_particles,
+                                                           norm.ppf(uniforms))
+            weights[:, 0] = 1.0 / no_particles
+        elif self.settings['generate_initial_state']:
             particles[:, 0] = model.generate_initial_state(no_particles)
             weights[:, 0] = 1.0 / no_particles
         else:
@@ -68,21 +94,19 @@ class ParticleMethods(BaseStateInference):
 
         for i in range(1, no_obs):
             # Resample particles
-            if self.settings['resampling_method'] is 'multinomial':
-                new_ancestors = multinomial(weights[:, i-1])
-            elif self.settings['resampling_method'] is 'stratified':
-                new_ancestors = stratified(weights[:, i-1])
-            elif self.settings['resampling_method'] is 'systematic':
-                new_ancestors = systematic(weights[:, i-1])
+            if self.settings['sqmc']:
+                new_ancestors, noise = self._resample_sqmc(particles[:, i-1],
+                                                           weights[:, i-1])
             else:
-                raise ValueError("Unknown resampling method selected...")
+                new_ancestors = self._resample(weights[:, i-1])
+                noise = None
 
             ancestors_resamp[:, 0:(i-1)] = ancestors_resamp[new_ancestors, 0:(i-1)]
             ancestors_resamp[:, i] = new_ancestors
             ancestors[:, i] = new_ancestors
 
             # Propagate particles
-            particles[:, i] = model.generate_state(particles[new_ancestors, i-1], i)
+            particles[:, i] = model.generate_state(particles[new_ancestors, i-1], i, noise)
 
             # Weight particles
             unnormalised_weights = model.evaluate_obs(particles[:, i], i)
@@ -118,7 +142,147 @@ class ParticleMethods(BaseStateInference):
         if self.settings['verbose']:
             print("Log-likelihood estimate is: " + str(self.results['log_like']))
 
+    def filter_batch(self, model, param_matrix):
+        """ Bootstrap particle filter for a batch of parameters.
+
+            Runs one particle system with P x N particles, where the
+            parameters of the model are replaced by arrays with the parameters
+            corresponding to each particle. Hence, the model must support
+            array-valued parameters in generate_initial_state, generate_state
+            and evaluate_obs. The particles are resampled within each block of
+            N particles.
+
+        """
+        self.name = "Bootstrap particle filter (batch)"
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        all_params = self._get_batch_all_params(model, param_matrix)
+        no_batch = param_matrix.shape[0]
+        no_obs = model.no_obs + 1
+        no_particles = self.settings['no_particles']
+        saved_params = self._save_model_params(model)
+
+        log_like = np.zeros(no_batch)
+        weights = np.ones((no_batch, no_particles)) / no_particles
+
+        try:
+            j = 0
+            for param in model.params.keys():
+                model.params[param] = np.repeat(all_params[:, j], no_particles)
+                j += 1
+
+            # Generate or set initial state
+            if self.settings['generate_initial_state']:
+                particles = model.generate_initial_state(no_batch * no_particles)
+                particles = np.array(particles).flatten()
+            else:
+                particles = np.ones(no_batch * no_particles)
+                particles *= self.settings['initial_state']
+
+            for i in range(1, no_obs):
+                # Resample and propagate particles
+                new_ancestors = self._resample_batch(weights)
+                particles = model.generate_state(particles[new_ancestors], i)
+                particles = np.array(particles).flatten()
+
+                # Weight particles
+                unnormalised_weights = model.evaluate_obs(particles, i)
+                unnormalised_weights = unnormalised_weights.reshape((no_batch, no_particles))
+
+                max_weight = np.max(unnormalised_weights, axis=1)
+                shifted_weights = np.exp(unnormalised_weights - max_weight[:, np.newaxis])
+                normalisation_factor = np.sum(shifted_weights, axis=1)
+                weights = shifted_weights / normalisation_factor[:, np.newaxis]
+
+                # Estimate log-likelihood
+                log_like += max_weight + np.log(normalisation_factor)
+                log_like -= np.log(no_particles)
+        finally:
+            self._restore_model_params(model, saved_params)
+
+        return self._store_batch_results(model, param_matrix, log_like)
+
+    def _resample_batch(self, weights):
+        """ Resamples each row of weights (batch x particles) using the method
+            given in the settings. Returns indices into the flattened array. """
+        no_batch, no_particles = weights.shape
+        if self.settings['resampling_method'] == 'multinomial':
+            uniforms = np.sort(np.random.uniform(size=(no_batch, no_particles)), axis=1)
+        elif self.settings['resampling_method'] == 'stratified':
+            uniforms = np.random.uniform(size=(no_batch, no_particles))
+            uniforms = (np.arange(no_particles) + uniforms) / no_particles
+        elif self.settings['resampling_method'] == 'systematic':
+            uniforms = np.random.uniform(size=(no_batch, 1))
+            uniforms = (np.arange(no_particles) + uniforms) / no_particles
+        else:
+            raise ValueError("Unknown resampling method selected...")
+
+        cum_weights = np.cumsum(weights, axis=1)
+        cum_weights /= cum_weights[:, -1][:, np.newaxis]
+        offset = np.arange(no_batch)[:, np.newaxis]
+        idx = np.searchsorted((cum_weights + offset).flatten(),
+                              (uniforms + offset).flatten())
+        last_idx = np.repeat((np.arange(no_batch) + 1) * no_particles - 1, no_particles)
+        return np.minimum(idx, last_idx)
+
     def smoother(self, model):
+        """ Particle smoother.
+
+            The smoother is selected by settings['smoothing_method']:
+
+                'fixed_lag': the fixed-lag particle smoother with the lag
+                             given by settings['fixed_lag'].
+                'paris': the forward-only PaRIS smoother of additive
+                         functionals with settings['paris_no_backward_samples']
+                         backward samples for each particle.
+                'ffbsi': the forward-filtering backward-simulation smoother
+                         with settings['ffbsi_no_trajectories'] trajectories.
+
+        """
+        if self.settings['smoothing_method'] == 'fixed_lag':
+            self._fixed_lag_smoother(model)
+        elif self.settings['smoothing_method'] == 'paris':
+            self._paris_smoother(model)
+        elif self.settings['smoothing_method'] == 'ffbsi':
+            self._ffbsi_smoother(model)
+        else:
+            raise ValueError("Unknown smoothing method selected...")
+
+    def _resample(self, weights):
+        """ Resamples particles using the method given in the settings. """
+        if self.settings['resampling_method'] == 'multinomial':
+            return multinomial(weights)
+        elif self.settings['resampling_method'] == 'stratified':
+            return stratified(weights)
+        elif self.settings['resampling_method'] == 'systematic':
+            return systematic(weights)
+        else:
+            raise ValueError("Unknown resampling method selected...")
+
+    @staticmethod
+    def _resample_sqmc(particles, weights):
+        """ Resampling step of the SQMC filter.
+
+            Draws a randomly shifted point set, sorts the particles and inverts
+            the empirical CDF of the sorted particles at the (sorted) first
+            coordinate of the points. The second coordinate is transformed
+            into the standard Gaussian noise used to propagate the particles.
+
+            Returns:
+                First value: the indices of the resampled particles.
+                Second value: the noise for each resampled particle.
+
+        """
+        no_particles = len(weights)
+        first_coord, second_coord = kronecker_point_set(no_particles)
+
+        order = np.argsort(particles)
+        cum_weights = np.cumsum(weights[order])
+        cum_weights /= cum_weights[-1]
+        idx = np.searchsorted(cum_weights, first_coord)
+        idx = np.minimum(idx, no_particles - 1)
+        return order[idx], norm.ppf(second_coord)
+
+    def _fixed_lag_smoother(self, model):
         """Fixed-lag particle smoother"""
         self.name = "Bootstrap particle filter and fixed-lag particle smoother."
         no_obs = model.no_obs + 1
@@ -188,3 +352,271 @@ class ParticleMethods(BaseStateInference):
         if self.settings['estimate_gradient']:
             self._estimate_gradient_and_hessian(model)
 
+    def _paris_smoother(self, model):
+        """ Forward-only smoother of additive functionals (PaRIS).
+
+            Runs the bootstrap particle filter and updates an estimate of the
+            gradient of the log joint distribution of states and observations
+            for each particle in a forward pass. Each update draws a small
+            number of indices from the backward kernel (proportional to the
+            filter weights times the transition density) by rejection sampling
+            using model.log_state_transition_bound. The cost is O(N * K) per
+            time step and only the current particles are stored, i.e., the
+            memory requirement of the gradient estimate is O(N).
+
+            The Hessian is estimated by the Segal-Weinstein estimator using
+            the increments of the gradient estimate between time steps. The
+            gradient and Hessian are only estimated if
+            settings['estimate_gradient'] is True.
+
+            The smoothed states are additive functionals as well. They are
+            updated in the same way for the latest settings['fixed_lag']
+            time steps and the estimate of each state is given when it
+            leaves this window (as in the fixed-lag smoother), so the memory
+            requirement is O(N * L) for lag L.
+
+        """
+        self.name = "Bootstrap particle filter and PaRIS particle smoother."
+        no_obs = model.no_obs + 1
+        no_params = model.no_params
+        no_particles = self.settings['no_particles']
+        no_backward_samples = self.settings['paris_no_backward_samples']
+        fixed_lag = self.settings['fixed_lag']
+        estimate_gradient = self.settings['estimate_gradient']
+
+        # Initalise variables
+        filt_state_est = np.zeros((no_obs, 1))
+        smo_state_est = np.zeros((no_obs, 1))
+        log_like = np.zeros(no_obs)
+        statistics = np.zeros((no_params, no_particles))
+        gradient_estimate = np.zeros(no_params)
+        gradient_outer_product = np.zeros((no_params, no_params))
+        log_joint_gradient_estimate = np.zeros(no_params)
+        log_joint_hessian_estimate = np.zeros((no_params, no_params))
+
+        # Generate or set initial state
+        if self.settings['generate_initial_state']:
+            particles = model.generate_initial_state(no_particles).flatten()
+        else:
+            particles = self.settings['initial_state'] * np.ones(no_particles)
+        weights = np.ones(no_particles) / no_particles
+        filt_state_est[0] = np.sum(weights * particles)
+
+        # Smoothed states in the window starting at window_start
+        state_statistics = particles.reshape((1, no_particles))
+        window_start = 0
+
+        for i in range(1, no_obs):
+            # Resample and propagate particles
+            ancestors = self._resample(weights)
+            new_particles = model.generate_state(particles[ancestors], i)
+            new_particles = np.array(new_particles).flatten()
+
+            # Update the statistics using samples from the backward kernel
+            backward_indices = self._sample_backward_indices(model,
+                                                             particles,
+                                                             weights,
+                                                             new_particles,
+                                                             i,
+                                                             no_backward_samples)
+            new_statistics = np.zeros((no_params, no_particles))
+            new_state_statistics = np.zeros(state_statistics.shape)
+            for k in range(no_backward_samples):
+                idx = backward_indices[:, k]
+                new_state_statistics += state_statistics[:, idx]
+                if estimate_gradient:
+                    sub_grad = model.log_joint_gradient(new_particles,
+                                                        particles[idx],
+                                                        i - 1)
+                    j = 0
+                    for param in sub_grad:
+                        new_statistics[j, :] += statistics[j, idx] + sub_grad[param]
+                        j += 1
+            statistics = new_statistics / no_backward_samples
+            state_statistics = np.vstack((new_state_statistics / no_backward_samples,
+                                          new_particles))
+            particles = new_particles
+
+            # Weight particles
+            unnormalised_weights = model.evaluate_obs(particles, i)
+
+            max_weight = np.max(unnormalised_weights)
+            shifted_weights = np.exp(unnormalised_weights - max_weight)
+            normalisation_factor = np.sum(shifted_weights)
+            weights = shifted_weights / normalisation_factor
+
+            # Estimate log-likelihood and the filtered state
+            log_like[i] = max_weight
+            log_like[i] += np.log(normalisation_factor)
+            log_like[i] -= np.log(no_particles)
+            filt_state_est[i] = np.sum(weights * particles)
+
+            # Estimate the smoothed states that leave the window
+            while i - window_start >= fixed_lag:
+                smo_state_est[window_start] = np.sum(weights * state_statistics[0, :])
+                state_statistics = state_statistics[1:, :]
+                window_start += 1
+
+            # Estimate the gradient and its increment
+            if estimate_gradient:
+                new_gradient_estimate = np.sum(statistics * weights, axis=1)
+                increment = new_gradient_estimate - gradient_estimate
+                gradient_outer_product += np.outer(increment, increment)
+                gradient_estimate = new_gradient_estimate
+
+        # Estimate the smoothed states remaining in the window
+        smo_state_est[window_start:, 0] = np.sum(weights * state_statistics, axis=1)
+
+        if estimate_gradient:
+            log_joint_gradient_estimate = gradient_estimate
+            part2 = np.outer(gradient_estimate, gradient_estimate)
+            log_joint_hessian_estimate = gradient_outer_product - part2 / no_obs
+
+        # No particle history is stored so no trajectory can be sampled
+        self.results.update({'filt_state_est': filt_state_est,
+                             'smo_state_est': smo_state_est,
+                             'log_like': np.sum(log_like),
+                             'state_trajectory': smo_state_est.flatten(),
+                             'log_joint_gradient_estimate': log_joint_gradient_estimate,
+                             'log_joint_hessian_estimate': log_joint_hessian_estimate
+                            })
+
+        if self.settings['estimate_gradient']:
+            self._estimate_gradient_and_hessian(model)
+
+    def _ffbsi_smoother(self, model):
+        """ Forward-filtering backward-simulation (FFBSi) particle smoother.
+
+            Runs the bootstrap particle filter and simulates M trajectories
+            backwards in time from the backward kernel. The indices are drawn
+            by rejection sampling using model.log_state_transition_bound,
+            which results in an expected cost of O(N + M * T). The smoothed
+            state and the gradient of the log joint distribution are estimated
+            by averaging over the trajectories. The Hessian is estimated by
+            the Segal-Weinstein estimator.
+
+        """
+        self.name = "Bootstrap particle filter and FFBSi particle smoother."
+        no_obs = model.no_obs + 1
+        no_params = model.no_params
+        no_trajectories = self.settings['ffbsi_no_trajectories']
+
+        self.filter(model)
+        particles = self.particles
+        weights = self.weights
+
+        # Initalise variables
+        trajectory_indices = np.zeros((no_trajectories, no_obs), dtype=int)
+        trajectories = np.zeros((no_trajectories, no_obs))
+        smo_gradient_est = np.zeros((no_params, no_obs))
+        log_joint_gradient_estimate = np.zeros(no_params)
+        log_joint_hessian_estimate = np.zeros((no_params, no_params))
+
+        # Sample the final state of each trajectory
+        cum_weights = np.cumsum(weights[:, -1])
+        cum_weights[-1] = 1.0
+        rnd_numbers = np.random.uniform(size=no_trajectories)
+        trajectory_indices[:, -1] = np.searchsorted(cum_weights, rnd_numbers)
+        trajectories[:, -1] = particles[trajectory_indices[:, -1], -1]
+
+        # Simulate the trajectories backwards in time
+        for i in range(no_obs - 2, -1, -1):
+            idx = self._sample_backward_indices(model,
+                                                particles[:, i],
+                                                weights[:, i],
+                                                trajectories[:, i + 1],
+                                                i + 1,
+                                                1)
+            trajectory_indices[:, i] = idx[:, 0]
+            trajectories[:, i] = particles[idx[:, 0], i]
+
+        smo_state_est = np.mean(trajectories, axis=0).reshape((no_obs, 1))
+
+        # Estimate gradient
+        if self.settings['estimate_gradient']:
+            for i in range(0, no_obs - 1):
+                sub_grad = model.log_joint_gradient(trajectories[:, i + 1],
+                                                    trajectories[:, i],
+                                                    i)
+                j = 0
+                for param in sub_grad:
+                    smo_gradient_est[j, i] = np.mean(sub_grad[param])
+                    j += 1
+
+            log_joint_gradient_estimate = np.sum(smo_gradient_est, axis=1)
+            part1 = np.matmul(smo_gradient_est, smo_gradient_est.transpose())
+            part2 = np.outer(log_joint_gradient_estimate,
+                             log_joint_gradient_estimate)
+            log_joint_hessian_estimate = part1 - part2 / no_obs
+
+        self.results.update({'smo_state_est': smo_state_est,
+                             'smo_state_trajectories': trajectories,
+                             'state_trajectory': trajectories[0, :],
+                             'log_joint_gradient_estimate': log_joint_gradient_estimate,
+                             'log_joint_hessian_estimate': log_joint_hessian_estimate
+                            })
+
+        if self.settings['estimate_gradient']:
+            self._estimate_gradient_and_hessian(model)
+
+    def _sample_backward_indices(self, model, particles, weights, next_particles,
+                                 time_step, no_samples):
+        """ Samples indices from the backward kernel.
+
+            Samples no_samples indices for each particle in next_particles
+            from the backward kernel by rejection sampling. The proposal is
+            the filter weights and the acceptance probability is the ratio
+            between the transition density and its upper bound. Samples which
+            are not accepted after settings['max_rejection_attempts'] attempts
+            are drawn from the backward kernel directly at the cost O(N).
+
+            Args:
+                model: a model object.
+                particles: particles at the previous time step. (array)
+                weights: normalised weights at the previous time step. (array)
+                next_particles: particles at the current time step. (array)
+                time_step: the current time step. (integer)
+                no_samples: number of samples per particle. (integer)
+
+            Returns:
+                An array of size len(next_particles) x no_samples with indices.
+
+        """
+        no_particles = len(particles)
+        no_next_particles = len(next_particles)
+        output = np.zeros(no_next_particles * no_samples, dtype=int)
+        pending = np.arange(no_next_particles * no_samples)
+        log_bound = model.log_state_transition_bound(time_step)
+
+        cum_weights = np.cumsum(weights)
+        cum_weights[-1] = 1.0
+
+        for i in range(self.settings['max_rejection_attempts']):
+            if len(pending) == 0:
+                break
+            candidates = np.searchsorted(cum_weights,
+                                         np.random.uniform(size=len(pending)))
+            targets = next_particles[pending // no_samples]
+            log_accept_prob = model.evaluate_state(targets,
+                                                   particles[candidates],
+                                                   time_step)
+            log_accept_prob = np.array(log_accept_prob).flatten() - log_bound
+            accepted = np.log(np.random.uniform(size=len(pending))) < log_accept_prob
+            output[pending[accepted]] = candidates[accepted]
+            pending = pending[~accepted]
+
+        if len(pending) > 0:
+            with np.errstate(divide='ignore'):
+                log_weights = np.log(weights)
+            targets = next_particles[pending // no_samples].reshape((-1, 1))
+            log_probs = model.evaluate_state(targets,
+                                             particles.reshape((1, -1)),
+                                             time_step)
+            log_probs = log_weights + np.array(log_probs)
+            log_probs -= np.max(log_probs, axis=1).reshape((-1, 1))
+            cum_probs = np.cumsum(np.exp(log_probs), axis=1)
+            rnd_numbers = np.random.uniform(size=(len(pending), 1))
+            rnd_numbers *= cum_probs[:, -1].reshape((-1, 1))
+            output[pending] = np.sum(cum_probs < rnd_numbers, axis=1)
+
+        return output.reshape((no_next_particles, no_samples))
@@ -0,0 +1,140 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""Tuning of the number of particles in the particle filter."""
+import time
+import numpy as np
+
+from helpers.parallel import run_in_pool, get_worker_context
+from state.particle_methods.standard import ParticleMethods
+
+
+def tune_no_particles(state_estimator, model, params=None,
+                      no_particles_grid=(100, 250, 500, 1000, 2000, 4000),
+                      no_repetitions=20, target_stdev=1.2, no_workers=None,
+                      seed=87655678):
+    """ Selects the number of particles from the log-likelihood variance.
+
+        Runs the particle filter no_repetitions times at a fixed (pilot)
+        parameter for each number of particles in no_particles_grid. The
+        standard deviation of the log-likelihood estimates is computed and
+        the smallest number of particles for which it is smaller than
+        target_stdev is selected. A standard deviation of about 1.0-1.5 is
+        optimal for pseudo-marginal MH algorithms. If no number of particles
+        in the grid reaches the target, the largest one is selected.
+
+        The filters are run in a pool of worker processes. The selected
+        number of particles is written into state_estimator.settings and the
+        complete results are stored in state_estimator.particle_tuning, which
+        is written into the settings output of a MH run using the estimator.
+        The parameters of the model are not changed.
+
+        Note that the Cython implementations of the particle methods have
+        the number of particles compiled into the code and cannot be tuned.
+
+        Args:
+            state_estimator: a ParticleMethods object.
+            model: a model object (with data and inference model).
+            params: the pilot parameters with the order as in
+                    params_to_estimate, e.g. the posterior mean from a short
+                    run or initial_params of the MH algorithm. (array) If
+                    None, the current parameters in the model are used.
+            no_particles_grid: numbers of particles to try. (list of integers)
+            no_repetitions: number of filters to run for each number of
+                            particles. (integer)
+            target_stdev: the target standard deviation. (float)
+            no_workers: number of worker processes. (integer)
+            seed: seed for the random number generators in the workers.
+
+        Returns:
+            A dict with the selected number of particles and the standard
+            deviation and computational time for each number of particles.
+
+    """
+    if not isinstance(state_estimator, ParticleMethods):
+        raise TypeError("Tuning the number of particles requires a " +
+                        "ParticleMethods object.")
+    if no_repetitions < 2:
+        raise ValueError("no_repetitions must be at least two.")
+
+    if params is None:
+        params = model.get_params()
+    params = np.array(params, dtype=float).reshape(-1)
+    no_particles_grid = np.sort(np.array(no_particles_grid, dtype=int))
+
+    tasks = []
+    for no_particles in no_particles_grid:
+        for i in range(no_repetitions):
+            tasks.append((int(no_particles), int(seed + len(tasks))))
+
+    # The filters are run in the current process if there is one worker
+    saved_params = state_estimator._save_model_params(model)
+    saved_no_particles = state_estimator.settings['no_particles']
+    context = {'state_estimator': state_estimator,
+               'model': model,
+               'params': params}
+    try:
+        output = run_in_pool(_estimate_log_likelihood, tasks, context, no_workers)
+    finally:
+        state_estimator._restore_model_params(model, saved_params)
+        state_estimator.settings['no_particles'] = saved_no_particles
+    output = np.array(output).reshape((len(no_particles_grid), no_repetitions, 2))
+
+    log_like_stdev = np.std(output[:, :, 0], axis=1, ddof=1)
+    time_per_filter = np.mean(output[:, :, 1], axis=1)
+
+    idx = np.where(log_like_stdev <= target_stdev)[0]
+    if len(idx) > 0:
+        selected = int(no_particles_grid[idx[0]])
+    else:
+        selected = int(no_particles_grid[-1])
+        print("No number of particles in the grid results in a standard " +
+              "deviation of the log-likelihood below {:.2f}.".format(target_stdev))
+
+    print("Tuning of the number of particles:")
+    for i in range(len(no_particles_grid)):
+        print("N: {}, stdev of log-likelihood: {:.3f}, time per filter: {:.3f}s."
+              .format(no_particles_grid[i], log_like_stdev[i], time_per_filter[i]))
+    print("Selected {} particles.".format(selected))
+
+    state_estimator.settings['no_particles'] = selected
+    state_estimator.particle_tuning = {'no_particles': selected,
+                                       'pilot_params': params.tolist(),
+                                       'target_stdev': target_stdev,
+                                       'no_repetitions': no_repetitions,
+                                       'no_particles_grid': no_particles_grid.tolist(),
+                                       'log_like_stdev': log_like_stdev.tolist(),
+                                       'time_per_filter': time_per_filter.tolist()
+                                      }
+    return state_estimator.particle_tuning
+
+
+def _estimate_log_likelihood(task):
+    """ Runs the particle filter once in a worker process. """
+    no_particles, seed = task
+    context = get_worker_context()
+    state_estimator = context['state_estimator']
+    model = context['model']
+
+    np.random.seed(seed)
+    state_estimator.settings['no_particles'] = no_particles
+    model.store_params(context['params'])
+
+    start_time = time.time()
+    state_estimator.filter(model)
+    return float(state_estimator.results['log_like']), time.time() - start_time
@@ -0,0 +1,100 @@
+###############################################################################
+#    Constructing Metropolis-Hastings proposals using damped BFGS updates
+#    Copyright (C) 2018  Johan Dahlin < uni (at) johandahlin [dot] com >
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###############################################################################
+
+"""State inference using remote worker servers."""
+import numpy as np
+
+from helpers.worker_service import WorkerClient, GRADIENT_KEYS
+from state.base_state_inference import BaseStateInference
+
+
+class RemoteStateInference(BaseStateInference):
+    """ State inference using remote worker servers.
+
+        Implements filter, smoother, filter_batch and smoother_batch by
+        sending the parameters of the model to worker servers (see
+        helpers/worker_service.py), which run a state estimator for their
+        own copy of the model. Hence, it can be used as the state estimator
+        in e.g. MetropolisHastings. The batches are split over the servers,
+        so filter_batch and smoother_batch (used in the ensemble and the
+        tempered SMC sampler) evaluate the parameters concurrently.
+
+        Args:
+            addresses: list of (host, port) of the servers.
+            new_settings: a dict with the settings:
+                'estimate_gradient': should the gradient and Hessian be
+                                     estimated by the smoother. (boolean)
+                'timeout': timeout for socket operations in seconds. (float)
+
+    """
+
+    def __init__(self, addresses, new_settings=None):
+        self.settings = {'estimate_gradient': False,
+                         'timeout': None
+                         }
+        if new_settings:
+            self.settings.update(new_settings)
+        self.client = WorkerClient(addresses, self.settings['timeout'])
+        self.name = "Remote state inference using " + \
+                    self.client.ping()[0]['name']
+        self.results = {}
+        self.batch_results = {}
+
+    def filter(self, model):
+        """Runs the filter in a worker server."""
+        self._run(model, run_smoother=False)
+
+    def smoother(self, model):
+        """Runs the smoother in a worker server."""
+        self._run(model, run_smoother=True)
+
+    def filter_batch(self, model, param_matrix):
+        """ Estimates the log-likelihood for a batch of parameters, which is
+            split over the worker servers. """
+        return self._run_remote_batch(model, param_matrix, run_smoother=False)
+
+    def smoother_batch(self, model, param_matrix):
+        """ As filter_batch but runs the smoother. """
+        return self._run_remote_batch(model, param_matrix, run_smoother=True)
+
+    def close(self):
+        """Closes the connections to the servers."""
+        self.client.close()
+
+    def _run(self, model, run_smoother):
+        """ Evaluates the current parameters of the model. """
+        estimate_gradient = run_smoother and self.settings['estimate_gradient']
+        output = self.client.evaluate(model.get_params(), run_smoother, estimate_gradient)
+
+        self.results.update({'log_like': float(output['log_like'][0]),
+                             'state_trajectory': output['state_trajectory'][0].reshape((model.no_obs + 1, 1))})
+        if estimate_gradient:
+            for key in GRADIENT_KEYS:
+                self.results.update({key: np.array(output[key][0])})
+
+    def _run_remote_batch(self, model, param_matrix, run_smoother):
+        """ Evaluates a batch of parameters in the worker servers. """
+        param_matrix = self._get_batch_param_matrix(model, param_matrix)
+        estimate_gradient = run_smoother and self.settings['estimate_gradient']
+        output = self.client.evaluate(param_matrix, run_smoother, estimate_gradient)
+
+        self.batch_results = {'params': param_matrix, 'log_like': output['log_like']}
+        if estimate_gradient:
+            for key in GRADIENT_KEYS:
+                self.batch_results.update({key: output[key]})
+        return self.batch_results